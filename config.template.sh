@@ -79,4 +79,12 @@ DEPLOYED_INDEX_DEDICATED_MACHINE_TYPE="e2-standard-16"  # Machine type for dedic
 # PEERING_PREFIX_LENGTH="16"
 
 # Locust worker scaling configuration
-# MIN_REPLICAS_WORKER=10  # Minimum number of Locust worker replicas (default: 10)
\ No newline at end of file
+# MIN_REPLICAS_WORKER=10  # Minimum number of Locust worker replicas (default: 10)
+# WORKER_PROCESSES=1      # Locust worker processes per worker pod, one per core; pods request this many CPUs (default: 1)
+# WORKER_SHM_SIZE=1Gi     # Size of /dev/shm in worker pods with several processes, which share the query vector pool there (default: 1Gi)
+
+# Locust query settings
+# RETURN_FULL_DATAPOINT=true  # Return full datapoints (vectors and restricts) with each neighbor
+
+# Locust load shape
+# QPS_SWEEP=true  # Step target QPS up until latency or errors cross a threshold (see --sweep-* options)
\ No newline at end of file
@@ -411,6 +411,8 @@ function create_terraform_vars() {
   echo "deployment_id = \"${DEPLOYMENT_ID}\"" >> terraform.tfvars
   echo "locust_test_type = \"${LOCUST_TEST_TYPE}\"" >> terraform.tfvars
   echo "create_external_ip = ${TF_VAR_create_external_ip:-false}" >> terraform.tfvars
+  echo "worker_processes = ${WORKER_PROCESSES:-1}" >> terraform.tfvars
+  echo "worker_shm_size = \"${WORKER_SHM_SIZE:-1Gi}\"" >> terraform.tfvars
   
   # Add network configuration
   echo "" >> terraform.tfvars
@@ -542,6 +544,7 @@ function extract_terraform_outputs() {
   export VS_DIMENSIONS=${INDEX_DIMENSIONS}
   export VS_DEPLOYED_INDEX_ID=$(terraform output -raw vector_search_deployed_index_id)
   export VS_INDEX_ENDPOINT_ID=$(terraform output -raw vector_search_endpoint_id)
+  export VS_INDEX_ID=$(terraform output -raw vector_search_index_id)
 
   # Get public endpoint if available
   if terraform output -raw vector_search_public_endpoint &>/dev/null; then
@@ -565,10 +568,16 @@ function create_locust_config() {
 INDEX_DIMENSIONS=${VS_DIMENSIONS}
 DEPLOYED_INDEX_ID=${VS_DEPLOYED_INDEX_ID}
 INDEX_ENDPOINT_ID=${VS_INDEX_ENDPOINT_ID}
+INDEX_ID=${VS_INDEX_ID}
+REGION=${REGION}
+INDEX_UPDATE_METHOD=${INDEX_UPDATE_METHOD:-BATCH_UPDATE}
 ENDPOINT_HOST=${VS_ENDPOINT_HOST}
 PROJECT_ID=${PROJECT_ID}
 PROJECT_NUMBER=${PROJECT_NUMBER}
 ENDPOINT_ACCESS_TYPE=${ENDPOINT_ACCESS_TYPE}
+INDEX_DISTANCE_MEASURE_TYPE=${INDEX_DISTANCE_MEASURE_TYPE:-COSINE_DISTANCE}
+QPS_SWEEP=${QPS_SWEEP:-false}
+RETURN_FULL_DATAPOINT=${RETURN_FULL_DATAPOINT:-false}
 EOF
 
   # Add blended search settings if enabled
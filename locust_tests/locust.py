@@ -1,51 +1,237 @@
 """Locust file for load testing Vector Search endpoints (both public HTTP and private PSC/gRPC)."""
 
+import collections
+import contextlib
+import copy
+import csv
+import datetime
+import itertools
+import json
+import math
 import random
 import os
+import signal
+import struct
+import tempfile
 import time
+import uuid
+import zlib
 from typing import Any, Callable
 
-import google.auth
-import google.auth.transport.requests
-import google.auth.transport.grpc
-from google.cloud.aiplatform_v1 import MatchServiceClient
-from google.cloud.aiplatform_v1 import FindNeighborsRequest
-from google.cloud.aiplatform_v1 import IndexDatapoint
-from google.cloud.aiplatform_v1.services.match_service.transports import grpc as match_transports_grpc
-import grpc
-import grpc.experimental.gevent as grpc_gevent
-import grpc_interceptor
-import locust
-from locust import between, env, FastHttpUser, User, task, events, wait_time, tag
+# Start of the locustfile import, reported as part of each worker's startup time
+_IMPORT_START_TIME = time.perf_counter()
+
+import numpy as np
+import gevent
+import gevent.event
+import gevent.local
+import gevent.lock
+from locust import between, env, FastHttpUser, LoadTestShape, User, task, events, wait_time, tag
+from locust.exception import StopUser
+from locust.runners import LocalRunner, MasterRunner, WorkerRunner, STATE_MISSING, STATE_SPAWNING, WORKER_REPORT_INTERVAL
+from locust.stats import calculate_response_time_percentile
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
-# Patch grpc so that it uses gevent instead of asyncio
-grpc_gevent.init_gevent()
+# Vertex AI client library types, imported by load_grpc_modules() only in gRPC mode since
+# google.cloud.aiplatform_v1 takes most of a second to import
+MatchServiceClient = None
+FindNeighborsRequest = None
+FindNeighborsResponse = None
+IndexDatapoint = None
+IndexServiceClient = None
+RemoveDatapointsRequest = None
+UpsertDatapointsRequest = None
+index_transports_grpc = None
+match_transports_grpc = None
+
+# grpc and grpc_interceptor, and LocustInterceptor, which subclasses grpc_interceptor.ClientInterceptor, are
+# also only set by load_grpc_modules(), so HTTP workers skip importing them
+grpc = None
+grpc_interceptor = None
+LocustInterceptor = None
+
+# Only needed for Parquet result files, and imported by load_pyarrow() when the master opens them
+pyarrow = None
+
+
+def load_grpc_modules():
+    """Import grpc and the Vertex AI client library, define LocustInterceptor and patch grpc for gevent, once."""
+    global MatchServiceClient, FindNeighborsRequest, FindNeighborsResponse, IndexDatapoint, IndexServiceClient
+    global RemoveDatapointsRequest, UpsertDatapointsRequest, index_transports_grpc, match_transports_grpc
+    global grpc, grpc_interceptor, LocustInterceptor
+    if MatchServiceClient is not None:
+        return
+    import grpc
+    import grpc_interceptor
+    from google.cloud.aiplatform_v1 import MatchServiceClient
+    from google.cloud.aiplatform_v1 import FindNeighborsRequest
+    from google.cloud.aiplatform_v1 import FindNeighborsResponse
+    from google.cloud.aiplatform_v1 import IndexDatapoint
+    from google.cloud.aiplatform_v1 import IndexServiceClient
+    from google.cloud.aiplatform_v1 import RemoveDatapointsRequest
+    from google.cloud.aiplatform_v1 import UpsertDatapointsRequest
+    from google.cloud.aiplatform_v1.services.index_service.transports import grpc as index_transports_grpc
+    from google.cloud.aiplatform_v1.services.match_service.transports import grpc as match_transports_grpc
+    import grpc.experimental.gevent as grpc_gevent
+
+    class LocustInterceptor(LocustInterceptorMixin, grpc_interceptor.ClientInterceptor):
+        """Interceptor for Locust which captures response details."""
+
+    # Patch grpc so that it uses gevent instead of asyncio
+    grpc_gevent.init_gevent()
+
 
-# gRPC channel cache
+# gRPC channel pools, one per (host, auth type and pool settings)
 _GRPC_CHANNEL_CACHE = {}
 
-class LocustInterceptor(grpc_interceptor.ClientInterceptor):
-    """Interceptor for Locust which captures response details."""
+# Full method name of MatchService.FindNeighbors, for generic stubs sending pre-serialized requests
+_FIND_NEIGHBORS_METHOD = '/google.cloud.aiplatform.v1.MatchService/FindNeighbors'
+
+# OAuth credentials shared by every HTTP user on a worker
+_SHARED_CREDENTIALS = None
+
+# Query vector pool cache, shared by every user on a worker
+_QUERY_VECTOR_POOL_CACHE = {}
+
+# Shared memory pool files this process created, removed when it quits
+_SHARED_POOL_FILES = []
+
+# Sparse embedding generators, shared by every user on a worker
+_SPARSE_EMBEDDING_CACHE = {}
+
+# Query filter and datapoint restricts generator, shared by every user on a worker
+_RESTRICTS_GENERATOR = None
+
+# Recall checkers, shared by every user on a worker
+_RECALL_CHECKER_CACHE = {}
+
+# Pre-encoded findNeighbors bodies, shared by every HTTP user on a worker
+_HTTP_BODY_POOL_CACHE = {}
+
+# Pre-serialized FindNeighborsRequests, shared by every gRPC user on a worker
+_GRPC_REQUEST_POOL_CACHE = {}
+
+# Query replay source shared by every user on a worker, and this worker's shard of the file
+_QUERY_REPLAY = None
+_QUERY_REPLAY_SHARD = (0, 1)
+
+# Open-loop arrival schedule shared by every user on a worker, and arrivals dropped across the run
+_ARRIVAL_SCHEDULE = None
+_OPEN_LOOP_DROPPED = 0
+
+# Upsert and remove traffic shared by every user on a worker, and the write rate limit the master set for it
+_DATAPOINT_WRITER = None
+_WRITE_RATE = 0.0
+
+# Hot-path profiler of this load generator process, and the master's view of every worker's profile
+_WORKER_PROFILER = None
+_CLIENT_BOUND_MONITOR = None
+_PROFILE_REPORT_GREENLET = None
+
+# Client-side measurements that are not request latencies; on the master, merged from every worker
+_CLIENT_METRICS = None
+
+# HDR latency histograms: the worker's recorder and snapshot greenlet, and the master's merged windows
+_LATENCY_RECORDER = None
+_LATENCY_SNAPSHOT_GREENLET = None
+_LATENCY_AGGREGATOR = None
+
+# Result files: the worker's sampled records and per-second aggregates, the greenlet sending them, and
+# the master's writer
+_RESULT_RECORDER = None
+_RESULT_SEND_GREENLET = None
+_RESULT_SINK = None
+
+# Parameter matrix shared by every user on a worker, and the wall-clock time its first cell started
+_PARAMETER_MATRIX = None
+_PARAMETER_MATRIX_START = None
+
+# Startup timing: this process's locustfile import, whether it has been reported, and the environment
+# and time of the last test start
+_IMPORT_TIME = None
+_STARTUP_REPORTED = False
+_TEST_START = None
+
+# The greenlet that ends the warm-up window, and on the master the workers yet to confirm their stats reset
+_WARMUP_GREENLET = None
+_WARMUP_UNCONFIRMED = None
+
+# Seconds the master waits for every worker to confirm its warm-up stats reset before resetting its own
+WARMUP_CONFIRM_TIMEOUT = 10
+
+# Suffix of the names of priming queries sent during the warm-up window
+WARMUP_SUFFIX = " (warmup)"
+
+
+class _RequestContext(gevent.local.local):
+    """Per-greenlet request details that the gRPC interceptor reads when naming a call."""
+
+    name_suffix = ""
+
 
-    def __init__(self, environment, *args, **kwargs):
-        """Initializes the interceptor with the specified environment."""
+_REQUEST_CONTEXT = _RequestContext()
+
+def _message_size(message: Any) -> int:
+    """Return the serialized size of a proto-plus response, or of raw bytes from a generic stub."""
+    if isinstance(message, bytes):
+        return len(message)
+    return message.__class__.pb(message).ByteSize()
+
+
+class LocustInterceptorMixin:
+    """Methods of LocustInterceptor, which load_grpc_modules() combines with grpc_interceptor.ClientInterceptor."""
+
+    def __init__(self, environment, *args, channel_pool=None, channel_index=0, size_sample_rate=1.0, **kwargs):
+        """
+        Initializes the interceptor with the specified environment.
+
+        Args:
+            environment: The Locust environment to report requests through.
+            channel_pool: The GrpcChannelPool the intercepted channel belongs to, if any.
+            channel_index: The channel's index in `channel_pool`.
+            size_sample_rate: Fraction of responses whose serialized size is
+                measured. Unmeasured responses report the running average
+                size, and 0 skips sizing entirely.
+        """
         super().__init__(*args, **kwargs)
         self.env = environment
+        self.channel_pool = channel_pool
+        self.channel_index = channel_index
+        self.size_every = round(1 / size_sample_rate) if size_sample_rate > 0 else 0
+        self.calls = 0
+        self.sized_calls = 0
+        self.sized_bytes = 0
+
+    def intercept_unary_unary(self, continuation, call_details, request):
+        """Marks unary responses, since future-based unary calls also return a rendezvous."""
+        return self.intercept(
+            lambda req, details: continuation(details, req), request, call_details, unary_response=True
+        )
+
+    def intercept_stream_unary(self, continuation, call_details, request_iterator):
+        """Marks unary responses, since future-based unary calls also return a rendezvous."""
+        return self.intercept(
+            lambda req, details: continuation(details, req), request_iterator, call_details, unary_response=True
+        )
 
     def intercept(
         self,
-        method: Callable[[Any, grpc.ClientCallDetails], Any],
+        method: Callable[[Any, "grpc.ClientCallDetails"], Any],
         request_or_iterator: Any,
-        call_details: grpc.ClientCallDetails,
+        call_details: "grpc.ClientCallDetails",
+        unary_response: bool = False,
     ) -> Any:
         """Intercepts message to store RPC latency and response size."""
+        name = call_details.method + _REQUEST_CONTEXT.name_suffix
         response = None
         exception = None
         end_perf_counter = None
         response_length = 0
+        if self.channel_pool is not None:
+            with profile_section("intercept"):
+                self.channel_pool.request_started(self.channel_index)
         start_perf_counter = time.perf_counter()
         try:
             # Response type
@@ -54,53 +240,108 @@ class LocustInterceptor(grpc_interceptor.ClientInterceptor):
             response_or_responses = method(request_or_iterator, call_details)
             end_perf_counter = time.perf_counter()
 
-            if isinstance(response_or_responses, grpc._channel._Rendezvous):
-                responses = list(response_or_responses)
-                # Re-write perf counter to account for time taken to receive all messages.
-                end_perf_counter = time.perf_counter()
-
-                # Total length = sum(messages).
-                total_length = 0
-                for message in responses:
-                    message_pb = message.__class__.pb(message)
-                    response_length = message_pb.ByteSize()
-                    total_length += response_length
-
-                # Re-write response to return the actual responses since above logic has
-                # consumed all responses.
-                def yield_responses():
-                    for rsp in responses:
-                        yield rsp
-
-                response_or_responses = yield_responses()
-            else:
-                response = response_or_responses
-                # Unary
-                message = response.result()
-                message_pb = message.__class__.pb(message)
-                response_length = message_pb.ByteSize()
+            if not unary_response and isinstance(response_or_responses, grpc._channel._Rendezvous):
+                # Measure messages as the caller consumes them, and report once the stream ends
+                return self._measure_stream(response_or_responses, name, start_perf_counter)
+
+            response = response_or_responses
+            if not response.done():
+                # Future-based call: report when the RPC completes instead of blocking the caller
+                response.add_done_callback(
+                    lambda future: self._report_future(future, name, start_perf_counter)
+                )
+                return response
+            # Unary: result() raises for a failed call, so it runs even when responses are not sized
+            result = response.result()
+            if self.size_every:
+                with profile_section("intercept"):
+                    response_length = self._response_length(result)
         except grpc.RpcError as e:
             exception = e
             end_perf_counter = time.perf_counter()
 
-        self.env.events.request.fire(
-            request_type='grpc',
-            name=call_details.method,
-            response_time=(end_perf_counter - start_perf_counter) * 1000,
-            response_length=response_length,
-            response=response_or_responses,
-            context=None,
-            exception=exception,
+        self._report(
+            name,
+            (end_perf_counter - start_perf_counter) * 1000,
+            response_length,
+            response_or_responses,
+            exception,
         )
         return response_or_responses
 
+    def _response_length(self, message: Any) -> int:
+        """Returns the size of one in `size_every` responses, and the running average size for the rest."""
+        if self.size_every == 1:
+            return _message_size(message)
+        self.calls += 1
+        if self.calls % self.size_every == 0 or not self.sized_calls:
+            self.sized_calls += 1
+            self.sized_bytes += _message_size(message)
+        return self.sized_bytes // self.sized_calls
+
+    def _measure_stream(self, responses: Any, name: str, start_perf_counter: float):
+        """Yields streamed messages without buffering them, and reports the call once the stream ends."""
+        response_length = 0
+        exception = None
+        try:
+            for message in responses:
+                if self.size_every:
+                    with profile_section("intercept"):
+                        response_length += self._response_length(message)
+                yield message
+        except grpc.RpcError as e:
+            exception = e
+            raise
+        finally:
+            self._report(
+                name,
+                (time.perf_counter() - start_perf_counter) * 1000,
+                response_length,
+                responses,
+                exception,
+            )
+
+    def _report_future(self, future: "grpc.Future", name: str, start_perf_counter: float):
+        """Reports a future-based unary call once it completes."""
+        end_perf_counter = time.perf_counter()
+        exception = future.exception()
+        with profile_section("intercept"):
+            response_length = 0 if exception or not self.size_every else self._response_length(future.result())
+        self._report(
+            name,
+            (end_perf_counter - start_perf_counter) * 1000,
+            response_length,
+            future,
+            exception,
+        )
+
+    def _report(self, name: str, response_time: float, response_length: int,
+                response: Any, exception: Exception):
+        """Fires the request event for a completed call and updates the channel's pool statistics."""
+        with profile_section("intercept"):
+            if self.channel_pool is not None:
+                self.channel_pool.request_finished(self.channel_index, response_time)
+            self.env.events.request.fire(
+                request_type='grpc',
+                name=name,
+                response_time=response_time,
+                response_length=response_length,
+                response=response,
+                context=None,
+                exception=exception,
+            )
+
 
-def _create_grpc_auth_channel(host: str) -> grpc.Channel:
+def _create_grpc_auth_channel(host: str, options: list = ()) -> "grpc.Channel":
     """Create a gRPC channel with SSL and auth."""
+    import google.auth.transport.grpc
+    import google.auth.transport.requests
+
     credentials, _ = google.auth.default()
     request = google.auth.transport.requests.Request()
     CHANNEL_OPTIONS = [
         ('grpc.use_local_subchannel_pool', True),
+        *options,
     ]
     return google.auth.transport.grpc.secure_authorized_channel(
         credentials,
@@ -111,217 +352,3347 @@ def _create_grpc_auth_channel(host: str) -> grpc.Channel:
     )
 
 
-def _cached_grpc_channel(
-    host: str, auth: bool, cache: bool = True
-) -> grpc.Channel:
-    """Return a cached gRPC channel for the given host and auth type."""
-    key = (host, auth)
-    if cache and key in _GRPC_CHANNEL_CACHE:
-        return _GRPC_CHANNEL_CACHE[key]
+def grpc_channel_options(keepalive_ms: int = 0, lb_policy: str = "round_robin") -> list:
+    """Return channel arguments for keepalive and load balancing across the addresses a target resolves to."""
+    options = [('grpc.lb_policy_name', lb_policy)]
+    if keepalive_ms > 0:
+        options += [
+            ('grpc.keepalive_time_ms', keepalive_ms),
+            ('grpc.keepalive_timeout_ms', min(keepalive_ms, 20000)),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+        ]
+    return options
+
 
-    new_channel = (
-        _create_grpc_auth_channel(host) if auth else grpc.insecure_channel(host)
-    )
-    if not cache:
-        return new_channel
+class GrpcChannelPool:
+    """A fixed number of gRPC channels to one host, shared by every user on a worker.
+
+    Each channel has its own subchannel pool, and so its own HTTP/2
+    connection, which spreads load over several TCP flows and multiplies the
+    number of concurrent streams the server allows. Users are assigned
+    channels round-robin, and in-flight requests and latency are tracked per
+    channel so a saturated connection shows up in the stats and logs.
+    """
+
+    def __init__(self, host: str, auth: bool, size: int = 1, options: list = (),
+                 max_concurrent_streams: int = 100):
+        """Open `size` channels to `host` with the given channel arguments."""
+        self.host = host
+        self.max_concurrent_streams = max_concurrent_streams
+        # A local subchannel pool gives every channel its own connection
+        self.channels = [
+            _create_grpc_auth_channel(host, options) if auth
+            else grpc.insecure_channel(host, options=[('grpc.use_local_subchannel_pool', True), *options])
+            for _ in range(max(size, 1))
+        ]
+        self.inflight = [0] * len(self.channels)
+        self.peak_inflight = [0] * len(self.channels)
+        self.latency_total = [0.0] * len(self.channels)
+        self.completed = [0] * len(self.channels)
+        self._intercepted = {}
+        self._clients = {}
+        self._connected = None
+        self._next_assignment = 0
+        self.monitor = None
+
+    @property
+    def size(self) -> int:
+        return len(self.channels)
 
-    _GRPC_CHANNEL_CACHE[key] = new_channel
+    def intercepted_channels(self, environment) -> list:
+        """Return the pool's channels wrapped in Locust interceptors, created once per environment."""
+        key = id(environment)
+        if key not in self._intercepted:
+            self._intercepted[key] = [
+                grpc.intercept_channel(
+                    channel,
+                    LocustInterceptor(
+                        environment=environment,
+                        channel_pool=self,
+                        channel_index=i,
+                        size_sample_rate=environment.parsed_options.response_size_sample_rate,
+                    ),
+                )
+                for i, channel in enumerate(self.channels)
+            ]
+        return self._intercepted[key]
+
+    def clients(self, environment, factory: Callable) -> list:
+        """Return `factory(channel)` for each intercepted channel, created once per environment and shared by users."""
+        key = (id(environment), factory)
+        if key not in self._clients:
+            self._clients[key] = [factory(channel) for channel in self.intercepted_channels(environment)]
+        return self._clients[key]
+
+    def connect(self, timeout: float) -> list:
+        """Wait until every channel is connected.
+
+        The first caller connects the channels one at a time and gets each
+        channel's connection time in milliseconds; later callers wait for it
+        and get an empty list.
+        """
+        if self._connected is not None:
+            self._connected.wait()
+            return []
+        self._connected = gevent.event.Event()
+        connect_times = []
+        try:
+            for channel in self.channels:
+                start_time = time.perf_counter()
+                grpc.channel_ready_future(channel).result(timeout=timeout)
+                connect_times.append((time.perf_counter() - start_time) * 1000)
+        finally:
+            self._connected.set()
+        return connect_times
+
+    def assign(self) -> int:
+        """Return the channel for the next user, round-robin over the pool."""
+        channel_index = self._next_assignment
+        self._next_assignment = (channel_index + 1) % self.size
+        return channel_index
+
+    def pick(self, preferred: int) -> int:
+        """Return `preferred` unless it is at the stream limit, in which case the least loaded channel."""
+        if self.inflight[preferred] < self.max_concurrent_streams:
+            return preferred
+        return min(range(self.size), key=self.inflight.__getitem__)
+
+    def request_started(self, channel_index: int):
+        self.inflight[channel_index] += 1
+        if self.inflight[channel_index] > self.peak_inflight[channel_index]:
+            self.peak_inflight[channel_index] = self.inflight[channel_index]
+
+    def request_finished(self, channel_index: int, response_time: float):
+        self.inflight[channel_index] -= 1
+        self.latency_total[channel_index] += response_time
+        self.completed[channel_index] += 1
+
+    def report(self, environment, report_metrics: bool = False):
+        """
+        Warns about channels that reached the stream limit since the last call, then resets the window.
+
+        Args:
+            environment: The Locust environment to report through.
+            report_metrics: Whether to also report each channel's peak in-flight
+                requests and mean latency as "grpc-channel" client metrics.
+        """
+        saturated = []
+        for i in range(self.size):
+            if report_metrics:
+                report_metric("grpc-channel", f"channel {i} in-flight", self.peak_inflight[i])
+                if self.completed[i]:
+                    report_metric("grpc-channel", f"channel {i} latency", self.latency_total[i] / self.completed[i])
+            if self.peak_inflight[i] >= self.max_concurrent_streams:
+                saturated.append(i)
+            self.peak_inflight[i] = self.inflight[i]
+            self.latency_total[i] = 0.0
+            self.completed[i] = 0
+        if saturated:
+            logging.warning(
+                f"gRPC channels {saturated} to {self.host} reached {self.max_concurrent_streams} concurrent "
+                f"streams; requests may queue on the client. Consider raising --grpc-channels."
+            )
+
+    def start_monitor(self, environment, interval: float, report_metrics: bool = False):
+        """Run `report` every `interval` seconds in a background greenlet."""
+        def monitor():
+            while True:
+                gevent.sleep(interval)
+                self.report(environment, report_metrics)
+
+        if self.monitor is None and interval > 0:
+            self.monitor = gevent.spawn(monitor)
+
+
+def match_service_client(channel: "grpc.Channel"):
+    """Build a MatchServiceClient on an existing channel."""
+    return MatchServiceClient(transport=match_transports_grpc.MatchServiceGrpcTransport(channel=channel))
+
+
+def index_service_client(channel: "grpc.Channel"):
+    """Build an IndexServiceClient on an existing channel."""
+    return IndexServiceClient(transport=index_transports_grpc.IndexServiceGrpcTransport(channel=channel))
+
+
+def find_neighbors_stub(channel: "grpc.Channel"):
+    """Build a generic FindNeighbors stub that sends and returns raw bytes."""
+    return channel.unary_unary(_FIND_NEIGHBORS_METHOD)
+
+
+def get_grpc_channel_pool(host: str, auth: bool, environment) -> GrpcChannelPool:
+    """Return the worker's channel pool for the given host and auth type, created on first use."""
+    load_grpc_modules()
+    options = environment.parsed_options
+    key = (host, auth, options.grpc_channels, options.grpc_keepalive_ms, options.grpc_max_concurrent_streams)
+    if key not in _GRPC_CHANNEL_CACHE:
+        pool = GrpcChannelPool(
+            host,
+            auth,
+            size=options.grpc_channels,
+            options=grpc_channel_options(options.grpc_keepalive_ms),
+            max_concurrent_streams=options.grpc_max_concurrent_streams,
+        )
+        pool.start_monitor(
+            environment, options.grpc_channel_report_interval, report_metrics=options.grpc_channel_metrics
+        )
+        _GRPC_CHANNEL_CACHE[key] = pool
     return _GRPC_CHANNEL_CACHE[key]
 
 
-def intercepted_cached_grpc_channel(
-    host: str,
-    auth: bool,
-    env: locust.env.Environment,
-    cache: bool = True,
-) -> grpc.Channel:
-    """Return a intercepted gRPC channel for the given host and auth type."""
-    channel = _cached_grpc_channel(host, auth=auth, cache=cache)
-    interceptor = LocustInterceptor(environment=env)
-    return grpc.intercept_channel(channel, interceptor)
+class SharedCredentials:
+    """OAuth credentials shared by every HTTP user on a worker.
 
-# Create a global config class that will be used throughout the application
-class Config:
-    """Singleton configuration class that loads from config file just once."""
-    _instance = None
-    
-    def __new__(cls, config_file_path=None):
-        if cls._instance is None:
-            cls._instance = super(Config, cls).__new__(cls)
-            cls._instance._initialized = False
-        return cls._instance
-    
-    def __init__(self, config_file_path=None):
-        if self._initialized:
-            return
-            
-        if config_file_path:
-            self._load_config(config_file_path)
-        self._initialized = True
-        
-        # Determine endpoint access type from configuration
-        self._determine_endpoint_access_type()
-        
-        logging.info(f"Loaded configuration: ENDPOINT_ACCESS_TYPE={self.endpoint_access_type}, "
-                     f"PSC_ENABLED={self.psc_enabled}, MATCH_GRPC_ADDRESS={self.match_grpc_address}, "
-                     f"ENDPOINT_HOST={self.endpoint_host}, PROJECT_NUMBER={self.project_number}")
-    
-    def _load_config(self, file_path):
-        """Load configuration from a bash-style config file."""
-        self.config = {}
-        
-        with open(file_path, 'r') as f:
-            for line in f:
-                # Skip comments and empty lines
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                
-                # Parse variable assignment
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    # Remove surrounding quotes if present
-                    if (value.startswith('"') and value.endswith('"')) or (value.startswith("'") and value.endswith("'")):
-                        value = value[1:-1]
-                    
-                    self.config[key] = value
-        
-        # Set attributes from the config
-        self.project_id = self.config.get('PROJECT_ID')
-        self.project_number = self.config.get('PROJECT_NUMBER', self.project_id)
-        self.dimensions = int(self.config.get('INDEX_DIMENSIONS', 768))
-        self.deployed_index_id = self.config.get('DEPLOYED_INDEX_ID')
-        self.index_endpoint_id = self.config.get('INDEX_ENDPOINT_ID')
-        self.endpoint_host = self.config.get('ENDPOINT_HOST')
-        
-        # Support both old and new config formats
-        # New format: ENDPOINT_ACCESS_TYPE
-        self.endpoint_access_type = self.config.get('ENDPOINT_ACCESS_TYPE')
-        
-        # Old format: PSC_ENABLED
-        self.psc_enabled = self.config.get('PSC_ENABLED', 'false').lower() in ('true', 'yes', '1')
-        
-        # PSC Configuration
-        self.match_grpc_address = self.config.get('MATCH_GRPC_ADDRESS')
-        self.service_attachment = self.config.get('SERVICE_ATTACHMENT')
-        self.psc_ip_address = self.config.get('PSC_IP_ADDRESS')
-        
-        # Embedding configuration
-        self.sparse_embedding_num_dimensions = int(self.config.get('SPARSE_EMBEDDING_NUM_DIMENSIONS', 0))
-        self.sparse_embedding_num_dimensions_with_values = int(self.config.get('SPARSE_EMBEDDING_NUM_DIMENSIONS_WITH_VALUES', 0))
-        self.num_neighbors = int(self.config.get('NUM_NEIGHBORS', 20)) 
-        self.num_embeddings_per_request = int(self.config.get('NUM_EMBEDDINGS_PER_REQUEST', 1))
-        self.return_full_datapoint = self.config.get('RETURN_FULL_DATAPOINT', 'False').lower() in ('true', 'yes', '1')
-        
-        # Network configuration
-        self.network_name = self.config.get('NETWORK_NAME', 'default')
-        
-        # If we have PSC_IP_ADDRESS but not MATCH_GRPC_ADDRESS, construct it
-        if self.psc_ip_address and not self.match_grpc_address:
-            self.match_grpc_address = f"{self.psc_ip_address}"
-            
-        # Get a clean numeric ID from the full endpoint ID
-        self.endpoint_id_numeric = None
-        if self.index_endpoint_id and "/" in self.index_endpoint_id:
-            self.endpoint_id_numeric = self.index_endpoint_id.split("/")[-1]
+    The token is fetched once, when the first user is created, and then
+    refreshed by a background greenlet `refresh_margin` seconds before it
+    expires. Users read `authorization` on every request, so neither user
+    spawning nor the request path waits on a token fetch; a 401 only asks
+    the greenlet to refresh early.
+    """
+
+    # Refresh interval when credentials don't report an expiry
+    DEFAULT_LIFETIME = 3500
+    # Minimum time between refreshes requested after 401s
+    MIN_REFRESH_INTERVAL = 10
+
+    def __init__(self, scopes: list, refresh_margin: float = 300):
+        # Imported here since only authenticated HTTP users need it
+        import google.auth.transport.requests
+
+        self.credentials, _ = google.auth.default(scopes=scopes)
+        self.auth_req = google.auth.transport.requests.Request()
+        self.refresh_margin = refresh_margin
+        self.refresh_requested = gevent.event.Event()
+        self.authorization = None
+        self.refreshed_at = 0.0
+        self.refresh()
+        self.greenlet = gevent.spawn(self._refresh_loop)
+
+    def refresh(self):
+        """Fetch a new token and publish its Authorization header value."""
+        self.credentials.refresh(self.auth_req)
+        self.authorization = "Bearer " + self.credentials.token
+        self.refreshed_at = time.monotonic()
+
+    def request_refresh(self):
+        """Ask the background greenlet to refresh now, e.g. after a 401."""
+        if time.monotonic() - self.refreshed_at > self.MIN_REFRESH_INTERVAL:
+            self.refresh_requested.set()
+
+    def _seconds_until_refresh(self) -> float:
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return self.DEFAULT_LIFETIME - (time.monotonic() - self.refreshed_at)
+        if expiry.tzinfo is None:
+            # google-auth reports expiry as naive UTC
+            expiry = expiry.replace(tzinfo=datetime.timezone.utc)
+        remaining = (expiry - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        return remaining - self.refresh_margin
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh_requested.wait(timeout=max(self._seconds_until_refresh(), 0))
+            self.refresh_requested.clear()
+            try:
+                self.refresh()
+                logging.debug("OAuth token refreshed in the background")
+            except Exception as e:
+                # Keep serving the current token and retry shortly
+                logging.error(f"Failed to refresh token: {str(e)}")
+                gevent.sleep(self.MIN_REFRESH_INTERVAL)
+
+
+class StaticCredentials:
+    """Stands in for SharedCredentials against the mock MatchService, which accepts any token."""
+
+    authorization = "Bearer mock"
+
+    def request_refresh(self):
+        pass
+
+
+def get_shared_credentials() -> SharedCredentials:
+    """Return the worker's shared OAuth credentials, fetching a token on first use."""
+    global _SHARED_CREDENTIALS
+    if _SHARED_CREDENTIALS is None:
+        if config.mock_server_address:
+            _SHARED_CREDENTIALS = StaticCredentials()
         else:
-            self.endpoint_id_numeric = self.index_endpoint_id
-    
-    def _determine_endpoint_access_type(self):
-        """Determine the endpoint access type from configuration."""
-        # If ENDPOINT_ACCESS_TYPE is directly specified, use it
-        if self.endpoint_access_type:
-            # Ensure it's one of the valid options
-            if self.endpoint_access_type not in ["public", "vpc_peering", "private_service_connect"]:
-                logging.warning(f"Invalid ENDPOINT_ACCESS_TYPE '{self.endpoint_access_type}', defaulting to 'public'")
-                self.endpoint_access_type = "public"
+            _SHARED_CREDENTIALS = SharedCredentials(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    return _SHARED_CREDENTIALS
+
+
+class QueryVectorPool:
+    """Pool of query vectors loaded or generated once and shared by all users on a worker.
+
+    Vectors are held as a float32 array of shape (size, dimensions). Pools loaded
+    from disk are memory-mapped, so every gevent user reads the same pages
+    without copying them.
+    """
+
+    def __init__(self, vectors: np.ndarray):
+        if vectors.ndim != 2 or vectors.shape[0] == 0:
+            raise ValueError(f"Query vector pool must be a non-empty 2-D array, got shape {vectors.shape}")
+        self.vectors = vectors
+        self.size, self.dimensions = vectors.shape
+
+    @classmethod
+    def from_file(cls, path: str, dimensions: int) -> 'QueryVectorPool':
+        """Memory-map a `.npy` file, or a raw float32 file of `dimensions`-wide rows."""
+        if path.endswith('.npy'):
+            vectors = np.load(path, mmap_mode='r')
         else:
-            # Otherwise, derive it from PSC_ENABLED
-            if self.psc_enabled:
-                self.endpoint_access_type = "private_service_connect"
-                logging.info("Derived endpoint_access_type='private_service_connect' from PSC_ENABLED=true")
-            else:
-                self.endpoint_access_type = "public"
-                logging.info("Derived endpoint_access_type='public' from PSC_ENABLED=false")
-    
-    def get(self, key, default=None):
-        """Get a configuration value by key."""
-        return getattr(self, key.lower(), self.config.get(key, default))
+            vectors = np.memmap(path, dtype=np.float32, mode='r')
+            if vectors.size % dimensions:
+                raise ValueError(f"Raw vector file {path} is not a whole number of {dimensions}-dimension float32 rows")
+            vectors = vectors.reshape(-1, dimensions)
+        if vectors.ndim != 2 or vectors.shape[1] != dimensions:
+            raise ValueError(f"Vector file {path} has shape {vectors.shape}, expected (N, {dimensions})")
+        return cls(vectors)
+
+    @classmethod
+    def generate(cls, size: int, dimensions: int, seed: int = None, path: str = None) -> 'QueryVectorPool':
+        """Generate `size` random vectors, optionally saving them to `path` and memory-mapping the result."""
+        rng = np.random.default_rng(seed)
+        vectors = rng.uniform(-1.0, 1.0, size=(size, dimensions)).astype(np.float32)
+        if not path:
+            return cls(vectors)
+        np.save(path, vectors)
+        return cls.from_file(path, dimensions)
+
+    @classmethod
+    def shared(cls, path: str, size: int, dimensions: int, seed: int = None,
+               timeout: float = 120.0) -> tuple:
+        """Generate the pool into `path` once for every process that asks, and memory-map it.
+
+        The first process to create `path`.lock generates the vectors and
+        moves them into place with a rename, so the others never see a
+        partial file; they wait for it to appear. If generation fails, the
+        lock is removed so the others fail at once instead of waiting out
+        `timeout`. Returns (pool, created).
+        """
+        lock_path = f"{path}.lock"
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            deadline = time.monotonic() + timeout
+            while not os.path.exists(path):
+                if not os.path.exists(lock_path):
+                    raise RuntimeError(f"Another process failed to create {path}")
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for another process to create {path}")
+                gevent.sleep(0.05)
+            return cls.from_file(path, dimensions), False
+        rng = np.random.default_rng(seed)
+        temporary_path = f"{path}.{os.getpid()}.npy"
+        try:
+            np.save(temporary_path, rng.uniform(-1.0, 1.0, size=(size, dimensions)).astype(np.float32))
+            os.replace(temporary_path, path)
+        except BaseException:
+            for leftover in (temporary_path, lock_path):
+                with contextlib.suppress(OSError):
+                    os.remove(leftover)
+            raise
+        return cls.from_file(path, dimensions), True
+
+    def row(self, index: int) -> list:
+        """Return row `index` (wrapping around) as a list of floats."""
+        return self.vectors[index % self.size].tolist()
+
+
+def shared_pool_path(size: int, dimensions: int, seed: int = None) -> str:
+    """Return the shared memory file for a generated pool, unique to the processes forked by one parent.
+
+    Falls back to the temporary directory when /dev/shm is missing or too
+    small for the pool, as with the 64 MB default of a container. The
+    choice depends on the file system's total size, not its free space, so
+    every process picks the same directory.
+    """
+    directory = "/dev/shm"
+    if os.path.isdir(directory):
+        stats = os.statvfs(directory)
+        if size * dimensions * np.dtype(np.float32).itemsize >= stats.f_blocks * stats.f_frsize:
+            directory = tempfile.gettempdir()
+    else:
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, f"vvs-locust-query-pool-{os.getppid()}-{size}x{dimensions}-{seed}.npy")
+
+
+def get_query_vector_pool(parsed_options, dimensions: int):
+    """Return the worker's shared query vector pool, or None if the pool is disabled."""
+    path = parsed_options.query_vectors_file
+    size = parsed_options.query_pool_size
+    if not path and size <= 0:
+        return None
+
+    key = (path, size, dimensions, parsed_options.query_pool_seed)
+    if key in _QUERY_VECTOR_POOL_CACHE:
+        return _QUERY_VECTOR_POOL_CACHE[key]
+
+    start_time = time.perf_counter()
+    source = path or "generated"
+    if path and os.path.exists(path):
+        pool = QueryVectorPool.from_file(path, dimensions)
+    elif size > 0 and not path and getattr(parsed_options, "processes", None):
+        # Processes forked by --processes share one generated pool in shared memory
+        source = shared_pool_path(size, dimensions, parsed_options.query_pool_seed)
+        pool, created = QueryVectorPool.shared(source, size, dimensions, seed=parsed_options.query_pool_seed)
+        if created:
+            _SHARED_POOL_FILES.extend([source, f"{source}.lock"])
+    elif size > 0:
+        pool = QueryVectorPool.generate(size, dimensions, seed=parsed_options.query_pool_seed, path=path or None)
+    else:
+        raise ValueError(f"Query vector file {path} does not exist and --query-pool-size is not set")
+    logging.info(f"Query vector pool ready: {pool.size} x {pool.dimensions} vectors "
+                 f"in {time.perf_counter() - start_time:.2f}s (source={source})")
+
+    _QUERY_VECTOR_POOL_CACHE[key] = pool
+    return pool
+
+class SparseEmbeddingGenerator:
+    """Random sparse embeddings, generated with NumPy in batches and handed out one at a time.
+
+    Each batch of (values, dimensions) pairs is drawn and converted to Python
+    lists in a few vectorized calls. Once half of a batch is used, the next
+    one is generated on the gevent hub's thread pool, so the event loop keeps
+    serving requests in flight while NumPy works; only one refill runs at a
+    time, so the thread has the generator to itself.
+    """
+
+    # Rows converted to Python lists per GIL-holding call during a refill
+    CONVERT_ROWS = 64
+
+    def __init__(self, num_dimensions: int, num_values: int, batch_size: int = 1024, seed: int = None):
+        self.num_dimensions = num_dimensions
+        self.num_values = num_values
+        self.batch_size = max(batch_size, 2)
+        self.rng = np.random.default_rng(seed)
+        self.batch = self._generate()
+        self.position = 0
+        self.next_batch = None
+        self.refill = None
+
+    def _sample_dimensions(self) -> np.ndarray:
+        """Draw `num_values` distinct dimensions for every row of a batch."""
+        n, k = self.num_dimensions, self.num_values
+        if 2 * k > n:
+            # Too dense for redrawing collisions to converge quickly
+            return np.stack([self.rng.choice(n, k, replace=False) for _ in range(self.batch_size)])
+        # Draw with replacement, then redraw only the entries that repeat a dimension in their row
+        dimensions = np.sort(self.rng.integers(0, n, (self.batch_size, k)), axis=1)
+        repeated = np.zeros(dimensions.shape, dtype=bool)
+        while True:
+            repeated[:, 1:] = dimensions[:, 1:] == dimensions[:, :-1]
+            num_repeated = int(repeated.sum())
+            if not num_repeated:
+                return dimensions
+            dimensions[repeated] = self.rng.integers(0, n, num_repeated)
+            dimensions.sort(axis=1)
+
+    def _generate(self) -> list:
+        values = self.rng.uniform(-1.0, 1.0, (self.batch_size, self.num_values))
+        dimensions = self._sample_dimensions()
+        # tolist() holds the GIL until it returns, so rows are converted in chunks to let the event loop run between
+        batch = []
+        for start in range(0, self.batch_size, self.CONVERT_ROWS):
+            end = start + self.CONVERT_ROWS
+            batch += zip(values[start:end].tolist(), dimensions[start:end].tolist())
+        return batch
+
+    def _refill(self):
+        self.next_batch = self._generate()
+
+    def next(self):
+        """Return the next (values, dimensions) pair as Python lists."""
+        if self.position == self.batch_size:
+            if self.refill is not None:
+                # Called inside profile sections, so the wait for the refill is kept out of them
+                with profile_yield():
+                    self.refill.get()
+            self.batch = self.next_batch if self.next_batch is not None else self._generate()
+            self.position = 0
+            self.next_batch = None
+            self.refill = None
+        elif self.position == self.batch_size // 2 and self.refill is None:
+            self.refill = gevent.get_hub().threadpool.spawn(self._refill)
+        embedding = self.batch[self.position]
+        self.position += 1
+        return embedding
+
+
+def sparse_embedding_configured() -> bool:
+    """Return whether the config describes a usable sparse embedding."""
+    return 0 < config.sparse_embedding_num_dimensions_with_values <= config.sparse_embedding_num_dimensions
+
+
+def resolve_embedding_mode(parsed_options) -> str:
+    """Return "dense", "sparse" or "hybrid" for --embedding-mode; "auto" uses sparse when it is configured."""
+    mode = parsed_options.embedding_mode
+    if mode == "auto":
+        return "sparse" if sparse_embedding_configured() else "dense"
+    if mode != "dense" and not sparse_embedding_configured():
+        raise ValueError(
+            f"--embedding-mode {mode} requires SPARSE_EMBEDDING_NUM_DIMENSIONS and "
+            "SPARSE_EMBEDDING_NUM_DIMENSIONS_WITH_VALUES in the config"
+        )
+    return mode
+
+
+def get_sparse_embedding_generator(parsed_options) -> SparseEmbeddingGenerator:
+    """Return the worker's shared sparse embedding generator."""
+    key = (
+        config.sparse_embedding_num_dimensions,
+        config.sparse_embedding_num_dimensions_with_values,
+        parsed_options.sparse_batch_size,
+        parsed_options.query_pool_seed,
+    )
+    if key not in _SPARSE_EMBEDDING_CACHE:
+        _SPARSE_EMBEDDING_CACHE[key] = SparseEmbeddingGenerator(*key)
+    return _SPARSE_EMBEDDING_CACHE[key]
+
+class RestrictsGenerator:
+    """Generates filters for queries, and matching restricts for upserted datapoints.
+
+    Each request draws a target selectivity from `selectivities`, a list of
+    (selectivity, weight) pairs. The selectivity is turned into filters that
+    match that fraction of datapoints, assuming the indexed datapoints carry
+    one of `num_tokens` tokens ("0" to "{num_tokens - 1}") in the token
+    namespace, and a value uniform in [0, 1) in the numeric namespace:
+    - a token filter allows round(selectivity * num_tokens) random tokens
+    - a numeric filter matches values LESS than the selectivity
+    - with both, each filter gets the square root of the selectivity
+    Upserted datapoints get restricts drawn from the same distributions, so
+    written data matches the filters. A selectivity of 1 sends no filter.
+    """
+
+    def __init__(self, selectivities: list, filter_type: str = "token", namespace: str = "category",
+                 num_tokens: int = 100, numeric_namespace: str = "score", crowding_attributes: int = 0):
+        self.selectivities = [selectivity for selectivity, _ in selectivities]
+        self.weights = [weight for _, weight in selectivities]
+        self.filter_type = filter_type
+        self.namespace = namespace
+        self.tokens = [str(i) for i in range(num_tokens)]
+        self.numeric_namespace = numeric_namespace
+        self.crowding_attributes = crowding_attributes
+
+    def next_filter(self) -> dict:
+        """Return the restricts and stats label for the next request's queries."""
+        selectivity = random.choices(self.selectivities, weights=self.weights)[0]
+        query_filter = {
+            "label": f" [sel={selectivity:g}]",
+            "restricts": [],
+            "numeric_restricts": [],
+            "crowding_attribute": None,
+        }
+        if selectivity >= 1:
+            return query_filter
+        each = math.sqrt(selectivity) if self.filter_type == "both" else selectivity
+        if self.filter_type in ("token", "both"):
+            count = min(max(round(each * len(self.tokens)), 1), len(self.tokens))
+            query_filter["restricts"].append((self.namespace, random.sample(self.tokens, count)))
+        if self.filter_type in ("numeric", "both"):
+            query_filter["numeric_restricts"].append((self.numeric_namespace, each, "LESS"))
+        return query_filter
+
+    def datapoint_restricts(self) -> dict:
+        """Return restricts and a crowding attribute for one upserted datapoint."""
+        return {
+            "restricts": [(self.namespace, [random.choice(self.tokens)])],
+            "numeric_restricts": [(self.numeric_namespace, random.random(), None)],
+            "crowding_attribute": (
+                str(random.randrange(self.crowding_attributes)) if self.crowding_attributes else None
+            ),
+        }
+
+
+def restricts_to_json(restricts: dict) -> dict:
+    """Return the REST datapoint fields for restricts from RestrictsGenerator."""
+    fields = {}
+    if restricts["restricts"]:
+        fields["restricts"] = [
+            {"namespace": namespace, "allowList": tokens} for namespace, tokens in restricts["restricts"]
+        ]
+    if restricts["numeric_restricts"]:
+        fields["numericRestricts"] = []
+        for namespace, value, op in restricts["numeric_restricts"]:
+            numeric_restrict = {"namespace": namespace, "valueFloat": value}
+            if op is not None:
+                numeric_restrict["op"] = op
+            fields["numericRestricts"].append(numeric_restrict)
+    if restricts["crowding_attribute"] is not None:
+        fields["crowdingTag"] = {"crowdingAttribute": restricts["crowding_attribute"]}
+    return fields
+
+
+def apply_restricts(datapoint: "IndexDatapoint", restricts: dict):
+    """Set restricts from RestrictsGenerator on a proto-plus IndexDatapoint."""
+    datapoint.restricts = [
+        IndexDatapoint.Restriction(namespace=namespace, allow_list=tokens)
+        for namespace, tokens in restricts["restricts"]
+    ]
+    numeric_restricts = []
+    for namespace, value, op in restricts["numeric_restricts"]:
+        numeric_restrict = IndexDatapoint.NumericRestriction(namespace=namespace, value_float=value)
+        if op is not None:
+            numeric_restrict.op = op
+        numeric_restricts.append(numeric_restrict)
+    datapoint.numeric_restricts = numeric_restricts
+    if restricts["crowding_attribute"] is not None:
+        datapoint.crowding_tag = IndexDatapoint.CrowdingTag(crowding_attribute=restricts["crowding_attribute"])
+
+
+def _parse_selectivities(value: str) -> list:
+    """Parse "selectivity:weight,..." into (selectivity, weight) pairs; a missing weight counts as 1."""
+    selectivities = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        selectivity, _, weight = item.partition(":")
+        selectivity = float(selectivity)
+        if not 0 < selectivity <= 1:
+            raise ValueError(f"Filter selectivity must be in (0, 1], got {selectivity}")
+        selectivities.append((selectivity, float(weight) if weight else 1.0))
+    return selectivities
+
+
+def get_restricts_generator(parsed_options):
+    """Return the worker's shared restricts generator, or None if no filters or crowding tags are configured."""
+    global _RESTRICTS_GENERATOR
+    if not parsed_options.filter_selectivity and not parsed_options.crowding_attribute_count:
+        return None
+    if _RESTRICTS_GENERATOR is None:
+        _RESTRICTS_GENERATOR = RestrictsGenerator(
+            _parse_selectivities(parsed_options.filter_selectivity) or [(1.0, 1.0)],
+            filter_type=parsed_options.filter_type,
+            namespace=parsed_options.filter_namespace,
+            num_tokens=parsed_options.filter_token_count,
+            numeric_namespace=parsed_options.numeric_filter_namespace,
+            crowding_attributes=parsed_options.crowding_attribute_count,
+        )
+    return _RESTRICTS_GENERATOR
+
+
+class RecallChecker:
+    """Checks the neighbors returned for sampled queries against exact nearest neighbors.
+
+    Exact neighbors are read from a ground-truth file aligned with the query
+    vector pool, or computed by brute force over a corpus of vectors. Brute
+    force scans the corpus in blocks with NumPy matmuls on gevent's thread
+    pool, so the event loop keeps sending requests while it runs.
+    """
+
+    # Checks allowed to queue for the thread pool before further samples are skipped
+    MAX_PENDING = 32
+
+    def __init__(self, sample_rate: float, corpus: np.ndarray = None, ids: list = None,
+                 ground_truth: list = None, distance: str = "COSINE_DISTANCE", block_size: int = 65536):
+        self.sample_rate = sample_rate
+        self.corpus = corpus
+        self.ids = ids
+        self.ground_truth = ground_truth
+        self.distance = distance
+        self.block_size = block_size
+        self.pending = 0
+        self.skipped = 0
+        self.norms = None
+        if corpus is not None and distance != "DOT_PRODUCT_DISTANCE":
+            # Corpus norms are needed for every cosine and L2 scan, so compute them once
+            self.norms = np.concatenate([
+                np.einsum("ij,ij->i", block, block)
+                for block in self._blocks()
+            ])
+            if distance == "COSINE_DISTANCE":
+                self.norms = np.sqrt(np.maximum(self.norms, 1e-24))
+
+    def _blocks(self):
+        for start in range(0, len(self.corpus), self.block_size):
+            yield np.asarray(self.corpus[start:start + self.block_size], dtype=np.float32)
+
+    def sample(self) -> bool:
+        """Return whether to check the next request."""
+        return random.random() < self.sample_rate
+
+    def exact_neighbors(self, vector: list, k: int) -> list:
+        """Return the ids of the `k` corpus vectors nearest to `vector`, nearest first."""
+        query = np.asarray(vector, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for block_index, block in enumerate(self._blocks()):
+            start = block_index * self.block_size
+            # Higher score is nearer for every distance type
+            scores = block @ query
+            if self.distance == "COSINE_DISTANCE":
+                scores /= self.norms[start:start + len(block)]
+            elif self.distance == "L2_SQUARED_DISTANCE":
+                scores = 2 * scores - self.norms[start:start + len(block)]
+            rows = np.concatenate([best_rows, np.arange(start, start + len(block))])
+            scores = np.concatenate([best_scores, scores])
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+                rows, scores = rows[top], scores[top]
+            best_rows, best_scores = rows, scores
+        nearest = best_rows[np.argsort(-best_scores)]
+        return [self.ids[row] if self.ids else str(row) for row in nearest]
+
+    def check(self, environment, pool_index: int, vector: list, neighbor_ids: list, k: int):
+        """Report recall@k for one query in a background greenlet."""
+        if self.ground_truth is not None and pool_index is None:
+            return
+        if self.pending >= self.MAX_PENDING:
+            self.skipped += 1
+            return
+        self.pending += 1
+        gevent.spawn(self._check, environment, pool_index, vector, neighbor_ids, k)
+
+    def _check(self, environment, pool_index: int, vector: list, neighbor_ids: list, k: int):
+        try:
+            if self.ground_truth is not None:
+                exact = self.ground_truth[pool_index % len(self.ground_truth)][:k]
+            else:
+                exact = gevent.get_hub().threadpool.apply(self.exact_neighbors, (vector, k))
+            if not exact:
+                return
+            recall = len(set(exact) & set(neighbor_ids[:k])) / len(exact)
+            report_metric("recall", f"recall@{k} (%)", recall * 100)
+        finally:
+            self.pending -= 1
+
+
+def _load_ground_truth(path: str) -> list:
+    """Read exact neighbor ids from a JSONL file with one line per query vector pool row.
+
+    Each line is a list of datapoint ids, nearest first, or an object with
+    such a list under "neighbors".
+    """
+    ground_truth = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                record = record["neighbors"]
+            ground_truth.append([str(datapoint_id) for datapoint_id in record])
+    return ground_truth
+
+
+def get_recall_checker(parsed_options, vector_pool, dimensions: int):
+    """Return the worker's shared recall checker, or None if recall checks are disabled."""
+    if parsed_options.recall_sample_rate <= 0:
+        return None
+    key = (
+        parsed_options.recall_sample_rate,
+        parsed_options.recall_corpus_file,
+        parsed_options.recall_corpus_ids_file,
+        parsed_options.recall_ground_truth_file,
+        parsed_options.recall_distance,
+    )
+    if key in _RECALL_CHECKER_CACHE:
+        return _RECALL_CHECKER_CACHE[key]
+
+    start_time = time.perf_counter()
+    if parsed_options.recall_ground_truth_file:
+        if vector_pool is None:
+            raise ValueError("--recall-ground-truth-file requires --query-vectors-file or --query-pool-size")
+        ground_truth = _load_ground_truth(parsed_options.recall_ground_truth_file)
+        if len(ground_truth) < vector_pool.size:
+            raise ValueError(f"Ground truth has {len(ground_truth)} rows but the query vector pool has {vector_pool.size}")
+        checker = RecallChecker(parsed_options.recall_sample_rate, ground_truth=ground_truth)
+    elif parsed_options.recall_corpus_file:
+        corpus = QueryVectorPool.from_file(parsed_options.recall_corpus_file, dimensions).vectors
+        ids = None
+        if parsed_options.recall_corpus_ids_file:
+            with open(parsed_options.recall_corpus_ids_file) as f:
+                ids = [line.strip() for line in f if line.strip()]
+            if len(ids) != len(corpus):
+                raise ValueError(f"Corpus has {len(corpus)} vectors but {len(ids)} ids")
+        checker = RecallChecker(
+            parsed_options.recall_sample_rate, corpus=corpus, ids=ids, distance=parsed_options.recall_distance
+        )
+    else:
+        raise ValueError("--recall-sample-rate requires --recall-corpus-file or --recall-ground-truth-file")
+    logging.info(f"Recall checks ready in {time.perf_counter() - start_time:.2f}s "
+                 f"(sample rate {parsed_options.recall_sample_rate})")
+
+    _RECALL_CHECKER_CACHE[key] = checker
+    return checker
+
+
+class FindNeighborsBodyTemplate:
+    """findNeighbors JSON body pre-encoded around placeholders for each query's feature vector.
+
+    The body is split into bytes around the vectors, so a request only encodes
+    the vectors themselves. With a query vector pool, `precompile` encodes a
+    complete body for every pool row once per worker.
+    """
+
+    _PLACEHOLDER = "__feature_vector__"
+
+    def __init__(self, request: dict):
+        request = copy.deepcopy(request)
+        for query in request["queries"]:
+            query["datapoint"]["featureVector"] = self._PLACEHOLDER
+        encoded = json.dumps(request, separators=(',', ':')).encode()
+        self.parts = encoded.split(json.dumps(self._PLACEHOLDER).encode())
+        self.num_vectors = len(self.parts) - 1
+
+    def render(self, feature_vectors: list) -> bytes:
+        """Return the complete body for one feature vector per query."""
+        pieces = [self.parts[0]]
+        for feature_vector, part in zip(feature_vectors, self.parts[1:]):
+            pieces.append(json.dumps(feature_vector, separators=(',', ':')).encode())
+            pieces.append(part)
+        return b''.join(pieces)
+
+    def precompile(self, pool: QueryVectorPool) -> list:
+        """Return a complete body for every row of the pool, indexed by the row of its first query."""
+        return [
+            self.render([pool.row(i + j) for j in range(self.num_vectors)])
+            for i in range(pool.size)
+        ]
+
+
+def get_precompiled_bodies(template: FindNeighborsBodyTemplate, pool: QueryVectorPool) -> list:
+    """Return the worker's shared precompiled bodies for this template and pool."""
+    key = (tuple(template.parts), id(pool))
+    if key not in _HTTP_BODY_POOL_CACHE:
+        start_time = time.perf_counter()
+        bodies = template.precompile(pool)
+        logging.info(f"Precompiled {len(bodies)} findNeighbors bodies ({sum(map(len, bodies)) / 1e6:.1f} MB) "
+                     f"in {time.perf_counter() - start_time:.2f}s")
+        _HTTP_BODY_POOL_CACHE[key] = bodies
+    return _HTTP_BODY_POOL_CACHE[key]
+
+
+class FindNeighborsRequestTemplate:
+    """Raw protobuf FindNeighborsRequest built once, with only the feature vectors replaced per request.
+
+    Bypasses proto-plus wrappers on the hot path. Serialized requests are sent
+    through a generic unary-unary stub; with a query vector pool, `precompile`
+    serializes a request for every pool row once per worker.
+    """
+
+    def __init__(self, index_endpoint: str, deployed_index_id: str, neighbor_count: int,
+                 fraction_leaf_nodes_to_search_override: float = 0.0, num_queries: int = 1,
+                 return_full_datapoint: bool = False, per_crowding_attribute_neighbor_count: int = 0):
+        query = FindNeighborsRequest.Query(
+            datapoint=IndexDatapoint(datapoint_id="0"),
+            neighbor_count=neighbor_count,
+        )
+        if fraction_leaf_nodes_to_search_override > 0:
+            query.fraction_leaf_nodes_to_search_override = fraction_leaf_nodes_to_search_override
+        if per_crowding_attribute_neighbor_count > 0:
+            query.per_crowding_attribute_neighbor_count = per_crowding_attribute_neighbor_count
+        request = FindNeighborsRequest(
+            index_endpoint=index_endpoint,
+            deployed_index_id=deployed_index_id,
+            queries=[query] * num_queries,
+            return_full_datapoint=return_full_datapoint,
+        )
+        self.message = FindNeighborsRequest.pb(request)
+        self.feature_vectors = [q.datapoint.feature_vector for q in self.message.queries]
+
+    def serialize(self, feature_vectors: list) -> bytes:
+        """Return the serialized request for one feature vector per query."""
+        for field, feature_vector in zip(self.feature_vectors, feature_vectors):
+            del field[:]
+            field.extend(feature_vector)
+        return self.message.SerializeToString()
+
+    def precompile(self, pool: QueryVectorPool) -> list:
+        """Return a serialized request for every row of the pool, indexed by the row of its first query."""
+        num_queries = len(self.feature_vectors)
+        return [
+            self.serialize([pool.row(i + j) for j in range(num_queries)])
+            for i in range(pool.size)
+        ]
+
+
+def get_serialized_requests(template: FindNeighborsRequestTemplate, pool: QueryVectorPool) -> list:
+    """Return the worker's shared pre-serialized requests for this template and pool."""
+    key = (template.message.SerializeToString(), id(pool))
+    if key not in _GRPC_REQUEST_POOL_CACHE:
+        start_time = time.perf_counter()
+        requests = template.precompile(pool)
+        logging.info(f"Pre-serialized {len(requests)} FindNeighborsRequests ({sum(map(len, requests)) / 1e6:.1f} MB) "
+                     f"in {time.perf_counter() - start_time:.2f}s")
+        _GRPC_REQUEST_POOL_CACHE[key] = requests
+    return _GRPC_REQUEST_POOL_CACHE[key]
+
+
+class ArrivalSchedule:
+    """Open-loop arrival schedule shared by all users on a worker.
+
+    Arrivals follow a fixed-interval or Poisson process at `rate` per second,
+    independent of how long requests take. Each user claims the next arrival
+    and waits for its intended start time. Arrivals that no user picks up
+    within `max_lag` seconds are dropped and counted, so overload shows up as
+    lag and drops rather than as a silently lower offered load.
+    """
+
+    def __init__(self, distribution: str = "poisson", max_lag: float = 1.0):
+        self.distribution = distribution
+        self.max_lag = max_lag
+        self.rate = 0.0
+        self.next_arrival = None
+        self.dropped = 0
+
+    def set_rate(self, rate: float):
+        """Change the arrival rate, restarting the schedule from now."""
+        self.rate = rate
+        self.next_arrival = None
+
+    def _interval(self) -> float:
+        if self.distribution == "poisson":
+            return random.expovariate(self.rate)
+        return 1.0 / self.rate
+
+    def claim(self):
+        """Claim the next arrival and return its intended start time on the `time.perf_counter` clock.
+
+        Returns None if no rate has been set yet.
+        """
+        if self.rate <= 0:
+            return None
+        now = time.perf_counter()
+        if self.next_arrival is None:
+            self.next_arrival = now
+        overdue = now - self.max_lag - self.next_arrival
+        if overdue > 0:
+            # Skip every arrival that is already too late to send
+            skipped = int(overdue * self.rate) + 1
+            self.dropped += skipped
+            self.next_arrival += skipped / self.rate
+        intended_start = self.next_arrival
+        self.next_arrival += self._interval()
+        return intended_start
+
+class DatapointWriter:
+    """Upsert and remove traffic shared by all users on a worker.
+
+    Writes are limited to `rate` requests per second by a token bucket that
+    holds up to a second of tokens (unlimited when the rate is 0). They only
+    run during the first `active_seconds` of each active/quiet cycle, or all
+    the time when `quiet_seconds` is 0. Upserted ids are remembered so that
+    removes only delete datapoints this worker added, oldest first. The
+    writer also tracks when writes last ran, so queries can be tagged as sent
+    during ingest or quiet periods.
+    """
+
+    # Upserted ids remembered for removal; older ids are forgotten beyond this
+    MAX_TRACKED_IDS = 1_000_000
+
+    def __init__(self, id_prefix: str, batch_size: int = 10, remove_fraction: float = 0.5,
+                 active_seconds: float = 0, quiet_seconds: float = 0, ingest_window: float = 5.0):
+        # A random part keeps ids unique across workers and runs
+        self.id_prefix = f"{id_prefix}{uuid.uuid4().hex[:8]}-"
+        self.batch_size = batch_size
+        self.remove_fraction = remove_fraction
+        self.active_seconds = active_seconds
+        self.quiet_seconds = quiet_seconds
+        self.ingest_window = ingest_window
+        self.rate = 0.0
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+        self.upserted = collections.deque(maxlen=self.MAX_TRACKED_IDS)
+        self.next_id = 0
+        self.inflight = 0
+        self.last_write = None
+
+    def set_rate(self, rate: float):
+        """Change the write rate limit, in requests per second on this worker."""
+        self.rate = rate
+        self.tokens = min(self.tokens, max(rate, 1.0))
+
+    def writes_allowed(self) -> bool:
+        """Return whether the wall clock is in the active part of the write cycle."""
+        if self.quiet_seconds <= 0:
+            return True
+        return time.time() % (self.active_seconds + self.quiet_seconds) < self.active_seconds
+
+    def acquire(self) -> bool:
+        """Take a token for one write request, returning False if the rate limit is reached."""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.last_refill) * self.rate, max(self.rate, 1.0))
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def next_operation(self) -> tuple:
+        """Return ("remove", ids) of datapoints upserted earlier, or ("upsert", ids) of new datapoints."""
+        if len(self.upserted) >= self.batch_size and random.random() < self.remove_fraction:
+            return "remove", [self.upserted.popleft() for _ in range(self.batch_size)]
+        ids = [f"{self.id_prefix}{self.next_id + i}" for i in range(self.batch_size)]
+        self.next_id += self.batch_size
+        return "upsert", ids
+
+    def write_started(self):
+        self.inflight += 1
+
+    def write_finished(self, operation: str, ids: list, success: bool):
+        """Record a completed write, remembering the ids of successful upserts for later removal."""
+        self.inflight -= 1
+        self.last_write = time.monotonic()
+        if operation == "upsert" and success:
+            self.upserted.extend(ids)
+
+    def ingest_active(self) -> bool:
+        """Return whether a write is in flight or finished within the last `ingest_window` seconds."""
+        if self.inflight > 0:
+            return True
+        return self.last_write is not None and time.monotonic() - self.last_write < self.ingest_window
+
+
+def get_datapoint_writer(parsed_options) -> DatapointWriter:
+    """Return the worker's shared datapoint writer, created on first use."""
+    global _DATAPOINT_WRITER
+    if _DATAPOINT_WRITER is None:
+        if not config.index_name:
+            raise ValueError("--write-ratio requires INDEX_ID in the configuration")
+        _DATAPOINT_WRITER = DatapointWriter(
+            parsed_options.write_id_prefix,
+            batch_size=parsed_options.upsert_batch_size,
+            remove_fraction=parsed_options.remove_fraction,
+            active_seconds=parsed_options.write_active_seconds,
+            quiet_seconds=parsed_options.write_quiet_seconds,
+            ingest_window=parsed_options.ingest_window,
+        )
+        _DATAPOINT_WRITER.set_rate(_WRITE_RATE)
+    return _DATAPOINT_WRITER
+
+
+def write_endpoint(parsed_options) -> str:
+    """Return the host that upserts and removes are sent to, the regional Vertex AI API by default."""
+    return parsed_options.write_endpoint or f"{config.region}-aiplatform.googleapis.com"
+
+
+def report_metric(kind: str, name: str, value: float, exception: Exception = None):
+    """Record a client-side measurement in this process's ClientMetrics.
+
+    Measurements are kept out of Locust's request stats, so they never count
+    towards requests per second, failure ratios or latency percentiles.
+    """
+    get_client_metrics().record(kind, name, value, failed=exception is not None)
+
+
+def report_startup_metric(environment, name: str, milliseconds: float):
+    """Report a startup timing as a "startup" client metric, with --startup-metrics."""
+    if environment.parsed_options.startup_metrics:
+        report_metric("startup", name, milliseconds)
+
+
+class WorkerProfiler:
+    """Hot-path instrumentation for one load generator process.
+
+    Measures event loop lag with a greenlet that sleeps `lag_interval`
+    seconds and records how late it wakes up, process CPU time, and the
+    exclusive time spent in named sections of the request path (a nested
+    section pauses its parent). Sections share one stack across greenlets,
+    so code inside them that yields must do so within `suspended`; other
+    greenlets' work until it resumes would be charged to the section. With `sample_interval` set, a SIGPROF timer
+    also samples the interrupted Python stack every `sample_interval` seconds
+    of CPU time, for a flame graph of where the worker spends its CPU.
+    """
+
+    def __init__(self, lag_interval: float = 0.1, sample_interval: float = 0.0):
+        self.lag_interval = lag_interval
+        self.sample_interval = sample_interval
+        self.sections = {}
+        self.stack = []
+        self.stacks = collections.Counter()
+        self._reset()
+        self.lag_greenlet = gevent.spawn(self._sample_lag)
+        if sample_interval > 0:
+            signal.signal(signal.SIGPROF, self._sample_stack)
+            signal.setitimer(signal.ITIMER_PROF, sample_interval, sample_interval)
+
+    def _reset(self):
+        self.section_times = collections.Counter()
+        self.mark = time.perf_counter()
+        self.wall_start = self.mark
+        self.cpu_start = time.process_time()
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_samples = 0
+
+    def section(self, name: str) -> "_ProfileSection":
+        """Return a context manager that charges the time spent inside it to section `name`."""
+        if name not in self.sections:
+            self.sections[name] = _ProfileSection(self, name)
+        return self.sections[name]
+
+    def _enter(self, name: str):
+        now = time.perf_counter()
+        if self.stack:
+            self.section_times[self.stack[-1]] += now - self.mark
+        self.stack.append(name)
+        self.mark = now
+
+    def _exit(self, name: str):
+        now = time.perf_counter()
+        # Sections only yield within suspended(), so exits match; never let a mismatched one corrupt the stack
+        if self.stack and self.stack[-1] == name:
+            self.section_times[name] += now - self.mark
+            self.stack.pop()
+        self.mark = now
+
+    @contextlib.contextmanager
+    def suspended(self):
+        """Close this greenlet's open sections while it yields, and reopen them when it resumes."""
+        now = time.perf_counter()
+        if self.stack:
+            self.section_times[self.stack[-1]] += now - self.mark
+        # Other greenlets close their sections, or suspend them too, so the stack is empty when this one resumes
+        stack, self.stack = self.stack, []
+        self.mark = now
+        try:
+            yield
+        finally:
+            self.stack = stack
+            self.mark = time.perf_counter()
+
+    def _sample_lag(self):
+        while True:
+            start = time.perf_counter()
+            gevent.sleep(self.lag_interval)
+            lag = max(time.perf_counter() - start - self.lag_interval, 0.0)
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_samples += 1
+
+    def _sample_stack(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def take_report(self) -> dict:
+        """Return CPU, loop lag and per-section time since the last report, and start a new period.
+
+        CPU and section times are percentages of one core over the period;
+        `other` is CPU time outside any section.
+        """
+        wall = max(time.perf_counter() - self.wall_start, 1e-9)
+        cpu_percent = 100 * (time.process_time() - self.cpu_start) / wall
+        sections = {name: 100 * seconds / wall for name, seconds in self.section_times.items()}
+        sections["other"] = max(cpu_percent - sum(sections.values()), 0.0)
+        report = {
+            "cpu_percent": cpu_percent,
+            "loop_lag_mean_ms": 1000 * self.lag_total / self.lag_samples if self.lag_samples else 0.0,
+            "loop_lag_max_ms": 1000 * self.lag_max,
+            "sections": sections,
+        }
+        self._reset()
+        return report
+
+    def stop(self, sample_path: str = ""):
+        """Stop sampling, and write the sampled stacks in folded format (one "stack count" line each)."""
+        self.lag_greenlet.kill(block=False)
+        if self.sample_interval <= 0:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        if sample_path:
+            with open(sample_path, "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logging.info(f"Wrote {sum(self.stacks.values())} profile samples to {sample_path}")
+
+
+class _ProfileSection:
+    """Context manager for one WorkerProfiler section; holds no state, so it can be shared."""
+
+    __slots__ = ("profiler", "name")
+
+    def __init__(self, profiler: WorkerProfiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+
+    def __exit__(self, *exc_info):
+        self.profiler._exit(self.name)
+
+
+# Returned by profile_section when profiling is off
+_NULL_SECTION = contextlib.nullcontext()
+
+
+def profile_section(name: str):
+    """Return a context manager charging its time to the worker profiler's `name` section, or a no-op."""
+    if _WORKER_PROFILER is None:
+        return _NULL_SECTION
+    return _WORKER_PROFILER.section(name)
+
+
+def profile_yield():
+    """Return a context manager for code inside profile sections that yields to other greenlets, or a no-op."""
+    if _WORKER_PROFILER is None:
+        return _NULL_SECTION
+    return _WORKER_PROFILER.suspended()
+
+
+class ClientBoundMonitor:
+    """Master-side view of worker profiles, warning when a worker rather than the endpoint limits the load.
+
+    A worker is client-bound when its process uses at least `cpu_percent` of
+    a core, or its event loop lags by at least `loop_lag_ms` on average.
+    Latency it measures then includes time spent waiting on its own CPU.
+    """
+
+    # Seconds between repeated warnings about the same worker
+    WARNING_INTERVAL = 60
+
+    def __init__(self, environment, cpu_percent: float = 90.0, loop_lag_ms: float = 50.0):
+        self.environment = environment
+        self.cpu_percent = cpu_percent
+        self.loop_lag_ms = loop_lag_ms
+        self.warned = {}
+        self.peaks = {}
+
+    def update(self, worker: str, profile: dict):
+        """Record one worker's profile report, adding it to the stats and warning if the worker is client-bound."""
+        report_metric("worker-profile", "cpu (% of a core)", profile["cpu_percent"])
+        report_metric("worker-profile", "loop lag (ms)", profile["loop_lag_mean_ms"])
+        peak_cpu, peak_lag = self.peaks.get(worker, (0.0, 0.0))
+        self.peaks[worker] = (max(peak_cpu, profile["cpu_percent"]), max(peak_lag, profile["loop_lag_max_ms"]))
+
+        client_bound = (profile["cpu_percent"] >= self.cpu_percent
+                        or profile["loop_lag_mean_ms"] >= self.loop_lag_ms)
+        now = time.monotonic()
+        if not client_bound or now - self.warned.get(worker, -math.inf) < self.WARNING_INTERVAL:
+            return
+        self.warned[worker] = now
+        sections = ", ".join(
+            f"{name} {percent:.0f}%"
+            for name, percent in sorted(profile["sections"].items(), key=lambda item: -item[1])
+        )
+        logging.warning(
+            f"Worker {worker} is client-bound: CPU {profile['cpu_percent']:.0f}% of a core, event loop lag "
+            f"{profile['loop_lag_mean_ms']:.1f} ms mean / {profile['loop_lag_max_ms']:.1f} ms max "
+            f"(time in {sections}). Its latency includes client-side queueing; add workers or lower "
+            f"the users per worker."
+        )
+
+    def summary(self):
+        """Log each worker's peak CPU and loop lag over the run."""
+        for worker, (peak_cpu, peak_lag) in sorted(self.peaks.items()):
+            logging.info(f"Worker {worker} profile: peak CPU {peak_cpu:.0f}% of a core, "
+                         f"peak event loop lag {peak_lag:.1f} ms")
+
+
+def _parse_query_record(record: dict) -> dict:
+    """Normalize one replayed query into feature_vector, sparse_embedding and neighbor_count.
+
+    Accepts either a bare datapoint or a findNeighbors query with a nested
+    `datapoint`, in camelCase (REST) or snake_case (proto) field names.
+    """
+    datapoint = record.get('datapoint', record)
+    sparse_embedding = datapoint.get('sparseEmbedding', datapoint.get('sparse_embedding'))
+    if sparse_embedding is not None:
+        sparse_embedding = {
+            'values': sparse_embedding['values'],
+            'dimensions': [int(d) for d in sparse_embedding['dimensions']],
+        }
+    return {
+        'feature_vector': datapoint.get('featureVector', datapoint.get('feature_vector')),
+        'sparse_embedding': sparse_embedding,
+        'neighbor_count': record.get('neighborCount', record.get('neighbor_count')),
+    }
+
+
+def stream_query_records(path: str, shard_index: int = 0, shard_count: int = 1, loop: bool = False):
+    """Lazily yield parsed query records from a JSONL file.
+
+    Only every `shard_count`-th line starting at `shard_index` is parsed, so
+    each worker replays a disjoint slice of the log without reading it into
+    memory. With `loop`, the file is re-opened at EOF.
+    """
+    while True:
+        found = False
+        with open(path, 'r') as f:
+            for line_number, line in enumerate(f):
+                if line_number % shard_count != shard_index:
+                    continue
+                line = line.strip()
+                if not line:
+                    continue
+                found = True
+                yield _parse_query_record(json.loads(line))
+        if not loop or not found:
+            return
+
+
+def get_query_replay(parsed_options):
+    """Return the worker's shared replay generator, or None if replay is disabled."""
+    global _QUERY_REPLAY
+    if not parsed_options.replay_file:
+        return None
+    if _QUERY_REPLAY is None:
+        shard_index, shard_count = _QUERY_REPLAY_SHARD
+        _QUERY_REPLAY = stream_query_records(
+            parsed_options.replay_file,
+            shard_index=shard_index,
+            shard_count=shard_count,
+            loop=parsed_options.replay_at_eof == "loop",
+        )
+        logging.info(f"Replaying queries from {parsed_options.replay_file} (shard {shard_index} of {shard_count})")
+    return _QUERY_REPLAY
+
+
+class ParameterMatrix:
+    """Grid of query parameters that a run cycles through, one cell at a time.
+
+    Every combination of the configured neighbor counts, leaf fractions,
+    return_full_datapoint values and queries per request is a cell. Cells are
+    held for `cell_time` seconds each, in order, counted from the run's start
+    time so that all workers switch together. Each cell has a label that is
+    appended to request names, giving every cell its own rows in the stats.
+    """
+
+    def __init__(self, num_neighbors: list, fraction_leaf_nodes: list, return_full_datapoint: list,
+                 queries_per_request: list, cell_time: float):
+        self.cell_time = cell_time
+        self.cells = []
+        for k, leaf, full, batch in itertools.product(
+            num_neighbors, fraction_leaf_nodes, return_full_datapoint, queries_per_request
+        ):
+            # Only the parameters that vary are named in the label
+            label = []
+            if len(num_neighbors) > 1:
+                label.append(f"k={k}")
+            if len(fraction_leaf_nodes) > 1:
+                label.append(f"leaf={leaf:g}")
+            if len(return_full_datapoint) > 1:
+                label.append(f"full={str(full).lower()}")
+            if len(queries_per_request) > 1:
+                label.append(f"q={batch}")
+            self.cells.append({
+                "num_neighbors": k,
+                "fraction_leaf_nodes_to_search_override": leaf,
+                "return_full_datapoint": full,
+                "queries_per_request": batch,
+                "label": "[" + " ".join(label) + "]",
+            })
+        self.current_index = None
+
+    def current(self) -> dict:
+        """Return the cell for the current time, logging whenever this process moves to a new one."""
+        global _PARAMETER_MATRIX_START
+        if _PARAMETER_MATRIX_START is None:
+            # No start time from the master yet
+            _PARAMETER_MATRIX_START = time.time()
+        index = int((time.time() - _PARAMETER_MATRIX_START) // self.cell_time) % len(self.cells)
+        if index != self.current_index:
+            self.current_index = index
+            logging.info(f"Parameter matrix cell {index + 1} of {len(self.cells)}: {self.cells[index]['label']}")
+        return self.cells[index]
+
+
+def _parse_list(value: str, parse: Callable) -> list:
+    """Parse a comma-separated option value, dropping duplicates but keeping the given order."""
+    values = [parse(item.strip()) for item in value.split(",") if item.strip()]
+    return list(dict.fromkeys(values))
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in ("true", "1", "yes"):
+        return True
+    if value.lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"Expected true or false, got {value!r}")
+
+
+def parameter_matrix_configured(parsed_options) -> bool:
+    return any([
+        parsed_options.matrix_num_neighbors,
+        parsed_options.matrix_leaf_fractions,
+        parsed_options.matrix_return_full_datapoint,
+        parsed_options.matrix_queries_per_request,
+    ])
+
+
+def get_parameter_matrix(parsed_options):
+    """Return the worker's shared parameter matrix, or None if no matrix is configured.
+
+    Parameters without a --matrix-* list keep their single configured value.
+    """
+    global _PARAMETER_MATRIX
+    if not parameter_matrix_configured(parsed_options):
+        return None
+    if _PARAMETER_MATRIX is None:
+        _PARAMETER_MATRIX = ParameterMatrix(
+            _parse_list(parsed_options.matrix_num_neighbors, int) or [parsed_options.num_neighbors],
+            _parse_list(parsed_options.matrix_leaf_fractions, float)
+            or [parsed_options.fraction_leaf_nodes_to_search_override],
+            _parse_list(parsed_options.matrix_return_full_datapoint, _parse_bool)
+            or [parsed_options.return_full_datapoint],
+            _parse_list(parsed_options.matrix_queries_per_request, int)
+            or [max(parsed_options.num_embeddings_per_request, 1)],
+            parsed_options.matrix_cell_time,
+        )
+        logging.info(f"Parameter matrix of {len(_PARAMETER_MATRIX.cells)} cells, "
+                     f"{parsed_options.matrix_cell_time:g}s each")
+    return _PARAMETER_MATRIX
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram with fixed memory, in the style of HdrHistogram.
+
+    Response times are recorded in microseconds into buckets whose width is
+    proportional to their value, so every value up to `highest_ms` keeps
+    `significant_figures` decimal digits of precision. Histograms with the
+    same settings merge by adding their counts, which keeps high percentiles
+    exact across workers instead of averaging rounded ones.
+    """
+
+    def __init__(self, significant_figures: int = 3, highest_ms: float = 3_600_000):
+        # Enough linear sub-buckets per power of two to tell apart 10^significant_figures steps
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.half_count = 1 << (self.sub_bucket_bits - 1)
+        self.highest = int(highest_ms * 1000)
+        self.counts = np.zeros(self._index(self.highest) + 1, dtype=np.int64)
+        self.max_value = 0
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return shift * self.half_count + (value >> shift)
+
+    def _highest_equivalent(self, index: int) -> int:
+        if index < 2 * self.half_count:
+            return index
+        shift = (index >> (self.sub_bucket_bits - 1)) - 1
+        return ((index - shift * self.half_count + 1) << shift) - 1
+
+    def record(self, value_ms: float):
+        """Record one response time in milliseconds, clamped to the histogram's range."""
+        value = min(max(int(value_ms * 1000), 0), self.highest)
+        self.counts[self._index(value)] += 1
+        if value > self.max_value:
+            self.max_value = value
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add another histogram with the same settings into this one."""
+        self.counts += other.counts
+        self.max_value = max(self.max_value, other.max_value)
+
+    def percentile(self, percentile: float) -> float:
+        """Return the response time in milliseconds at or below which `percentile` percent of values fall."""
+        cumulative = np.cumsum(self.counts)
+        total = int(cumulative[-1])
+        if total == 0:
+            return 0.0
+        rank = max(math.ceil(percentile / 100 * total), 1)
+        index = int(np.searchsorted(cumulative, rank))
+        return min(self._highest_equivalent(index), self.max_value) / 1000
+
+    def encode(self) -> bytes:
+        """Return the histogram as compressed, sparse (bucket, count) pairs."""
+        indexes = np.flatnonzero(self.counts)
+        return zlib.compress(
+            struct.pack("<Q", self.max_value)
+            + indexes.astype(np.uint32).tobytes()
+            + self.counts[indexes].tobytes()
+        )
+
+    @classmethod
+    def decode(cls, payload: bytes, significant_figures: int = 3, highest_ms: float = 3_600_000) -> "LatencyHistogram":
+        """Rebuild a histogram from `encode` output."""
+        histogram = cls(significant_figures, highest_ms)
+        raw = zlib.decompress(payload)
+        (histogram.max_value,) = struct.unpack_from("<Q", raw)
+        num_buckets = (len(raw) - 8) // 12
+        indexes = np.frombuffer(raw, dtype=np.uint32, count=num_buckets, offset=8)
+        histogram.counts[indexes] = np.frombuffer(raw, dtype=np.int64, count=num_buckets, offset=8 + 4 * num_buckets)
+        return histogram
+
+
+class LatencyRecorder:
+    """Per-worker latency histograms for every request type and name, shipped to the master as snapshots.
+
+    A recorder created with `recording=False`, as during a warm-up window,
+    ignores requests until `reset` is called.
+    """
+
+    def __init__(self, significant_figures: int = 3, recording: bool = True):
+        self.significant_figures = significant_figures
+        self.recording = recording
+        self.histograms = {}
+
+    def record(self, request_type: str, name: str, response_time: float):
+        if not self.recording:
+            return
+        key = (request_type, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram(self.significant_figures)
+        histogram.record(response_time)
+
+    def snapshot(self) -> list:
+        """Return [request_type, name, encoded histogram] entries recorded since the last snapshot, and reset."""
+        entries = [
+            [request_type, name, histogram.encode()]
+            for (request_type, name), histogram in self.histograms.items()
+        ]
+        self.histograms = {}
+        return entries
+
+    def reset(self):
+        """Drop everything not yet snapshotted, after a stats reset, and start recording."""
+        self.histograms = {}
+        self.recording = True
+
+
+class LatencyHistogramAggregator:
+    """Merges worker latency snapshots per time window and exports high percentiles.
+
+    Windows are summarized into table rows once snapshots for a window two
+    windows later arrive, so the master only keeps a few windows of
+    histograms in memory, plus one run-wide histogram per request name.
+    """
+
+    PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+    def __init__(self, path: str, significant_figures: int = 3, window: float = 10.0):
+        self.path = path
+        self.significant_figures = significant_figures
+        self.window = window
+        self.open_windows = {}
+        self.totals = {}
+        self.rows = []
+        self.updated = False
+
+    def merge(self, window_start: float, entries: list):
+        """Merge one worker's snapshot for the window starting at `window_start` (epoch seconds)."""
+        histograms = self.open_windows.setdefault(window_start, {})
+        for request_type, name, payload in entries:
+            histogram = LatencyHistogram.decode(payload, self.significant_figures)
+            for merged in (histograms, self.totals):
+                key = (request_type, name)
+                if key in merged:
+                    merged[key].merge(histogram)
+                else:
+                    merged[key] = copy.deepcopy(histogram)
+        self.updated = True
+        for start in sorted(self.open_windows):
+            if start < window_start - self.window:
+                self._close_window(start)
+
+    def reset_totals(self):
+        """Restart the run-wide histograms after a stats reset; rows of windows before it are kept."""
+        self.totals = {}
+        self.updated = True
+
+    def _row(self, window_label: str, request_type: str, name: str, histogram: LatencyHistogram) -> list:
+        return [window_label, request_type, name, histogram.count] + [
+            round(histogram.percentile(p), 3) for p in self.PERCENTILES
+        ] + [histogram.max_value / 1000]
+
+    def _window_rows(self, window_start: float) -> list:
+        label = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(window_start))
+        return [
+            self._row(label, request_type, name, histogram)
+            for (request_type, name), histogram in sorted(self.open_windows[window_start].items())
+        ]
+
+    def _close_window(self, window_start: float):
+        self.rows += self._window_rows(window_start)
+        del self.open_windows[window_start]
+
+    def export(self):
+        """Write per-window and run-wide rows to the CSV file, and log the run-wide percentiles.
+
+        Windows still open are summarized without closing them, so a later
+        export can include snapshots that arrive after the test stops.
+        """
+        rows = self.rows + [row for start in sorted(self.open_windows) for row in self._window_rows(start)]
+        totals = [
+            self._row("total", request_type, name, histogram)
+            for (request_type, name), histogram in sorted(self.totals.items())
+        ]
+        with open(self.path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["window_start", "type", "name", "count"]
+                + [f"p{p}" for p in self.PERCENTILES] + ["max"]
+            )
+            writer.writerows(rows + totals)
+        for _, request_type, name, count, *percentiles, max_ms in totals:
+            logging.info(
+                f"HDR {request_type} {name}: {count} requests, "
+                + ", ".join(f"p{p}={v:.3f}ms" for p, v in zip(self.PERCENTILES, percentiles))
+                + f", max={max_ms:.3f}ms"
+            )
+        logging.info(f"Wrote HDR latency percentiles to {self.path}")
+        self.updated = False
+
+
+# Precision of the per-second latency histograms in the result files
+RESULT_SIGNIFICANT_FIGURES = 2
+
+# Precision and range of client metric histograms; the range is in the histogram's millisecond units, and
+# wide enough for byte counts
+CLIENT_METRIC_SIGNIFICANT_FIGURES = 2
+CLIENT_METRIC_HIGHEST = 1e9
+
+
+class ClientMetrics:
+    """Client-side measurements such as recall, payload sizes, CPU use and schedule lag.
+
+    Reported as requests, these values would count towards requests per
+    second and failure ratios and mix into latency percentiles. Here each
+    (kind, name) keeps a count, failures, sum, min, max and a
+    2-significant-figure histogram instead. Workers send what they recorded
+    since their last report to the master, which merges it, logs a table on
+    exit and writes it to `<--csv prefix>_client_metrics.csv`.
+    """
+
+    COLUMNS = ["kind", "name", "count", "failures", "per_second", "mean", "min", "p50", "p90", "p99", "max"]
+
+    def __init__(self):
+        self.entries = {}
+        self.start_time = time.time()
+
+    def _entry(self, kind: str, name: str) -> list:
+        entry = self.entries.get((kind, name))
+        if entry is None:
+            # count, failures, sum, min, max, histogram
+            entry = self.entries[(kind, name)] = [
+                0, 0, 0.0, math.inf, -math.inf,
+                LatencyHistogram(CLIENT_METRIC_SIGNIFICANT_FIGURES, CLIENT_METRIC_HIGHEST),
+            ]
+        return entry
+
+    def record(self, kind: str, name: str, value: float, failed: bool = False):
+        entry = self._entry(kind, name)
+        entry[0] += 1
+        entry[1] += failed
+        entry[2] += value
+        entry[3] = min(entry[3], value)
+        entry[4] = max(entry[4], value)
+        entry[5].record(value)
+
+    def take(self) -> list:
+        """Return [kind, name, count, failures, sum, min, max, encoded histogram] entries, and reset."""
+        entries = [
+            [kind, name, count, failures, total, minimum, maximum, histogram.encode()]
+            for (kind, name), (count, failures, total, minimum, maximum, histogram) in self.entries.items()
+        ]
+        self.entries = {}
+        return entries
+
+    def merge(self, entries: list):
+        """Add `take` output from a worker."""
+        for kind, name, count, failures, total, minimum, maximum, payload in entries:
+            entry = self._entry(kind, name)
+            entry[0] += count
+            entry[1] += failures
+            entry[2] += total
+            entry[3] = min(entry[3], minimum)
+            entry[4] = max(entry[4], maximum)
+            entry[5].merge(LatencyHistogram.decode(payload, CLIENT_METRIC_SIGNIFICANT_FIGURES, CLIENT_METRIC_HIGHEST))
+
+    def reset(self, keep: tuple = ()):
+        """Drop every entry except those of the kinds in `keep`, and restart the per-second rate."""
+        self.entries = {key: entry for key, entry in self.entries.items() if key[0] in keep}
+        self.start_time = time.time()
+
+    def rows(self) -> list:
+        """Return one dict per (kind, name) with the columns in COLUMNS."""
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        rows = []
+        for (kind, name), (count, failures, total, minimum, maximum, histogram) in sorted(self.entries.items()):
+            rows.append({
+                "kind": kind,
+                "name": name,
+                "count": count,
+                "failures": failures,
+                "per_second": round(count / elapsed, 2),
+                "mean": float(f"{total / count:.4g}"),
+                "min": float(f"{minimum:.4g}"),
+                "p50": float(f"{histogram.percentile(50):.4g}"),
+                "p90": float(f"{histogram.percentile(90):.4g}"),
+                "p99": float(f"{histogram.percentile(99):.4g}"),
+                "max": float(f"{maximum:.4g}"),
+            })
+        return rows
+
+    def log_table(self):
+        rows = self.rows()
+        if not rows:
+            return
+        lines = [f"{'kind':<16} {'name':<44} " + " ".join(f"{column:>10}" for column in self.COLUMNS[2:])]
+        for row in rows:
+            lines.append(f"{row['kind']:<16} {row['name']:<44} "
+                         + " ".join(f"{row[column]:>10}" for column in self.COLUMNS[2:]))
+        logging.info("Client metrics:\n" + "\n".join(lines))
+
+    def write_csv(self, path: str):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+
+def get_client_metrics() -> ClientMetrics:
+    """Return this process's client metrics, created on first use."""
+    global _CLIENT_METRICS
+    if _CLIENT_METRICS is None:
+        _CLIENT_METRICS = ClientMetrics()
+    return _CLIENT_METRICS
+
+
+class ResultRecorder:
+    """Per-worker source of the result files: sampled request records and per-second aggregates.
+
+    Every request is added to an aggregate for its second, request type and
+    name, with a 2-significant-figure latency histogram for percentiles. A
+    `sample_rate` fraction is also kept as individual records, up to
+    `max_records` between sends; records beyond that are dropped and counted
+    so a slow master cannot grow the worker's memory without bound. A
+    recorder created with `recording=False`, as during a warm-up window,
+    ignores requests until `reset` is called.
+    """
+
+    def __init__(self, sample_rate: float, max_records: int = 100_000, recording: bool = True):
+        self.sample_rate = sample_rate
+        self.max_records = max_records
+        self.recording = recording
+        self.records = []
+        self.dropped = 0
+        self.seconds = {}
+
+    def record(self, request_type: str, name: str, response_time: float, response_length: int,
+               exception: Exception = None):
+        if not self.recording:
+            return
+        now = time.time()
+        key = (int(now), request_type, name)
+        aggregate = self.seconds.get(key)
+        if aggregate is None:
+            # failures, total response time, min response time, response bytes, histogram
+            aggregate = self.seconds[key] = [0, 0.0, math.inf, 0, LatencyHistogram(RESULT_SIGNIFICANT_FIGURES)]
+        if exception is not None:
+            aggregate[0] += 1
+        aggregate[1] += response_time
+        aggregate[2] = min(aggregate[2], response_time)
+        aggregate[3] += response_length or 0
+        aggregate[4].record(response_time)
+
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            if len(self.records) >= self.max_records:
+                self.dropped += 1
+                return
+            self.records.append([
+                now, request_type, name, response_time, response_length or 0,
+                exception is None, "" if exception is None else str(exception),
+            ])
+
+    def take(self, final: bool = False) -> dict:
+        """Return and clear the sampled records and the aggregates of completed seconds, or of all seconds if `final`."""
+        current_second = math.inf if final else int(time.time())
+        seconds = []
+        for key in [key for key in self.seconds if key[0] < current_second]:
+            failures, total, minimum, response_bytes, histogram = self.seconds.pop(key)
+            seconds.append(list(key) + [failures, total, minimum, response_bytes, histogram.encode()])
+        data = {"records": self.records, "seconds": seconds, "dropped": self.dropped}
+        self.records = []
+        self.dropped = 0
+        return data
+
+    def reset(self):
+        """Drop the records and aggregates not yet sent, after a stats reset, and start recording."""
+        self.records = []
+        self.dropped = 0
+        self.seconds = {}
+        self.recording = True
+
+
+class _ResultFileWriter:
+    """Appends batches of rows to one Parquet file, as a row group per batch, or to one CSV file."""
+
+    def __init__(self, path: str, columns: list):
+        self.path = path
+        self.names = [name for name, _ in columns]
+        self.rows = 0
+        if path.endswith(".parquet"):
+            self.schema = pyarrow.schema([(name, pyarrow.type_for_alias(kind)) for name, kind in columns])
+            self.parquet_writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+            self.csv_file = None
+        else:
+            self.parquet_writer = None
+            self.csv_file = open(path, "w", newline="")
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(self.names)
+
+    def write(self, rows: list):
+        if not rows:
+            return
+        self.rows += len(rows)
+        if self.parquet_writer is not None:
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(zip(*rows), self.schema)],
+                schema=self.schema,
+            )
+            self.parquet_writer.write_table(table)
+        else:
+            self.csv_writer.writerows(rows)
+            self.csv_file.flush()
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        else:
+            self.csv_file.close()
+
+
+class ResultSink:
+    """Streams worker results to a request file and a per-second aggregate file on the master.
+
+    Sampled records are buffered and written once `flush_rows` of them are
+    waiting or `flush` is called. Aggregates from different workers for the
+    same second are merged, and a second is written once it is `lateness`
+    seconds old, so every worker's send for it has arrived. Files are
+    Parquet or CSV, with columns given as (name, Arrow type alias) pairs.
+    """
+
+    REQUEST_COLUMNS = [
+        ("timestamp", "double"), ("worker", "string"), ("request_type", "string"), ("name", "string"),
+        ("response_time_ms", "double"), ("response_length", "int64"), ("success", "bool"), ("error", "string"),
+    ]
+    SECOND_COLUMNS = [
+        ("second", "int64"), ("request_type", "string"), ("name", "string"), ("requests", "int64"),
+        ("failures", "int64"), ("mean_ms", "double"), ("min_ms", "double"), ("p50_ms", "double"),
+        ("p90_ms", "double"), ("p99_ms", "double"), ("max_ms", "double"), ("response_bytes", "int64"),
+    ]
+
+    def __init__(self, directory: str, run_id: str, file_format: str = "parquet",
+                 flush_rows: int = 10_000, lateness: float = 10.0):
+        os.makedirs(directory, exist_ok=True)
+        self.flush_rows = flush_rows
+        self.lateness = lateness
+        self.records = []
+        self.seconds = {}
+        self.dropped = 0
+        extension = "parquet" if file_format == "parquet" else "csv"
+        self.request_writer = _ResultFileWriter(
+            os.path.join(directory, f"{run_id}-requests.{extension}"), self.REQUEST_COLUMNS
+        )
+        self.second_writer = _ResultFileWriter(
+            os.path.join(directory, f"{run_id}-per-second.{extension}"), self.SECOND_COLUMNS
+        )
+
+    def add(self, worker: str, data: dict):
+        """Add one worker's `ResultRecorder.take` output."""
+        self.records += [[record[0], worker] + record[1:] for record in data["records"]]
+        for second, request_type, name, failures, total, minimum, response_bytes, payload in data["seconds"]:
+            histogram = LatencyHistogram.decode(payload, RESULT_SIGNIFICANT_FIGURES)
+            key = (second, request_type, name)
+            aggregate = self.seconds.get(key)
+            if aggregate is None:
+                self.seconds[key] = [failures, total, minimum, response_bytes, histogram]
+            else:
+                aggregate[0] += failures
+                aggregate[1] += total
+                aggregate[2] = min(aggregate[2], minimum)
+                aggregate[3] += response_bytes
+                aggregate[4].merge(histogram)
+        if data["dropped"]:
+            self.dropped += data["dropped"]
+            logging.warning(f"Worker {worker} dropped {data['dropped']} sampled result records; "
+                            f"lower --results-sample-rate or --results-flush-interval")
+        if len(self.records) >= self.flush_rows:
+            self.request_writer.write(self.records)
+            self.records = []
+
+    def flush(self, final: bool = False):
+        """Write buffered records, and the aggregates of seconds old enough to be complete, or all if `final`."""
+        self.request_writer.write(self.records)
+        self.records = []
+        cutoff = math.inf if final else time.time() - self.lateness
+        rows = []
+        for key in sorted(key for key in self.seconds if key[0] < cutoff):
+            failures, total, minimum, response_bytes, histogram = self.seconds.pop(key)
+            requests = histogram.count
+            rows.append(list(key) + [
+                requests, failures, round(total / requests, 3), round(minimum, 3),
+                histogram.percentile(50), histogram.percentile(90), histogram.percentile(99),
+                histogram.max_value / 1000, response_bytes,
+            ])
+        self.second_writer.write(rows)
+
+    def close(self):
+        """Write everything still buffered and close the files."""
+        self.flush(final=True)
+        self.request_writer.close()
+        self.second_writer.close()
+        logging.info(f"Wrote {self.request_writer.rows} request records to {self.request_writer.path} and "
+                     f"{self.second_writer.rows} per-second rows to {self.second_writer.path}")
+
+
+def load_pyarrow() -> bool:
+    """Import pyarrow for Parquet result files, once, and return whether it is installed."""
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            # Results are written as CSV without it
+            pyarrow = None
+            return False
+    return True
+
+
+def get_result_sink(parsed_options) -> ResultSink:
+    """Open the result files for a run, picking Parquet when pyarrow is available for --results-format auto."""
+    file_format = parsed_options.results_format
+    if file_format == "auto":
+        file_format = "parquet" if load_pyarrow() else "csv"
+    elif file_format == "parquet" and not load_pyarrow():
+        raise ValueError("--results-format parquet requires pyarrow; install it or use --results-format csv")
+    run_id = parsed_options.results_run_id or time.strftime("%Y%m%d-%H%M%S")
+    return ResultSink(
+        parsed_options.results_dir,
+        run_id,
+        file_format,
+        flush_rows=parsed_options.results_flush_rows,
+        lateness=2 * parsed_options.results_flush_interval + 1,
+    )
+
+
+# Create a global config class that will be used throughout the application
+class Config:
+    """Singleton configuration class that loads from config file just once."""
+    _instance = None
+    
+    def __new__(cls, config_file_path=None):
+        if cls._instance is None:
+            cls._instance = super(Config, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self, config_file_path=None):
+        if self._initialized:
+            return
+            
+        if config_file_path:
+            self._load_config(config_file_path)
+        self._initialized = True
+        
+        # Determine endpoint access type from configuration
+        self._determine_endpoint_access_type()
+        
+        logging.info(f"Loaded configuration: ENDPOINT_ACCESS_TYPE={self.endpoint_access_type}, "
+                     f"PSC_ENABLED={self.psc_enabled}, MATCH_GRPC_ADDRESS={self.match_grpc_address}, "
+                     f"ENDPOINT_HOST={self.endpoint_host}, PROJECT_NUMBER={self.project_number}")
+        if self.mock_server_address:
+            logging.info(f"Targeting the mock MatchService at {self.mock_server_address}")
+    
+    def _load_config(self, file_path):
+        """Load configuration from a bash-style config file."""
+        self.config = {}
+        
+        with open(file_path, 'r') as f:
+            for line in f:
+                # Skip comments and empty lines
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                
+                # Parse variable assignment
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    key = key.strip()
+                    value = value.strip()
+                    
+                    # Remove surrounding quotes if present
+                    if (value.startswith('"') and value.endswith('"')) or (value.startswith("'") and value.endswith("'")):
+                        value = value[1:-1]
+                    
+                    self.config[key] = value
+        
+        # Set attributes from the config
+        self.project_id = self.config.get('PROJECT_ID')
+        self.project_number = self.config.get('PROJECT_NUMBER', self.project_id)
+        self.dimensions = int(self.config.get('INDEX_DIMENSIONS', 768))
+        self.deployed_index_id = self.config.get('DEPLOYED_INDEX_ID')
+        self.index_endpoint_id = self.config.get('INDEX_ENDPOINT_ID')
+        self.endpoint_host = self.config.get('ENDPOINT_HOST')
+        self.index_id = self.config.get('INDEX_ID')
+        self.region = self.config.get('REGION', 'us-central1')
+        self.index_update_method = self.config.get('INDEX_UPDATE_METHOD', '')
+        
+        # Support both old and new config formats
+        # New format: ENDPOINT_ACCESS_TYPE
+        self.endpoint_access_type = self.config.get('ENDPOINT_ACCESS_TYPE')
+        
+        # Old format: PSC_ENABLED
+        self.psc_enabled = self.config.get('PSC_ENABLED', 'false').lower() in ('true', 'yes', '1')
+        
+        # PSC Configuration
+        self.match_grpc_address = self.config.get('MATCH_GRPC_ADDRESS')
+        self.service_attachment = self.config.get('SERVICE_ATTACHMENT')
+        self.psc_ip_address = self.config.get('PSC_IP_ADDRESS')
+        
+        # Embedding configuration
+        self.sparse_embedding_num_dimensions = int(self.config.get('SPARSE_EMBEDDING_NUM_DIMENSIONS', 0))
+        self.sparse_embedding_num_dimensions_with_values = int(self.config.get('SPARSE_EMBEDDING_NUM_DIMENSIONS_WITH_VALUES', 0))
+        self.num_neighbors = int(self.config.get('NUM_NEIGHBORS', 20)) 
+        self.num_embeddings_per_request = int(self.config.get('NUM_EMBEDDINGS_PER_REQUEST', 1))
+        self.return_full_datapoint = self.config.get('RETURN_FULL_DATAPOINT', 'False').lower() in ('true', 'yes', '1')
+        self.index_distance_measure_type = self.config.get('INDEX_DISTANCE_MEASURE_TYPE', 'COSINE_DISTANCE')
+
+        # Load shape configuration
+        self.qps_sweep = self.config.get('QPS_SWEEP', 'false').lower() in ('true', 'yes', '1')
+        
+        # Network configuration
+        self.network_name = self.config.get('NETWORK_NAME', 'default')
+        
+        # If we have PSC_IP_ADDRESS but not MATCH_GRPC_ADDRESS, construct it
+        if self.psc_ip_address and not self.match_grpc_address:
+            self.match_grpc_address = f"{self.psc_ip_address}"
+
+        # Local mock MatchService (utils/mock_match_service.py) in place of a deployed index
+        self.mock_server_address = self.config.get('MOCK_SERVER_ADDRESS')
+        if self.mock_server_address:
+            self.match_grpc_address = f"{self.mock_server_address}:{self.config.get('MOCK_SERVER_GRPC_PORT', '8500')}"
+            self.endpoint_host = f"{self.mock_server_address}:{self.config.get('MOCK_SERVER_HTTP_PORT', '8080')}"
+            
+        # Get a clean numeric ID from the full endpoint ID
+        self.endpoint_id_numeric = None
+        if self.index_endpoint_id and "/" in self.index_endpoint_id:
+            self.endpoint_id_numeric = self.index_endpoint_id.split("/")[-1]
+        else:
+            self.endpoint_id_numeric = self.index_endpoint_id
+
+        # Full index resource name for upserts and removes, and its region
+        self.index_name = None
+        if self.index_id and "/" in self.index_id:
+            self.index_name = self.index_id
+            self.region = self.index_id.split("/")[3]
+        elif self.index_id:
+            self.index_name = f"projects/{self.project_number}/locations/{self.region}/indexes/{self.index_id}"
+    
+    def _determine_endpoint_access_type(self):
+        """Determine the endpoint access type from configuration."""
+        # If ENDPOINT_ACCESS_TYPE is directly specified, use it
+        if self.endpoint_access_type:
+            # Ensure it's one of the valid options
+            if self.endpoint_access_type not in ["public", "vpc_peering", "private_service_connect"]:
+                logging.warning(f"Invalid ENDPOINT_ACCESS_TYPE '{self.endpoint_access_type}', defaulting to 'public'")
+                self.endpoint_access_type = "public"
+        else:
+            # Otherwise, derive it from PSC_ENABLED
+            if self.psc_enabled:
+                self.endpoint_access_type = "private_service_connect"
+                logging.info("Derived endpoint_access_type='private_service_connect' from PSC_ENABLED=true")
+            else:
+                self.endpoint_access_type = "public"
+                logging.info("Derived endpoint_access_type='public' from PSC_ENABLED=false")
+    
+    def get(self, key, default=None):
+        """Get a configuration value by key."""
+        return getattr(self, key.lower(), self.config.get(key, default))
+
+# Load the config once at startup
+config = Config('./locust_config.env')
+
+# Determine if we're using gRPC or HTTP based on endpoint_access_type
+USE_GRPC = config.endpoint_access_type in ["private_service_connect", "vpc_peering"]
+logging.info(f"Using gRPC mode: {USE_GRPC} based on endpoint_access_type={config.endpoint_access_type}")
+if USE_GRPC:
+    load_grpc_modules()
+
+@events.init_command_line_parser.add_listener
+def _(parser):
+    """Add command line arguments to the Locust environment."""
+    # Add user-focused test parameters
+    parser.add_argument(
+        "--num-neighbors", 
+        type=int, 
+        default=config.num_neighbors, 
+        help="Number of nearest neighbors to find in each query"
+    )
+    
+    # Add QPS per user control
+    parser.add_argument(
+        "--qps-per-user",
+        type=int,
+        default=10,
+        help=(
+            'The QPS each user should target. Locust will try to maintain this rate, '
+            'but if latency is high, actual QPS may be lower.'
+        ),
+    )
+    
+    # Advanced parameters
+    parser.add_argument(
+        "--fraction-leaf-nodes-to-search-override",
+        type=float,
+        default=0.0,
+        help="Advanced: Fraction of leaf nodes to search (0.0-1.0). Higher values increase recall but reduce performance."
+    )
+
+    parser.add_argument(
+        "--return-full-datapoint",
+        type=_parse_bool,
+        default=config.return_full_datapoint,
+        metavar="{true,false}",
+        help="Return each neighbor's full datapoint (vector and restricts) instead of just its id.",
+    )
+
+    # Multi-query batching
+    parser.add_argument(
+        "--num-embeddings-per-request",
+        type=int,
+        default=config.num_embeddings_per_request,
+        help="Number of queries packed into each findNeighbors request.",
+    )
+
+    # gRPC concurrency
+    parser.add_argument(
+        "--grpc-channels",
+        type=int,
+        default=1,
+        help="Number of gRPC channels (connections) per worker. Users are assigned channels round-robin.",
+    )
+    parser.add_argument(
+        "--grpc-keepalive-ms",
+        type=int,
+        default=0,
+        help="gRPC keepalive ping interval in milliseconds, so idle pooled connections are not dropped. 0 disables.",
+    )
+    parser.add_argument(
+        "--grpc-max-concurrent-streams",
+        type=int,
+        default=100,
+        help=(
+            'Concurrent stream limit the server advertises per connection. Future-based calls move off a '
+            'channel at this limit, and a warning is logged when channels reach it.'
+        ),
+    )
+    parser.add_argument(
+        "--grpc-channel-report-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between gRPC channel saturation checks. 0 disables them.",
+    )
+    parser.add_argument(
+        "--grpc-channel-metrics",
+        action="store_true",
+        default=False,
+        help="Report each gRPC channel's peak in-flight requests and mean latency as grpc-channel client metrics.",
+    )
+    parser.add_argument(
+        "--grpc-inflight-per-user",
+        type=int,
+        default=1,
+        help=(
+            'Maximum outstanding gRPC requests per user. Above 1, users send future-based calls '
+            'without waiting for responses, so a few users can sustain high QPS.'
+        ),
+    )
+
+    # Query vector pool
+    parser.add_argument(
+        "--query-vectors-file",
+        type=str,
+        default="",
+        help=(
+            'Path to a .npy or raw float32 file of query vectors, memory-mapped once per worker. '
+            'If the file does not exist and --query-pool-size is set, a pool is generated and saved there.'
+        ),
+    )
+    parser.add_argument(
+        "--query-pool-size",
+        type=int,
+        default=0,
+        help="Number of random query vectors to pre-generate per worker. 0 generates a new vector for every request.",
+    )
+    parser.add_argument(
+        "--query-pool-order",
+        choices=["cycle", "random"],
+        default="cycle",
+        help="How users pick rows from the query vector pool: cycle from a random offset, or sample uniformly.",
+    )
+    parser.add_argument(
+        "--query-pool-seed",
+        type=int,
+        default=None,
+        help="Seed for generating the query vector pool and sparse embeddings, for reproducible runs.",
+    )
+
+    # Embedding type
+    parser.add_argument(
+        "--embedding-mode",
+        choices=["auto", "dense", "sparse", "hybrid"],
+        default="auto",
+        help=(
+            'Embedding type of each query. auto sends sparse embeddings when SPARSE_EMBEDDING_* is configured '
+            'and dense vectors otherwise; hybrid sends both in each datapoint.'
+        ),
+    )
+    parser.add_argument(
+        "--sparse-batch-size",
+        type=int,
+        default=1024,
+        help="Number of sparse embeddings generated per vectorized batch.",
+    )
+
+    # Query replay
+    parser.add_argument(
+        "--replay-file",
+        type=str,
+        default="",
+        help=(
+            'Path to a JSONL file of recorded queries to replay instead of synthetic vectors. '
+            'Lines are streamed lazily and sharded across workers.'
+        ),
+    )
+    parser.add_argument(
+        "--replay-at-eof",
+        choices=["loop", "stop"],
+        default="loop",
+        help="What to do when a worker reaches the end of its replay shard: start over, or stop its users.",
+    )
+
+    # Open-loop load model
+    parser.add_argument(
+        "--target-qps",
+        type=float,
+        default=0,
+        help=(
+            'Open-loop mode: total QPS to offer across all workers, regardless of latency. '
+            'Overrides --qps-per-user; users act as the concurrency limit for in-flight requests.'
+        ),
+    )
+    parser.add_argument(
+        "--arrival-distribution",
+        choices=["poisson", "fixed"],
+        default="poisson",
+        help="Open-loop mode: Poisson arrivals or a fixed interval between requests.",
+    )
+    parser.add_argument(
+        "--max-schedule-lag",
+        type=float,
+        default=1.0,
+        help="Open-loop mode: seconds an arrival may wait for a free user before it is dropped.",
+    )
+
+    # HTTP request encoding
+    parser.add_argument(
+        "--http-body-mode",
+        choices=["json", "template", "precompiled"],
+        default="json",
+        help=(
+            'How HTTP users encode dense findNeighbors bodies: json encodes the whole request each call, '
+            'template splices an encoded vector into pre-encoded bytes, and precompiled encodes a body per '
+            'query pool row once at worker start (requires a query vector pool).'
+        ),
+    )
+
+    # gRPC request encoding
+    parser.add_argument(
+        "--grpc-request-mode",
+        choices=["proto-plus", "protobuf", "serialized"],
+        default="proto-plus",
+        help=(
+            'How gRPC users build dense FindNeighborsRequests: proto-plus builds wrapper objects each call, '
+            'protobuf reuses one raw protobuf request and swaps the vector, and serialized sends requests '
+            'pre-serialized per query pool row at worker start (requires a query vector pool).'
+        ),
+    )
+
+    # gRPC measurement overhead
+    parser.add_argument(
+        "--response-size-sample-rate",
+        type=float,
+        default=1.0,
+        help=(
+            'Fraction of gRPC responses whose serialized size is measured; the rest report the running '
+            'average size. Lower values cut per-call client overhead, and 0 skips response sizing.'
+        ),
+    )
+
+    # Response payload cost
+    parser.add_argument(
+        "--payload-sample-rate",
+        type=float,
+        default=0.0,
+        help=(
+            'Fraction of successful responses whose size and client-side decode time (JSON for HTTP, '
+            'protobuf for gRPC) are reported as payload rows. gRPC responses are then received as raw '
+            'bytes, so decoding is timed separately from the call instead of inside it.'
+        ),
+    )
+
+    # Recall measurement
+    parser.add_argument(
+        "--recall-sample-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of dense requests whose returned neighbors are checked against exact neighbors. 0 disables.",
+    )
+    parser.add_argument(
+        "--recall-corpus-file",
+        type=str,
+        default="",
+        help="Path to a .npy or raw float32 file of the indexed vectors, searched by brute force for exact neighbors.",
+    )
+    parser.add_argument(
+        "--recall-corpus-ids-file",
+        type=str,
+        default="",
+        help="Text file with the datapoint id of each corpus vector, one per line. Defaults to the row number.",
+    )
+    parser.add_argument(
+        "--recall-ground-truth-file",
+        type=str,
+        default="",
+        help=(
+            'JSONL file of precomputed exact neighbor ids, one line per query vector pool row. '
+            'Used instead of brute force over --recall-corpus-file.'
+        ),
+    )
+    parser.add_argument(
+        "--recall-distance",
+        choices=["DOT_PRODUCT_DISTANCE", "COSINE_DISTANCE", "L2_SQUARED_DISTANCE"],
+        default=config.index_distance_measure_type,
+        help="Distance measure for brute-force neighbors; should match the index.",
+    )
+
+    # QPS sweep (with QPS_SWEEP=true in the config)
+    parser.add_argument(
+        "--sweep-users",
+        type=int,
+        default=100,
+        help="Users kept running during a QPS sweep; they cap how many requests can be in flight.",
+    )
+    parser.add_argument(
+        "--sweep-start-qps",
+        type=float,
+        default=10.0,
+        help="Target QPS of the first sweep step.",
+    )
+    parser.add_argument(
+        "--sweep-step-qps",
+        type=float,
+        default=10.0,
+        help="Target QPS added at each sweep step.",
+    )
+    parser.add_argument(
+        "--sweep-max-qps",
+        type=float,
+        default=10000.0,
+        help="Target QPS at which the sweep stops even if the index keeps up.",
+    )
+    parser.add_argument(
+        "--sweep-window",
+        type=float,
+        default=10.0,
+        help="Seconds per measurement window; a step is stable once consecutive window p99s agree.",
+    )
+    parser.add_argument(
+        "--sweep-min-step-time",
+        type=float,
+        default=30.0,
+        help="Minimum seconds to hold each sweep step.",
+    )
+    parser.add_argument(
+        "--sweep-max-step-time",
+        type=float,
+        default=300.0,
+        help="Seconds after which a step whose p99 has not stabilized ends the sweep.",
+    )
+    parser.add_argument(
+        "--sweep-stability-tolerance",
+        type=float,
+        default=0.1,
+        help="Largest relative change between consecutive window p99s for a step to count as stable.",
+    )
+    parser.add_argument(
+        "--sweep-stability-floor-ms",
+        type=float,
+        default=2.0,
+        help=(
+            "Change in milliseconds between consecutive window p99s that always counts as stable, since "
+            "Locust rounds response times to whole milliseconds and low-latency p99s move by whole steps."
+        ),
+    )
+    parser.add_argument(
+        "--sweep-p99-ms",
+        type=float,
+        default=1000.0,
+        help="p99 latency in milliseconds above which a step fails and the sweep stops.",
+    )
+    parser.add_argument(
+        "--sweep-max-error-rate",
+        type=float,
+        default=0.01,
+        help="Error rate above which a step fails and the sweep stops.",
+    )
+    parser.add_argument(
+        "--sweep-min-achieved-ratio",
+        type=float,
+        default=0.95,
+        help="Fraction of the target QPS a step must actually complete to pass.",
+    )
+    parser.add_argument(
+        "--sweep-csv",
+        type=str,
+        default="qps_sweep.csv",
+        help="File the per-step sweep table is written to.",
+    )
+
+    # Mixed read/write workload
+    parser.add_argument(
+        "--write-ratio",
+        type=float,
+        default=0.0,
+        help=(
+            'Fraction of user iterations that upsert or remove datapoints instead of querying. Requires '
+            'INDEX_ID in the config and an index deployed with STREAM_UPDATE.'
+        ),
+    )
+    parser.add_argument(
+        "--write-max-rate",
+        type=float,
+        default=0.0,
+        help="Maximum write requests per second in total, split evenly across workers. 0 means no limit.",
+    )
+    parser.add_argument(
+        "--upsert-batch-size",
+        type=int,
+        default=10,
+        help="Datapoints per upsertDatapoints or removeDatapoints request.",
+    )
+    parser.add_argument(
+        "--remove-fraction",
+        type=float,
+        default=0.5,
+        help="Fraction of writes that remove datapoints upserted earlier in the run, rather than upserting new ones.",
+    )
+    parser.add_argument(
+        "--write-active-seconds",
+        type=float,
+        default=60.0,
+        help="With --write-quiet-seconds, seconds of each cycle during which writes are sent.",
+    )
+    parser.add_argument(
+        "--write-quiet-seconds",
+        type=float,
+        default=0.0,
+        help="Seconds of each cycle with no writes, giving quiet periods to compare against. 0 writes continuously.",
+    )
+    parser.add_argument(
+        "--ingest-window",
+        type=float,
+        default=5.0,
+        help="Queries sent within this many seconds of a write on the same worker are tagged (ingest), others (quiet).",
+    )
+    parser.add_argument(
+        "--write-endpoint",
+        type=str,
+        default="",
+        help="Host for upserts and removes. Defaults to the index region's aiplatform.googleapis.com endpoint.",
+    )
+    parser.add_argument(
+        "--write-id-prefix",
+        type=str,
+        default="ltf-",
+        help="Prefix of the datapoint ids the load test upserts, so they can be told apart from real data.",
+    )
+
+    # Filtered and crowding queries
+    parser.add_argument(
+        "--filter-selectivity",
+        type=str,
+        default="",
+        help=(
+            'Comma-separated selectivity:weight pairs to draw each request\'s filter from, e.g. '
+            '1:1,0.1:2,0.01:2,0.001:1. Selectivity is the fraction of datapoints the filter matches, and 1 '
+            'sends no filter. Stats are split per selectivity.'
+        ),
+    )
+    parser.add_argument(
+        "--filter-type",
+        type=str,
+        choices=["token", "numeric", "both"],
+        default="token",
+        help="Filter with token restricts, numeric restricts, or both, which split the selectivity between them.",
+    )
+    parser.add_argument(
+        "--filter-namespace",
+        type=str,
+        default="category",
+        help="Token restrict namespace. Indexed datapoints are expected to carry one of its tokens, 0 to N-1.",
+    )
+    parser.add_argument(
+        "--filter-token-count",
+        type=int,
+        default=100,
+        help="Number of distinct tokens (N) in the token namespace.",
+    )
+    parser.add_argument(
+        "--numeric-filter-namespace",
+        type=str,
+        default="score",
+        help="Numeric restrict namespace. Indexed datapoints are expected to carry a value uniform in [0, 1).",
+    )
+    parser.add_argument(
+        "--crowding-neighbor-count",
+        type=int,
+        default=0,
+        help="per_crowding_attribute_neighbor_count for each query. 0 disables crowding.",
+    )
+    parser.add_argument(
+        "--crowding-attribute-count",
+        type=int,
+        default=0,
+        help="Number of distinct crowding attributes given to upserted datapoints. 0 upserts no crowding tags.",
+    )
+
+    # Parameter matrix
+    parser.add_argument(
+        "--matrix-num-neighbors",
+        type=str,
+        default="",
+        help="Comma-separated neighbor counts to cycle through, e.g. 10,50,100.",
+    )
+    parser.add_argument(
+        "--matrix-leaf-fractions",
+        type=str,
+        default="",
+        help="Comma-separated fraction_leaf_nodes_to_search_override values to cycle through, e.g. 0,0.05,0.1.",
+    )
+    parser.add_argument(
+        "--matrix-return-full-datapoint",
+        type=str,
+        default="",
+        help="Comma-separated return_full_datapoint values to cycle through, e.g. false,true.",
+    )
+    parser.add_argument(
+        "--matrix-queries-per-request",
+        type=str,
+        default="",
+        help="Comma-separated numbers of queries per request to cycle through, e.g. 1,4,16.",
+    )
+    parser.add_argument(
+        "--matrix-cell-time",
+        type=float,
+        default=60.0,
+        help=(
+            'Seconds each parameter matrix cell is held for. Cells run in order and then repeat, so a run '
+            'of cells x this time covers each combination once.'
+        ),
+    )
+
+    # HDR latency histograms
+    parser.add_argument(
+        "--hdr-csv",
+        type=str,
+        default="",
+        help=(
+            'Record every request into HDR-style latency histograms on the workers, merge them on the '
+            'master and write per-window and run-wide percentiles up to p99.99 to this CSV file.'
+        ),
+    )
+    parser.add_argument(
+        "--hdr-window",
+        type=float,
+        default=10.0,
+        help="Length in seconds of the time windows HDR percentiles are reported for.",
+    )
+    parser.add_argument(
+        "--hdr-significant-figures",
+        type=int,
+        choices=[1, 2, 3, 4],
+        default=3,
+        help="Decimal digits of precision kept by the HDR histograms.",
+    )
+
+    # Result files
+    parser.add_argument(
+        "--results-dir",
+        type=str,
+        default="",
+        help=(
+            'Write sampled per-request records and per-second aggregates of every request type and name to '
+            'files in this directory on the master, e.g. a mounted volume, for offline analysis.'
+        ),
+    )
+    parser.add_argument(
+        "--results-sample-rate",
+        type=float,
+        default=0.01,
+        help="Fraction of requests written as individual records; per-second aggregates always cover all requests.",
+    )
+    parser.add_argument(
+        "--results-format",
+        type=str,
+        choices=["auto", "parquet", "csv"],
+        default="auto",
+        help="Result file format. auto writes Parquet when pyarrow is installed and CSV otherwise.",
+    )
+    parser.add_argument(
+        "--results-run-id",
+        type=str,
+        default="",
+        help="Prefix of the result file names. Defaults to the test start time, so each run gets its own files.",
+    )
+    parser.add_argument(
+        "--results-flush-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between workers sending their results to the master and the master writing them.",
+    )
+    parser.add_argument(
+        "--results-flush-rows",
+        type=int,
+        default=10000,
+        help="Request records the master buffers before writing them as one batch.",
+    )
+    parser.add_argument(
+        "--results-buffer-rows",
+        type=int,
+        default=100000,
+        help="Request records a worker buffers between sends; records beyond this are dropped and counted.",
+    )
+
+    # Load generator profiling
+    parser.add_argument(
+        "--profile-workers",
+        action="store_true",
+        default=False,
+        help=(
+            'Measure each load generator\'s CPU use, event loop lag and time spent generating, serializing, '
+            'intercepting and decoding requests, report it to the master and warn about client-bound workers.'
+        ),
+    )
+    parser.add_argument(
+        "--client-bound-cpu",
+        type=float,
+        default=90.0,
+        help="Percent of a core above which a profiled worker is reported as client-bound.",
+    )
+    parser.add_argument(
+        "--client-bound-lag-ms",
+        type=float,
+        default=50.0,
+        help="Mean event loop lag in milliseconds above which a profiled worker is reported as client-bound.",
+    )
+    parser.add_argument(
+        "--profile-sample-file",
+        type=str,
+        default="",
+        help=(
+            'Also sample the Python stack of each load generator and write the samples to this file in '
+            'folded format for flamegraph.pl or speedscope; workers append their process id to the name.'
+        ),
+    )
+    parser.add_argument(
+        "--profile-sample-interval",
+        type=float,
+        default=0.005,
+        help="Seconds of CPU time between stack samples with --profile-sample-file.",
+    )
+    parser.add_argument(
+        "--startup-metrics",
+        action="store_true",
+        default=False,
+        help=(
+            "Report locustfile import, user init and spawn times as 'startup' client metrics. Import and spawn "
+            "times are always logged."
+        ),
+    )
+    parser.add_argument(
+        "--warmup-seconds",
+        type=float,
+        default=0,
+        help=(
+            "Warm-up window lasting until this many seconds after every user has spawned. Users connect and send "
+            "priming queries first, and stats reset when the window ends. Connection setup and the full latency of "
+            "each user's first response (not time to first byte) are reported as 'warmup' client metrics. "
+            "0 disables warm-up."
+        ),
+    )
+    parser.add_argument(
+        "--warmup-queries",
+        type=int,
+        default=3,
+        help=f"Priming queries each user sends before its tasks with --warmup-seconds, named with '{WARMUP_SUFFIX}'.",
+    )
+    parser.add_argument(
+        "--warmup-connect-timeout",
+        type=float,
+        default=30,
+        help="Seconds to wait for gRPC channels to connect during warm-up.",
+    )
+
+@events.init.add_listener
+def on_locust_init(environment, **kwargs):
+    """Set up the host and tags based on configuration."""
+    # Determine test mode based on endpoint access type
+    is_grpc_mode = config.endpoint_access_type in ["private_service_connect", "vpc_peering"]
+    
+    # Set default tags based on endpoint access type if no tags were specified
+    if hasattr(environment.parsed_options, 'tags') and not environment.parsed_options.tags:
+        if is_grpc_mode:
+            environment.parsed_options.tags = ['grpc']
+            logging.info("Auto-setting tags to 'grpc' based on endpoint access type 'private_service_connect'")
+        else:
+            environment.parsed_options.tags = ['http']
+            logging.info(f"Auto-setting tags to 'http' based on endpoint access type '{config.endpoint_access_type}'")
+    
+    # Set host based on endpoint access type if no host was specified
+    if not environment.host:
+        if is_grpc_mode:
+            # PSC/gRPC mode
+            grpc_address = config.match_grpc_address
+            if grpc_address:
+                logging.info(f"Auto-setting host to gRPC address: {grpc_address}")
+                environment.host = grpc_address
+            else:
+                logging.warning("No MATCH_GRPC_ADDRESS found in configuration, host must be specified manually for PSC/gRPC mode")
+        else:
+            # HTTP mode
+            endpoint_host = config.endpoint_host
+            if endpoint_host:
+                # The mock server speaks plain HTTP
+                scheme = "http" if config.mock_server_address else "https"
+                host = f"{scheme}://{endpoint_host}"
+                logging.info(f"Auto-setting host to HTTP endpoint: {host}")
+                environment.host = host
+            else:
+                logging.warning("No ENDPOINT_HOST found in configuration, host must be specified manually for HTTP mode")
+
+@events.quit.add_listener
+def on_shared_pool_quit(**kwargs):
+    """Remove the shared memory query pool this process created; processes still mapping it keep their mapping."""
+    for path in _SHARED_POOL_FILES:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    _SHARED_POOL_FILES.clear()
+
+
+@events.init.add_listener
+def on_replay_init(environment, **kwargs):
+    """Register the message the master uses to assign replay shards to workers."""
+    if isinstance(environment.runner, MasterRunner) or environment.runner is None:
+        return
+
+    def on_replay_shard(environment, msg, **kwargs):
+        global _QUERY_REPLAY, _QUERY_REPLAY_SHARD
+        _QUERY_REPLAY_SHARD = (msg.data["index"], msg.data["count"])
+        _QUERY_REPLAY = None
+
+    environment.runner.register_message("replay_shard", on_replay_shard)
+
+
+def _active_workers(runner: MasterRunner) -> list:
+    """Return the master's connected workers, ordered by worker index."""
+    workers = runner.clients.ready + runner.clients.spawning + runner.clients.running
+    return sorted(workers, key=lambda w: runner.get_worker_index(w.id))
+
+
+@events.test_start.add_listener
+def on_replay_test_start(environment, **kwargs):
+    """Give each connected worker its own shard of the replay file."""
+    if not isinstance(environment.runner, MasterRunner) or not environment.parsed_options.replay_file:
+        return
+    workers = _active_workers(environment.runner)
+    for shard_index, worker in enumerate(workers):
+        environment.runner.send_message(
+            "replay_shard", {"index": shard_index, "count": len(workers)}, client_id=worker.id
+        )
+
+@events.init.add_listener
+def on_open_loop_init(environment, **kwargs):
+    """Register the message that creates the worker's arrival schedule and sets its rate."""
+    if isinstance(environment.runner, MasterRunner) or environment.runner is None:
+        return
+
+    def on_open_loop_rate(environment, msg, **kwargs):
+        global _ARRIVAL_SCHEDULE
+        if msg.data["rate"] <= 0:
+            _ARRIVAL_SCHEDULE = None
+            return
+        if _ARRIVAL_SCHEDULE is None:
+            _ARRIVAL_SCHEDULE = ArrivalSchedule(distribution=msg.data["distribution"], max_lag=msg.data["max_lag"])
+        _ARRIVAL_SCHEDULE.set_rate(msg.data["rate"])
+        logging.info(f"Open-loop arrival rate set to {msg.data['rate']:.2f} QPS on this worker")
+
+    environment.runner.register_message("open_loop_rate", on_open_loop_rate)
+
+
+def send_open_loop_rate(environment, target_qps: float):
+    """Split a total target QPS evenly across the workers (or this process when running locally).
+
+    Worker options only arrive with the first spawn message, so the schedule
+    settings travel with the rate.
+    """
+    data = {
+        "rate": target_qps,
+        "distribution": environment.parsed_options.arrival_distribution,
+        "max_lag": environment.parsed_options.max_schedule_lag,
+    }
+    if isinstance(environment.runner, MasterRunner):
+        workers = _active_workers(environment.runner)
+        for worker in workers:
+            environment.runner.send_message(
+                "open_loop_rate", dict(data, rate=target_qps / len(workers)), client_id=worker.id
+            )
+    else:
+        environment.runner.send_message("open_loop_rate", data)
+
+
+@events.test_start.add_listener
+def on_open_loop_test_start(environment, **kwargs):
+    """Start the open-loop schedule at the configured target QPS, or turn it off for closed-loop runs."""
+    if isinstance(environment.runner, WorkerRunner) or isinstance(environment.shape_class, QpsSweepShape):
+        # The QPS sweep sets the rate itself at every step
+        return
+    send_open_loop_rate(environment, environment.parsed_options.target_qps)
+
+
+@events.report_to_master.add_listener
+def on_open_loop_report(client_id, data, **kwargs):
+    """Send the number of arrivals this worker dropped since its last report."""
+    if _ARRIVAL_SCHEDULE is not None:
+        data["open_loop_dropped"] = _ARRIVAL_SCHEDULE.dropped
+        _ARRIVAL_SCHEDULE.dropped = 0
+
+
+@events.worker_report.add_listener
+def on_open_loop_worker_report(client_id, data, **kwargs):
+    """Accumulate dropped arrivals on the master and warn whenever a worker drops some."""
+    global _OPEN_LOOP_DROPPED
+    dropped = data.get("open_loop_dropped", 0)
+    if dropped:
+        _OPEN_LOOP_DROPPED += dropped
+        logging.warning(f"Worker {client_id} dropped {dropped} open-loop arrivals; "
+                        f"add users or lower --target-qps ({_OPEN_LOOP_DROPPED} dropped in total)")
+
+
+@events.test_stop.add_listener
+def on_open_loop_test_stop(environment, **kwargs):
+    """Log the total number of dropped arrivals for the run."""
+    global _OPEN_LOOP_DROPPED
+    if environment.parsed_options.target_qps <= 0 or isinstance(environment.runner, WorkerRunner):
+        return
+    if isinstance(environment.runner, LocalRunner) and _ARRIVAL_SCHEDULE is not None:
+        # Local runs have no worker reports
+        _OPEN_LOOP_DROPPED += _ARRIVAL_SCHEDULE.dropped
+        _ARRIVAL_SCHEDULE.dropped = 0
+    logging.info(f"Open-loop run dropped {_OPEN_LOOP_DROPPED} arrivals in total")
+    _OPEN_LOOP_DROPPED = 0
+
+
+@events.init.add_listener
+def on_write_init(environment, **kwargs):
+    """Register the message that sets the worker's write rate limit."""
+    if isinstance(environment.runner, MasterRunner) or environment.runner is None:
+        return
+
+    def on_write_rate(environment, msg, **kwargs):
+        global _WRITE_RATE
+        _WRITE_RATE = msg.data["rate"]
+        if _DATAPOINT_WRITER is not None:
+            _DATAPOINT_WRITER.set_rate(_WRITE_RATE)
+
+    environment.runner.register_message("write_rate", on_write_rate)
+
+
+@events.test_start.add_listener
+def on_write_test_start(environment, **kwargs):
+    """Split the total write rate limit evenly across the workers (or this process when running locally)."""
+    if isinstance(environment.runner, WorkerRunner) or environment.parsed_options.write_ratio <= 0:
+        return
+    if config.index_update_method and config.index_update_method != "STREAM_UPDATE":
+        logging.warning(f"INDEX_UPDATE_METHOD is {config.index_update_method}; "
+                        f"upserts and removes need an index deployed with STREAM_UPDATE")
+    rate = environment.parsed_options.write_max_rate
+    if isinstance(environment.runner, MasterRunner):
+        workers = _active_workers(environment.runner)
+        for worker in workers:
+            environment.runner.send_message("write_rate", {"rate": rate / len(workers)}, client_id=worker.id)
+    else:
+        environment.runner.send_message("write_rate", {"rate": rate})
+
+
+@events.init.add_listener
+def on_matrix_init(environment, **kwargs):
+    """Register the message that starts the parameter matrix's first cell on every worker at once."""
+    if isinstance(environment.runner, MasterRunner) or environment.runner is None:
+        return
+
+    def on_matrix_start(environment, msg, **kwargs):
+        global _PARAMETER_MATRIX_START
+        _PARAMETER_MATRIX_START = msg.data["start"]
+
+    environment.runner.register_message("matrix_start", on_matrix_start)
+
+
+@events.test_start.add_listener
+def on_matrix_test_start(environment, **kwargs):
+    """Start the parameter matrix from its first cell and log the cells it cycles through."""
+    if isinstance(environment.runner, WorkerRunner) or not parameter_matrix_configured(environment.parsed_options):
+        return
+    matrix = get_parameter_matrix(environment.parsed_options)
+    logging.info("Parameter matrix cells:\n" + "\n".join(
+        f"{index + 1:>4} {cell['label']}" for index, cell in enumerate(matrix.cells)
+    ))
+    environment.runner.send_message("matrix_start", {"start": time.time()})
+
+
+@events.init.add_listener
+def on_hdr_init(environment, **kwargs):
+    """Register the message workers use to ship latency histogram snapshots to the master."""
+    if not isinstance(environment.runner, MasterRunner):
+        return
+
+    def on_hdr_snapshot(environment, msg, **kwargs):
+        if _LATENCY_AGGREGATOR is not None:
+            _LATENCY_AGGREGATOR.merge(msg.data["window_start"], msg.data["entries"])
+
+    environment.runner.register_message("hdr_snapshot", on_hdr_snapshot)
+
+
+def send_latency_snapshot(environment, window_start: float):
+    """Ship the worker's histograms to the master, or merge them directly when running locally."""
+    entries = _LATENCY_RECORDER.snapshot()
+    if not entries:
+        return
+    if isinstance(environment.runner, WorkerRunner):
+        environment.runner.send_message("hdr_snapshot", {"window_start": window_start, "entries": entries})
+    elif _LATENCY_AGGREGATOR is not None:
+        _LATENCY_AGGREGATOR.merge(window_start, entries)
+
+
+@events.test_start.add_listener
+def on_hdr_test_start(environment, **kwargs):
+    """Start recording latency histograms, and on workers a greenlet that snapshots each window."""
+    global _LATENCY_RECORDER, _LATENCY_SNAPSHOT_GREENLET, _LATENCY_AGGREGATOR
+    options = environment.parsed_options
+    if not options.hdr_csv:
+        return
+    if not isinstance(environment.runner, WorkerRunner):
+        _LATENCY_AGGREGATOR = LatencyHistogramAggregator(
+            options.hdr_csv, options.hdr_significant_figures, options.hdr_window
+        )
+    if isinstance(environment.runner, MasterRunner):
+        return
+    # Warm-up traffic is left out; the stats reset that ends the window starts recording
+    _LATENCY_RECORDER = LatencyRecorder(options.hdr_significant_figures, recording=options.warmup_seconds <= 0)
+
+    def snapshot_windows():
+        # Windows are aligned to the wall clock so snapshots from every worker line up
+        while True:
+            now = time.time()
+            window_end = (math.floor(now / options.hdr_window) + 1) * options.hdr_window
+            gevent.sleep(window_end - now)
+            send_latency_snapshot(environment, window_end - options.hdr_window)
+
+    _LATENCY_SNAPSHOT_GREENLET = gevent.spawn(snapshot_windows)
+
+
+@events.request.add_listener
+def on_hdr_request(request_type, name, response_time, **kwargs):
+    """Record each request's response time into the worker's histograms."""
+    if _LATENCY_RECORDER is not None and response_time is not None:
+        _LATENCY_RECORDER.record(request_type, name, response_time)
+
+
+@events.reset_stats.add_listener
+def on_hdr_reset_stats(**kwargs):
+    """Leave requests from before a stats reset out of the histograms, as Locust's own stats do."""
+    if _LATENCY_RECORDER is not None:
+        _LATENCY_RECORDER.reset()
+    if _LATENCY_AGGREGATOR is not None:
+        _LATENCY_AGGREGATOR.reset_totals()
+
+
+@events.test_stop.add_listener
+def on_hdr_test_stop(environment, **kwargs):
+    """Flush the last partial window, and write the merged percentiles on the master or local runner."""
+    global _LATENCY_RECORDER, _LATENCY_SNAPSHOT_GREENLET
+    options = environment.parsed_options
+    if not options.hdr_csv:
+        return
+    if _LATENCY_RECORDER is not None:
+        _LATENCY_SNAPSHOT_GREENLET.kill()
+        send_latency_snapshot(environment, math.floor(time.time() / options.hdr_window) * options.hdr_window)
+        _LATENCY_RECORDER = None
+        _LATENCY_SNAPSHOT_GREENLET = None
+    if _LATENCY_AGGREGATOR is not None:
+        _LATENCY_AGGREGATOR.export()
+
+
+@events.quit.add_listener
+def on_hdr_quit(**kwargs):
+    """Rewrite the percentiles if worker snapshots arrived after the test stopped."""
+    if _LATENCY_AGGREGATOR is not None and _LATENCY_AGGREGATOR.updated:
+        _LATENCY_AGGREGATOR.export()
+
+
+@events.init.add_listener
+def on_results_init(environment, **kwargs):
+    """Register the message workers use to send sampled records and per-second aggregates to the master."""
+    if not isinstance(environment.runner, MasterRunner):
+        return
+
+    def on_results(environment, msg, **kwargs):
+        if _RESULT_SINK is not None:
+            _RESULT_SINK.add(msg.node_id, msg.data)
+
+    environment.runner.register_message("results", on_results)
+
+
+def send_results(environment, final: bool = False):
+    """Pass this process's recorded results to the master, or straight to the result files on a local runner."""
+    data = _RESULT_RECORDER.take(final)
+    if isinstance(environment.runner, WorkerRunner):
+        environment.runner.send_message("results", data)
+    elif _RESULT_SINK is not None:
+        _RESULT_SINK.add("local", data)
+
+
+@events.test_start.add_listener
+def on_results_test_start(environment, **kwargs):
+    """Open the result files on the master or local runner, and start recording on load generators."""
+    global _RESULT_RECORDER, _RESULT_SEND_GREENLET, _RESULT_SINK
+    options = environment.parsed_options
+    if not options.results_dir:
+        return
+    if not isinstance(environment.runner, WorkerRunner):
+        if _RESULT_SINK is not None:
+            _RESULT_SINK.close()
+        _RESULT_SINK = get_result_sink(options)
+    if not isinstance(environment.runner, MasterRunner):
+        # Warm-up traffic is left out; the stats reset that ends the window starts recording
+        _RESULT_RECORDER = ResultRecorder(
+            options.results_sample_rate, options.results_buffer_rows, recording=options.warmup_seconds <= 0
+        )
+
+    def flush_results():
+        while True:
+            gevent.sleep(options.results_flush_interval)
+            if _RESULT_RECORDER is not None:
+                send_results(environment)
+            if _RESULT_SINK is not None:
+                _RESULT_SINK.flush()
+
+    _RESULT_SEND_GREENLET = gevent.spawn(flush_results)
+
+
+@events.request.add_listener
+def on_results_request(request_type, name, response_time, response_length, exception=None, **kwargs):
+    """Add each request to this worker's per-second aggregates, and sample it as a record."""
+    if _RESULT_RECORDER is not None and response_time is not None:
+        _RESULT_RECORDER.record(request_type, name, response_time, response_length, exception)
+
+
+@events.reset_stats.add_listener
+def on_results_reset_stats(**kwargs):
+    """Leave requests from before a stats reset that have not been sent yet out of the result files."""
+    if _RESULT_RECORDER is not None:
+        _RESULT_RECORDER.reset()
+
+
+@events.test_stop.add_listener
+def on_results_test_stop(environment, **kwargs):
+    """Send everything recorded, including the current second, and write what the master has so far."""
+    global _RESULT_RECORDER, _RESULT_SEND_GREENLET
+    if _RESULT_SEND_GREENLET is not None:
+        _RESULT_SEND_GREENLET.kill()
+        _RESULT_SEND_GREENLET = None
+    if _RESULT_RECORDER is not None:
+        send_results(environment, final=True)
+        _RESULT_RECORDER = None
+    if _RESULT_SINK is not None:
+        # Workers' final sends may still be on their way, so the files are completed on quit
+        _RESULT_SINK.flush()
+
+
+@events.quit.add_listener
+def on_results_quit(**kwargs):
+    """Write the remaining results and close the files."""
+    global _RESULT_SINK
+    if _RESULT_SINK is not None:
+        _RESULT_SINK.close()
+        _RESULT_SINK = None
+
+
+@events.test_start.add_listener
+def on_client_metrics_test_start(environment, **kwargs):
+    """Start every test with empty client metrics."""
+    get_client_metrics().reset()
+
+
+@events.reset_stats.add_listener
+def on_client_metrics_reset_stats(**kwargs):
+    """Reset client metrics along with the stats, keeping startup and warm-up timings, which are only measured once."""
+    get_client_metrics().reset(keep=("startup", "warmup"))
+
+
+@events.report_to_master.add_listener
+def on_client_metrics_report(client_id, data, **kwargs):
+    """Send the client metrics recorded since this worker's last report."""
+    data["client_metrics"] = get_client_metrics().take()
+
+
+@events.worker_report.add_listener
+def on_client_metrics_worker_report(client_id, data, **kwargs):
+    """Merge a worker's client metrics on the master."""
+    if data.get("client_metrics"):
+        get_client_metrics().merge(data["client_metrics"])
+
+
+@events.quit.add_listener
+def on_client_metrics_quit(**kwargs):
+    """Log the client metrics table, and write it next to Locust's CSV files.
+
+    Done on quit rather than test stop, once the workers' final reports have reached the master.
+    """
+    if _TEST_START is None or isinstance(_TEST_START[0].runner, WorkerRunner):
+        return
+    environment = _TEST_START[0]
+    metrics = get_client_metrics()
+    metrics.log_table()
+    csv_prefix = getattr(environment.parsed_options, "csv_prefix", None)
+    if csv_prefix:
+        metrics.write_csv(f"{csv_prefix}_client_metrics.csv")
+
+
+@events.test_start.add_listener
+def on_startup_test_start(environment, **kwargs):
+    """Report how long this process took to import the locustfile, once per process."""
+    global _STARTUP_REPORTED, _TEST_START
+    _TEST_START = (environment, time.perf_counter())
+    if isinstance(environment.runner, MasterRunner) or _STARTUP_REPORTED:
+        return
+    _STARTUP_REPORTED = True
+    report_startup_metric(environment, "locustfile import (ms)", _IMPORT_TIME * 1000)
+
+
+@events.spawning_complete.add_listener
+def on_startup_spawning_complete(user_count, **kwargs):
+    """Report and log how long spawning every user took, from the start of the test."""
+    if _TEST_START is None:
+        return
+    environment, start_time = _TEST_START
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    elapsed = time.perf_counter() - start_time
+    report_startup_metric(environment, "all users spawned (ms)", elapsed * 1000)
+    logging.info(f"Spawned {user_count} users in {elapsed:.2f} s")
+
+
+def reset_warmup_stats(environment):
+    """Reset the stats at the end of the warm-up window, as the web UI does.
+
+    Firing reset_stats also resets the client metrics, keeping startup and
+    warm-up timings, and starts the HDR and result recorders.
+    """
+    environment.events.reset_stats.fire()
+    environment.runner.stats.reset_all()
+
+
+def finish_warmup(environment):
+    """Reset the master's or local runner's stats, once workers have reset theirs."""
+    global _WARMUP_UNCONFIRMED
+    _WARMUP_UNCONFIRMED = None
+    reset_warmup_stats(environment)
+    logging.info("Warm-up window ended, stats reset")
+
+
+@events.init.add_listener
+def on_warmup_init(environment, **kwargs):
+    """Register the messages that end the warm-up window on workers and confirm it to the master."""
+
+    def on_warmup_done(environment, msg, **kwargs):
+        # Drop warm-up traffic not yet sent to the master; later reports only hold steady-state traffic
+        reset_warmup_stats(environment)
+        environment.runner.send_message("warmup_reset", None)
+
+    def on_warmup_reset(environment, msg, **kwargs):
+        # Reset inline once the last worker confirms, so no steady-state report arrives in between
+        if _WARMUP_UNCONFIRMED is None:
+            return
+        _WARMUP_UNCONFIRMED.discard(msg.node_id)
+        if not _WARMUP_UNCONFIRMED:
+            finish_warmup(environment)
+
+    if isinstance(environment.runner, WorkerRunner):
+        environment.runner.register_message("warmup_done", on_warmup_done)
+    elif isinstance(environment.runner, MasterRunner):
+        environment.runner.register_message("warmup_reset", on_warmup_reset)
+
+
+def end_warmup(environment):
+    """Wait until every user has spawned and the warm-up window has passed, then reset the stats.
+
+    On the master, workers first reset their own stats and confirm. Reports
+    from a worker arrive in order, so by the time it confirms, the master
+    has merged all of that worker's warm-up traffic and can reset without
+    any of it arriving afterwards.
+    """
+    global _WARMUP_UNCONFIRMED
+    runner = environment.runner
+    while runner.state == STATE_SPAWNING:
+        gevent.sleep(0.5)
+    gevent.sleep(environment.parsed_options.warmup_seconds)
+    if not isinstance(runner, MasterRunner):
+        finish_warmup(environment)
+        return
+
+    _WARMUP_UNCONFIRMED = {worker.id for worker in runner.clients.values() if worker.state != STATE_MISSING}
+    if not _WARMUP_UNCONFIRMED:
+        finish_warmup(environment)
+        return
+    runner.send_message("warmup_done", None)
+    deadline = time.monotonic() + WARMUP_CONFIRM_TIMEOUT
+    while _WARMUP_UNCONFIRMED and time.monotonic() < deadline:
+        gevent.sleep(0.1)
+    if _WARMUP_UNCONFIRMED:
+        logging.warning(
+            f"{len(_WARMUP_UNCONFIRMED)} workers did not confirm their warm-up stats reset within "
+            f"{WARMUP_CONFIRM_TIMEOUT} s; resetting the master's stats anyway"
+        )
+        finish_warmup(environment)
+
 
-# Load the config once at startup
-config = Config('./locust_config.env')
+@events.test_start.add_listener
+def on_warmup_test_start(environment, **kwargs):
+    """On the master or local runner, start the greenlet that ends the warm-up window."""
+    global _WARMUP_GREENLET
+    if environment.parsed_options.warmup_seconds <= 0 or isinstance(environment.runner, WorkerRunner):
+        return
+    _WARMUP_GREENLET = gevent.spawn(end_warmup, environment)
 
-# Determine if we're using gRPC or HTTP based on endpoint_access_type
-USE_GRPC = config.endpoint_access_type in ["private_service_connect", "vpc_peering"]
-logging.info(f"Using gRPC mode: {USE_GRPC} based on endpoint_access_type={config.endpoint_access_type}")
 
-@events.init_command_line_parser.add_listener
-def _(parser):
-    """Add command line arguments to the Locust environment."""
-    # Add user-focused test parameters
-    parser.add_argument(
-        "--num-neighbors", 
-        type=int, 
-        default=config.num_neighbors, 
-        help="Number of nearest neighbors to find in each query"
-    )
-    
-    # Add QPS per user control
-    parser.add_argument(
-        "--qps-per-user",
-        type=int,
-        default=10,
-        help=(
-            'The QPS each user should target. Locust will try to maintain this rate, '
-            'but if latency is high, actual QPS may be lower.'
-        ),
-    )
-    
-    # Advanced parameters
-    parser.add_argument(
-        "--fraction-leaf-nodes-to-search-override",
-        type=float,
-        default=0.0,
-        help="Advanced: Fraction of leaf nodes to search (0.0-1.0). Higher values increase recall but reduce performance."
+@events.test_stop.add_listener
+def on_warmup_test_stop(environment, **kwargs):
+    """Stop the warm-up window if the test stops before it ends."""
+    global _WARMUP_GREENLET
+    if _WARMUP_GREENLET is not None:
+        _WARMUP_GREENLET.kill(block=False)
+        _WARMUP_GREENLET = None
+
+
+@events.quit.add_listener
+def on_warmup_quit(**kwargs):
+    """Log connection setup and first response latency next to steady-state query latency.
+
+    Logged on quit rather than test stop, once the workers' final stats have reached the master.
+    """
+    if _TEST_START is None:
+        return
+    environment = _TEST_START[0]
+    if isinstance(environment.runner, WorkerRunner) or environment.parsed_options.warmup_seconds <= 0:
+        return
+
+    def summary(entries) -> str:
+        requests = sum(entry.num_requests for entry in entries)
+        if not requests:
+            return "none"
+        response_times = collections.Counter()
+        for entry in entries:
+            response_times.update(entry.response_times)
+        p50 = calculate_response_time_percentile(response_times, requests, 0.5)
+        p99 = calculate_response_time_percentile(response_times, requests, 0.99)
+        return f"p50 {p50} ms, p99 {p99} ms over {requests}"
+
+    steady_state = [
+        entry for (name, method), entry in environment.runner.stats.entries.items() if is_query_entry(name, method)
+    ]
+    warmup = {row["name"]: row for row in get_client_metrics().rows() if row["kind"] == "warmup"}
+
+    def warmup_summary(name: str) -> str:
+        row = warmup.get(name)
+        if row is None:
+            return "none"
+        return f"p50 {row['p50']} ms, p99 {row['p99']} ms over {row['count']}"
+
+    logging.info(
+        f"Connection setup: {warmup_summary('connection setup (ms)')}; "
+        f"first response (full latency): {warmup_summary('first response (ms)')}; "
+        f"steady-state queries: {summary(steady_state)}"
     )
 
-@events.init.add_listener
-def on_locust_init(environment, **kwargs):
-    """Set up the host and tags based on configuration."""
-    # Determine test mode based on endpoint access type
-    is_grpc_mode = config.endpoint_access_type in ["private_service_connect", "vpc_peering"]
-    
-    # Set default tags based on endpoint access type if no tags were specified
-    if hasattr(environment.parsed_options, 'tags') and not environment.parsed_options.tags:
-        if is_grpc_mode:
-            environment.parsed_options.tags = ['grpc']
-            logging.info("Auto-setting tags to 'grpc' based on endpoint access type 'private_service_connect'")
-        else:
-            environment.parsed_options.tags = ['http']
-            logging.info(f"Auto-setting tags to 'http' based on endpoint access type '{config.endpoint_access_type}'")
-    
-    # Set host based on endpoint access type if no host was specified
-    if not environment.host:
-        if is_grpc_mode:
-            # PSC/gRPC mode
-            grpc_address = config.match_grpc_address
-            if grpc_address:
-                logging.info(f"Auto-setting host to gRPC address: {grpc_address}")
-                environment.host = grpc_address
-            else:
-                logging.warning("No MATCH_GRPC_ADDRESS found in configuration, host must be specified manually for PSC/gRPC mode")
-        else:
-            # HTTP mode
-            endpoint_host = config.endpoint_host
-            if endpoint_host:
-                host = f"https://{endpoint_host}"
-                logging.info(f"Auto-setting host to HTTP endpoint: {host}")
-                environment.host = host
-            else:
-                logging.warning("No ENDPOINT_HOST found in configuration, host must be specified manually for HTTP mode")
+
+@events.test_start.add_listener
+def on_profile_test_start(environment, **kwargs):
+    """Start the hot-path profiler on load generators, and watch the profiles on the master or local runner."""
+    global _WORKER_PROFILER, _CLIENT_BOUND_MONITOR, _PROFILE_REPORT_GREENLET
+    options = environment.parsed_options
+    if not options.profile_workers:
+        return
+    if not isinstance(environment.runner, WorkerRunner):
+        _CLIENT_BOUND_MONITOR = ClientBoundMonitor(
+            environment, options.client_bound_cpu, options.client_bound_lag_ms
+        )
+    if isinstance(environment.runner, MasterRunner):
+        return
+    sample_interval = options.profile_sample_interval if options.profile_sample_file else 0.0
+    _WORKER_PROFILER = WorkerProfiler(sample_interval=sample_interval)
+    if isinstance(environment.runner, LocalRunner):
+        # Local runs have no worker reports, so check the profile on the same interval
+        def report_profile():
+            while True:
+                gevent.sleep(WORKER_REPORT_INTERVAL)
+                _CLIENT_BOUND_MONITOR.update("local", _WORKER_PROFILER.take_report())
+
+        _PROFILE_REPORT_GREENLET = gevent.spawn(report_profile)
+
+
+@events.report_to_master.add_listener
+def on_profile_report(client_id, data, **kwargs):
+    """Send this worker's profile since its last report."""
+    if _WORKER_PROFILER is not None:
+        data["profile"] = _WORKER_PROFILER.take_report()
+
+
+@events.worker_report.add_listener
+def on_profile_worker_report(client_id, data, **kwargs):
+    """Check each worker's profile for client-bound load generation."""
+    if _CLIENT_BOUND_MONITOR is not None and "profile" in data:
+        _CLIENT_BOUND_MONITOR.update(client_id, data["profile"])
+
+
+@events.test_stop.add_listener
+def on_profile_test_stop(environment, **kwargs):
+    """Stop the profiler and write its stack samples, and log each worker's peak CPU and loop lag."""
+    global _WORKER_PROFILER, _PROFILE_REPORT_GREENLET
+    options = environment.parsed_options
+    if _PROFILE_REPORT_GREENLET is not None:
+        _PROFILE_REPORT_GREENLET.kill()
+        _PROFILE_REPORT_GREENLET = None
+    if _WORKER_PROFILER is not None:
+        sample_path = options.profile_sample_file
+        if sample_path and isinstance(environment.runner, WorkerRunner):
+            sample_path = f"{sample_path}.{os.getpid()}"
+        _WORKER_PROFILER.stop(sample_path)
+        _WORKER_PROFILER = None
+    if _CLIENT_BOUND_MONITOR is not None:
+        _CLIENT_BOUND_MONITOR.summary()
 
 # Base class with common functionality
 class BaseVectorSearchUser:
@@ -339,22 +3710,256 @@ class BaseVectorSearchUser:
         # Store parsed options needed for requests
         self.num_neighbors = environment.parsed_options.num_neighbors
         self.fraction_leaf_nodes_to_search_override = environment.parsed_options.fraction_leaf_nodes_to_search_override
+        self.queries_per_request = max(environment.parsed_options.num_embeddings_per_request, 1)
+        self.return_full_datapoint = environment.parsed_options.return_full_datapoint
+        self.crowding_neighbor_count = environment.parsed_options.crowding_neighbor_count
+        self.payload_sample_rate = environment.parsed_options.payload_sample_rate
+
+        # Parameter matrix, if any; the current cell's label is appended to request names
+        self.matrix = get_parameter_matrix(environment.parsed_options)
+        self.matrix_cell = None
+        self.matrix_label = ""
+        self.request_name_suffix = ""
+
+        # Shared query vector pool; each user cycles from its own random offset
+        self.vector_pool = get_query_vector_pool(environment.parsed_options, self.dimensions)
+        self.sample_vector_pool = environment.parsed_options.query_pool_order == "random"
+        self.vector_pool_position = random.randrange(self.vector_pool.size) if self.vector_pool else 0
+
+        # Recorded queries to replay, if any
+        self.replay = get_query_replay(environment.parsed_options)
+
+        # Decide the embedding type once, rather than on every request
+        self.embedding_mode = "replay" if self.replay is not None else resolve_embedding_mode(environment.parsed_options)
+        self.sparse_generator = None
+        if self.embedding_mode in ("sparse", "hybrid"):
+            self.sparse_generator = get_sparse_embedding_generator(environment.parsed_options)
+
+        # Query filters drawn per request, and restricts for upserted datapoints, if configured
+        self.restricts = get_restricts_generator(environment.parsed_options)
+        self.filtered = bool(environment.parsed_options.filter_selectivity)
+        self.query_filter = None
+
+        # Recall checks on a sample of dense, unfiltered queries, tracking the (pool row, vector) of each sampled query
+        self.recall_checker = None
+        if self.embedding_mode == "dense" and not self.filtered:
+            self.recall_checker = get_recall_checker(environment.parsed_options, self.vector_pool, self.dimensions)
+        self.recall_queries = None
+
+        # Upserts and removes mixed in with the queries, if any
+        self.write_ratio = environment.parsed_options.write_ratio
+        self.writer = get_datapoint_writer(environment.parsed_options) if self.write_ratio > 0 else None
+
+        # Open-loop arrival schedule, if any
+        self.environment = environment
+        self.arrival_schedule = _ARRIVAL_SCHEDULE
+
+        # Priming queries sent before this user's tasks when a warm-up window is configured
+        self.warmup = environment.parsed_options.warmup_seconds > 0
+        self.warmup_queries = environment.parsed_options.warmup_queries
+        self.warming_up = False
+
+    def update_matrix_cell(self):
+        """Apply the parameter matrix cell for the current time, returning True if it changed."""
+        if self.matrix is None:
+            return False
+        cell = self.matrix.current()
+        if cell is self.matrix_cell:
+            return False
+        self.matrix_cell = cell
+        self.num_neighbors = cell["num_neighbors"]
+        self.fraction_leaf_nodes_to_search_override = cell["fraction_leaf_nodes_to_search_override"]
+        self.return_full_datapoint = cell["return_full_datapoint"]
+        self.queries_per_request = cell["queries_per_request"]
+        self.matrix_label = " " + cell["label"]
+        return True
+
+    def next_query_filter(self):
+        """Draw the filter for the next request's queries, if filters are configured."""
+        if self.filtered:
+            with profile_section("generate"):
+                self.query_filter = self.restricts.next_filter()
+
+    def tag_request(self, name_suffix: str = None):
+        """Set the suffix appended to the names of the request about to be sent and its client-side metrics.
+
+        Queries are tagged with the parameter matrix cell, the filter's
+        selectivity and, when writes are mixed in, with whether this worker is
+        ingesting. Priming queries are tagged as warm-up traffic instead.
+        """
+        if self.warming_up:
+            name_suffix = WARMUP_SUFFIX
+        elif name_suffix is None:
+            name_suffix = self.matrix_label
+            if self.query_filter is not None:
+                name_suffix += self.query_filter["label"]
+            if self.writer is not None:
+                name_suffix += " (ingest)" if self.writer.ingest_active() else " (quiet)"
+        self.request_name_suffix = name_suffix
+        # Read by the gRPC interceptor, which runs in this user's greenlet
+        _REQUEST_CONTEXT.name_suffix = name_suffix
+
+    def should_write(self) -> bool:
+        """Decide whether this iteration upserts or removes datapoints instead of querying."""
+        if self.writer is None or self.warming_up or random.random() >= self.write_ratio:
+            return False
+        return self.writer.writes_allowed() and self.writer.acquire()
+
+    def new_datapoints(self, ids: list) -> list:
+        """Build (id, feature_vector, sparse_embedding, restricts) for each datapoint to upsert, embedded like the queries."""
+        datapoints = []
+        for datapoint_id in ids:
+            feature_vector = None if self.embedding_mode == "sparse" else self.next_feature_vector()
+            sparse_embedding = None
+            if self.sparse_generator is not None:
+                values, dimensions = self.generate_sparse_embedding()
+                sparse_embedding = {"values": values, "dimensions": dimensions}
+            restricts = self.restricts.datapoint_restricts() if self.restricts is not None else None
+            datapoints.append((datapoint_id, feature_vector, sparse_embedding, restricts))
+        return datapoints
 
     def generate_random_vector(self, dimensions):
         """Generate a random vector with the specified dimensions."""
         return [random.randint(-1000000, 1000000) for _ in range(dimensions)]
+
+    def next_vector_index(self):
+        """Return the index of the next query vector pool row to send."""
+        if self.sample_vector_pool:
+            return random.randrange(self.vector_pool.size)
+        self.vector_pool_position = (self.vector_pool_position + 1) % self.vector_pool.size
+        return self.vector_pool_position
+
+    def next_feature_vector(self):
+        """Return the next query vector, from the shared pool if one is configured."""
+        with profile_section("generate"):
+            if self.vector_pool is None:
+                index, vector = None, self.generate_random_vector(self.dimensions)
+            else:
+                index = self.next_vector_index()
+                vector = self.vector_pool.row(index)
+        if self.recall_queries is not None:
+            self.recall_queries.append((index, vector))
+        return vector
+
+    def next_batch_index(self):
+        """Return the pool row of a pre-encoded request's first query; its queries use the rows after it."""
+        index = self.next_vector_index()
+        if self.recall_queries is not None:
+            for row in range(index, index + self.queries_per_request):
+                self.recall_queries.append((row % self.vector_pool.size, self.vector_pool.row(row)))
+        return index
+
+    def start_recall_sample(self):
+        """Decide whether to check this request's recall, and if so track the queries built for it."""
+        if self.recall_checker is not None and self.recall_checker.sample():
+            self.recall_queries = []
+
+    def take_recall_queries(self):
+        """Return the queries tracked for the request just built, or None if it is not sampled."""
+        recall_queries, self.recall_queries = self.recall_queries, None
+        return recall_queries
+
+    def check_recall(self, recall_queries: list, neighbor_ids: list):
+        """Check the neighbor ids returned for each tracked query against its exact neighbors."""
+        for (pool_index, vector), ids in zip(recall_queries, neighbor_ids):
+            self.recall_checker.check(self.environment, pool_index, vector, ids, self.num_neighbors)
+
+    def wait_for_arrival(self):
+        """In open-loop mode, wait for the next scheduled arrival and return its intended start time."""
+        if self.arrival_schedule is None or self.warming_up:
+            return None
+        intended_start = self.arrival_schedule.claim()
+        while intended_start is None:
+            # No rate received from the master yet
+            gevent.sleep(0.1)
+            intended_start = self.arrival_schedule.claim()
+        delay = intended_start - time.perf_counter()
+        if delay > 0:
+            gevent.sleep(delay)
+        lag = max(time.perf_counter() - intended_start, 0.0)
+        report_metric("open-loop", "schedule lag", lag * 1000)
+        return intended_start
+
+    def warm_up(self, connect: Callable, send_query: Callable):
+        """Connect and send priming queries before this user's tasks, if a warm-up window is configured.
+
+        `connect` opens the user's connections and returns their setup times in
+        milliseconds. Connection setup and the full latency of the first
+        priming query, up to its complete response rather than its first byte,
+        are reported as warm-up metrics.
+        """
+        if not self.warmup:
+            return
+        try:
+            for connect_time in connect():
+                report_metric("warmup", "connection setup (ms)", connect_time)
+        except Exception as e:
+            logging.warning(f"Warm-up connection failed: {e}")
+            report_metric("warmup", "connection setup (ms)", 0, exception=e)
+            return
+
+        self.warming_up = True
+        try:
+            for i in range(self.warmup_queries):
+                start_time = time.perf_counter()
+                exception = None
+                try:
+                    send_query()
+                except Exception as e:
+                    # The request itself is already reported as failed
+                    exception = e
+                if i == 0:
+                    report_metric(
+                        "warmup", "first response (ms)", (time.perf_counter() - start_time) * 1000,
+                        exception=exception,
+                    )
+        finally:
+            self.warming_up = False
+
+    def report_arrival_latency(self, intended_start, exception: Exception = None):
+        """Report latency measured from the request's intended start, which includes any schedule lag."""
+        if intended_start is None:
+            return
+        report_metric(
+            "open-loop",
+            "latency from intended start",
+            (time.perf_counter() - intended_start) * 1000,
+            exception=exception,
+        )
+
+    def report_per_query(self, request_type: str, response_time: float, exception: Exception = None):
+        """Report a batched request once per query, so client metrics show per-query throughput and latency."""
+        if self.queries_per_request <= 1:
+            return
+        name = f"per query (batch of {self.queries_per_request}){self.request_name_suffix}"
+        for _ in range(self.queries_per_request):
+            report_metric(request_type, name, response_time, exception=exception)
+
+    def sample_payload(self) -> bool:
+        """Decide whether to measure the size and decode time of this response."""
+        return self.payload_sample_rate > 0 and random.random() < self.payload_sample_rate
+
+    def report_payload(self, encoding: str, size: int, decode_time: float):
+        """Report a response's size and client-side decode time as payload client metrics.
+
+        `decode_time` is in milliseconds but is reported in microseconds, since
+        most decodes take less than one.
+        """
+        report_metric("payload", f"response size (bytes){self.request_name_suffix}", size)
+        report_metric("payload", f"decode {encoding} (us){self.request_name_suffix}", decode_time * 1000)
+
+    def next_replay_record(self):
+        """Return the next replayed query record, stopping the user when the replay is exhausted."""
+        try:
+            return next(self.replay)
+        except StopIteration:
+            logging.info("Replay file exhausted, stopping user")
+            raise StopUser()
     
     def generate_sparse_embedding(self):
-        """Generate random sparse embedding based on configuration."""
-        values = [
-            random.uniform(-1.0, 1.0)
-            for _ in range(config.sparse_embedding_num_dimensions_with_values)
-        ]
-        dimensions = random.sample(
-            range(config.sparse_embedding_num_dimensions),
-            config.sparse_embedding_num_dimensions_with_values
-        )
-        return values, dimensions
+        """Return the next random sparse embedding as (values, dimensions) from the shared generator."""
+        with profile_section("generate"):
+            return self.sparse_generator.next()
 
 class VectorSearchHttpUser(FastHttpUser):
     """HTTP-based Vector Search user using FastHttpUser."""
@@ -362,103 +3967,190 @@ class VectorSearchHttpUser(FastHttpUser):
     abstract = True  # This is a abstract base class
     
     def __init__(self, environment: env.Environment):
+        init_start = time.perf_counter()
         super().__init__(environment)
         
         # Initialize base functionality
         self.base = BaseVectorSearchUser(environment)
         
-        # Set up QPS-based wait time if specified
+        # Set up QPS-based wait time if specified; in open-loop mode the arrival schedule paces requests
         user_qps = environment.parsed_options.qps_per_user
-        if user_qps > 0:
+        if self.base.arrival_schedule is not None:
+            self.wait_time = lambda: 0
+        elif user_qps > 0:
             # Use constant throughput based on QPS setting
             def wait_time_fn():
                 fn = wait_time.constant_throughput(user_qps)
                 return fn(self)
             self.wait_time = wait_time_fn
         
-        # Set up HTTP authentication
-        self.credentials, _ = google.auth.default(
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
-        self.auth_req = google.auth.transport.requests.Request()
-        self.credentials.refresh(self.auth_req)
-        self.token_refresh_time = time.time() + 3500  # Refresh after ~58 minutes
+        # Set up HTTP authentication from the worker's shared, background-refreshed token
+        self.credentials = get_shared_credentials()
         self.headers = {
-            "Authorization": "Bearer " + self.credentials.token,
+            "Authorization": self.credentials.authorization,
             "Content-Type": "application/json",
         }
         
         # Build the endpoint URL
         self.public_endpoint_url = f"/v1/projects/{self.base.project_number}/locations/us-central1/indexEndpoints/{self.base.endpoint_id_numeric}:findNeighbors"
+
+        # Upserts and removes go to the regional API rather than the index endpoint
+        if self.base.writer is not None:
+            self.index_path = f"/v1/{config.index_name}"
+            endpoint = write_endpoint(environment.parsed_options)
+            self.write_base_url = endpoint if "://" in endpoint else f"https://{endpoint}"
         
         # Build the base request
         self.request = {
             "deployedIndexId": self.base.deployed_index_id,
         }
-        self.dp = {
-            "datapointId": "0",
-        }
-        self.query = {
-            "datapoint": self.dp,
+        self.build_queries()
+
+        # Pre-encode dense request bodies if requested; matrix, filtered and sparse requests change shape, so stay on json
+        self.body_template = None
+        self.precompiled_bodies = None
+        body_mode = environment.parsed_options.http_body_mode
+        if self.base.embedding_mode != "dense" or self.base.matrix is not None or self.base.filtered:
+            body_mode = "json"
+        if body_mode != "json":
+            self.body_template = FindNeighborsBodyTemplate(self.request)
+        if body_mode == "precompiled":
+            if self.base.vector_pool is None:
+                raise ValueError("--http-body-mode precompiled requires --query-pool-size or --query-vectors-file")
+            self.precompiled_bodies = get_precompiled_bodies(self.body_template, self.base.vector_pool)
+        # The first user on a worker also pays for the shared pools, channels and clients
+        report_startup_metric(environment, "user init (ms)", (time.perf_counter() - init_start) * 1000)
+        logging.info("HTTP client initialized")
+
+    def on_start(self):
+        """Connect and send priming queries before the first task during a warm-up window."""
+        self.base.warm_up(self.connect, self.http_find_neighbors)
+
+    def connect(self) -> list:
+        """Open this user's first connection to the endpoint ahead of its requests, returning its setup time.
+
+        The connection is opened by a small request, timed up to its response,
+        so the time is TCP and TLS setup plus one round trip. It is named with
+        WARMUP_SUFFIX, so it never counts as a query and the stats reset at the
+        end of the warm-up window drops it.
+        """
+        start_time = time.perf_counter()
+        with self.client.request("GET", "/", name=f"connect{WARMUP_SUFFIX}", catch_response=True) as response:
+            connect_time = (time.perf_counter() - start_time) * 1000
+            if response.status_code == 0:
+                # No HTTP response at all, so the connection itself failed
+                response.failure(response.error)
+                raise response.error
+            # Any status means the connection is open; kept alive, it serves this user's first query
+            response.success()
+        return [connect_time]
+
+    def build_queries(self):
+        """Rebuild the base request's queries and options from the current query parameters."""
+        self.request["queries"] = [self.new_query() for _ in range(self.base.queries_per_request)]
+        if self.base.return_full_datapoint:
+            self.request["returnFullDatapoint"] = True
+        else:
+            self.request.pop("returnFullDatapoint", None)
+
+    def new_query(self):
+        """Build one query of the base request."""
+        query = {
+            "datapoint": {"datapointId": "0"},
             "neighborCount": self.base.num_neighbors,
         }
         
         # Add optional parameters if specified
         if self.base.fraction_leaf_nodes_to_search_override > 0:
-            self.query["fractionLeafNodesToSearchOverride"] = self.base.fraction_leaf_nodes_to_search_override
-            
-        self.request["queries"] = [self.query]
-        logging.info("HTTP client initialized")
-
-    def on_start(self):
-        """Called when a user starts."""
-        # Ensure token is valid at start
-        self.credentials.refresh(self.auth_req)
-        self.headers["Authorization"] = "Bearer " + self.credentials.token
-        self.token_refresh_time = time.time() + 3500
+            query["fractionLeafNodesToSearchOverride"] = self.base.fraction_leaf_nodes_to_search_override
+        if self.base.crowding_neighbor_count > 0:
+            query["perCrowdingAttributeNeighborCount"] = self.base.crowding_neighbor_count
+        return query
 
     @task
     @tag('http')
     def http_find_neighbors(self):
-        """Execute a Vector Search query using HTTP."""
-        # Check if token needs refreshing
-        if time.time() > self.token_refresh_time:
-            try:
-                self.credentials.refresh(self.auth_req)
-                self.headers["Authorization"] = "Bearer " + self.credentials.token
-                self.token_refresh_time = time.time() + 3500
-                logging.debug("OAuth token refreshed preemptively")
-            except Exception as e:
-                logging.error(f"Failed to refresh token: {str(e)}")
-            
-        # Handle sparse embedding case
-        if (config.sparse_embedding_num_dimensions > 0 and
-            config.sparse_embedding_num_dimensions_with_values > 0 and
-            config.sparse_embedding_num_dimensions_with_values <= config.sparse_embedding_num_dimensions):
-            
-            values, dimensions = self.base.generate_sparse_embedding()
-            self.request["queries"][0]["datapoint"]["sparseEmbedding"] = {
-                "values": values,
-                "dimensions": dimensions
-            }
-        else:
-            # Standard feature vector case
-            self.request["queries"][0]["datapoint"]["featureVector"] = self.base.generate_random_vector(self.base.dimensions)
-        
+        """Execute a Vector Search query using HTTP, or a write when the read/write mix picks one."""
+        if self.base.should_write():
+            self.http_write_datapoints()
+            return
+
+        # In open-loop mode, wait for this request's scheduled arrival
+        intended_start = self.base.wait_for_arrival()
+
+        # Pick up the latest token; it is refreshed in the background before expiry
+        self.headers["Authorization"] = self.credentials.authorization
+
+        # Switch to the current parameter matrix cell, if any
+        if self.base.update_matrix_cell():
+            self.build_queries()
+        self.base.next_query_filter()
+        self.base.tag_request()
+
+        body = None
+        self.base.start_recall_sample()
+
+        # Build and encode the body, timed as the serialize section when profiling
+        with profile_section("serialize"):
+            # Replay recorded queries if a replay file is configured
+            if self.base.replay is not None:
+                for query in self.request["queries"]:
+                    record = self.base.next_replay_record()
+                    datapoint = {"datapointId": "0"}
+                    if record["feature_vector"] is not None:
+                        datapoint["featureVector"] = record["feature_vector"]
+                    if record["sparse_embedding"] is not None:
+                        datapoint["sparseEmbedding"] = record["sparse_embedding"]
+                    query["datapoint"] = datapoint
+                    query["neighborCount"] = record["neighbor_count"] or self.base.num_neighbors
+            # Handle sparse embedding case, with a dense vector as well for hybrid queries
+            elif self.base.embedding_mode != "dense":
+                for query in self.request["queries"]:
+                    values, dimensions = self.base.generate_sparse_embedding()
+                    query["datapoint"]["sparseEmbedding"] = {
+                        "values": values,
+                        "dimensions": dimensions
+                    }
+                    if self.base.embedding_mode == "hybrid":
+                        query["datapoint"]["featureVector"] = self.base.next_feature_vector()
+            elif self.precompiled_bodies is not None:
+                # Standard feature vector case, pre-encoded at startup
+                body = self.precompiled_bodies[self.base.next_batch_index()]
+            elif self.body_template is not None:
+                # Standard feature vector case, spliced into the pre-encoded body
+                body = self.body_template.render(
+                    [self.base.next_feature_vector() for _ in range(self.base.queries_per_request)]
+                )
+            else:
+                # Standard feature vector case
+                for query in self.request["queries"]:
+                    query["datapoint"]["featureVector"] = self.base.next_feature_vector()
+
+            # Attach this request's filter to every query
+            if self.base.query_filter is not None:
+                restricts = restricts_to_json(self.base.query_filter)
+                for query in self.request["queries"]:
+                    query["datapoint"].pop("restricts", None)
+                    query["datapoint"].pop("numericRestricts", None)
+                    query["datapoint"].update(restricts)
+            if body is None:
+                body = json.dumps(self.request).encode()
+
+        recall_queries = self.base.take_recall_queries()
+
         # Send the request using FastHttpUser
         with self.client.request(
             "POST",
             url=self.public_endpoint_url,
-            json=self.request,
+            name=self.public_endpoint_url + self.base.request_name_suffix,
+            data=body,
             catch_response=True,
             headers=self.headers,
         ) as response:
             if response.status_code == 401:
-                # Refresh token on auth error
-                self.credentials.refresh(self.auth_req)
-                self.headers["Authorization"] = "Bearer " + self.credentials.token
-                self.token_refresh_time = time.time() + 3500
-                response.failure("Authentication failure, token refreshed")
+                # Refresh the shared token in the background on auth error
+                self.credentials.request_refresh()
+                response.failure("Authentication failure, token refresh requested")
             elif response.status_code == 403:
                 # Log detailed error for permission issues
                 error_msg = f"Permission denied: {response.text}"
@@ -468,20 +4160,81 @@ class VectorSearchHttpUser(FastHttpUser):
                 # Mark failed responses
                 response.failure(f"Failed with status code: {response.status_code}, body: {response.text}")
 
+        exception = response.request_meta["exception"]
+        self.base.report_per_query("http", response.request_meta["response_time"], exception=exception)
+        self.base.report_arrival_latency(intended_start, exception=exception)
+        if response.status_code != 200:
+            return
+
+        # Parse the body only when needed, timing the parse apart from the request's network latency
+        payload = None
+        if self.base.sample_payload():
+            start_time = time.perf_counter()
+            with profile_section("decode"):
+                payload = response.json()
+            self.base.report_payload("json", len(response.content), (time.perf_counter() - start_time) * 1000)
+        if recall_queries is not None:
+            if payload is None:
+                with profile_section("decode"):
+                    payload = response.json()
+            self.base.check_recall(recall_queries, [
+                [neighbor["datapoint"]["datapointId"] for neighbor in nearest.get("neighbors", [])]
+                for nearest in payload.get("nearestNeighbors", [])
+            ])
+
+    def http_write_datapoints(self):
+        """Upsert a batch of new datapoints, or remove a batch this worker upserted earlier."""
+        self.headers["Authorization"] = self.credentials.authorization
+        operation, ids = self.base.writer.next_operation()
+        if operation == "upsert":
+            path = f"{self.index_path}:upsertDatapoints"
+            body = {"datapoints": []}
+            for datapoint_id, feature_vector, sparse_embedding, restricts in self.base.new_datapoints(ids):
+                datapoint = {"datapointId": datapoint_id}
+                if feature_vector is not None:
+                    datapoint["featureVector"] = feature_vector
+                if sparse_embedding is not None:
+                    datapoint["sparseEmbedding"] = sparse_embedding
+                if restricts is not None:
+                    datapoint.update(restricts_to_json(restricts))
+                body["datapoints"].append(datapoint)
+        else:
+            path = f"{self.index_path}:removeDatapoints"
+            body = {"datapointIds": ids}
+
+        self.base.writer.write_started()
+        with self.client.request(
+            "POST",
+            url=self.write_base_url + path,
+            name=path,
+            json=body,
+            catch_response=True,
+            headers=self.headers,
+        ) as response:
+            if response.status_code == 401:
+                self.credentials.request_refresh()
+                response.failure("Authentication failure, token refresh requested")
+            elif response.status_code != 200:
+                response.failure(f"Failed with status code: {response.status_code}, body: {response.text}")
+        self.base.writer.write_finished(operation, ids, response.status_code == 200)
+
 class VectorSearchGrpcUser(User):
     """gRPC-based Vector Search user."""
     
     abstract = True  # This is a abstract base class
     
     def __init__(self, environment: env.Environment):
+        init_start = time.perf_counter()
         super().__init__(environment)
         
         # Initialize base functionality
         self.base = BaseVectorSearchUser(environment)
         
-        # Set up QPS-based wait time if specified
+        # Set up QPS-based wait time if specified; in open-loop mode the arrival schedule paces requests
         user_qps = environment.parsed_options.qps_per_user
-        if user_qps > 0:
+        if self.base.arrival_schedule is not None:
+            self.wait_time = lambda: 0
+        elif user_qps > 0:
             # Use constant throughput based on QPS setting
             def wait_time_fn():
                 fn = wait_time.constant_throughput(user_qps)
@@ -497,70 +4250,275 @@ class VectorSearchGrpcUser(User):
         
         logging.info(f"Using PSC/gRPC address: {self.match_grpc_address}")
             
-        # Create a gRPC channel with interceptor
-        channel = intercepted_cached_grpc_channel(
+        # Share the worker's pool of gRPC channels with interceptors
+        self.channel_pool = get_grpc_channel_pool(
             self.match_grpc_address,
             auth=False,  # PSC connections don't need auth
-            env=environment
+            environment=environment,
         )
         
-        # Create the client
-        self.grpc_client = MatchServiceClient(
-            transport=match_transports_grpc.MatchServiceGrpcTransport(
-                channel=channel
+        # The worker's clients, one per channel; each user is assigned a channel round-robin
+        self.grpc_clients = self.channel_pool.clients(environment, match_service_client)
+        self.channel_index = self.channel_pool.assign()
+        self.grpc_client = self.grpc_clients[self.channel_index]
+
+        # Upserts and removes go to the regional API over an authenticated channel, not the PSC address
+        if self.base.writer is not None:
+            write_host = write_endpoint(environment.parsed_options)
+            if ":" not in write_host:
+                write_host += ":443"
+            write_pool = get_grpc_channel_pool(write_host, auth=True, environment=environment)
+            self.index_client = write_pool.clients(environment, index_service_client)[write_pool.assign()]
+
+        # Limit outstanding requests per user when sending future-based calls
+        max_inflight = environment.parsed_options.grpc_inflight_per_user
+        self.inflight = gevent.lock.BoundedSemaphore(max_inflight) if max_inflight > 1 else None
+
+        # Build the index endpoint resource name once - use the proper format with project number
+        self.index_endpoint = f"projects/{self.base.project_number}/locations/us-central1/indexEndpoints/{self.base.endpoint_id_numeric}"
+
+        # Build raw protobuf requests up front if requested, sent as bytes through a generic stub
+        self.request_template = None
+        self.serialized_requests = None
+        request_mode = environment.parsed_options.grpc_request_mode
+        if self.base.embedding_mode != "dense" or self.base.matrix is not None or self.base.filtered:
+            request_mode = "proto-plus"
+        # Receive raw bytes when sampling payloads, so the response is decoded here rather than inside the call
+        self.raw_responses = environment.parsed_options.payload_sample_rate > 0
+        if request_mode != "proto-plus" or self.raw_responses:
+            self.find_neighbors_rpcs = self.channel_pool.clients(environment, find_neighbors_stub)
+        if request_mode != "proto-plus":
+            self.request_template = FindNeighborsRequestTemplate(
+                self.index_endpoint,
+                self.base.deployed_index_id,
+                self.base.num_neighbors,
+                self.base.fraction_leaf_nodes_to_search_override,
+                num_queries=self.base.queries_per_request,
+                return_full_datapoint=self.base.return_full_datapoint,
+                per_crowding_attribute_neighbor_count=self.base.crowding_neighbor_count,
             )
-        )
+        if request_mode == "serialized":
+            if self.base.vector_pool is None:
+                raise ValueError("--grpc-request-mode serialized requires --query-pool-size or --query-vectors-file")
+            self.serialized_requests = get_serialized_requests(self.request_template, self.base.vector_pool)
+        # The first user on a worker also pays for the shared pools, channels and clients
+        report_startup_metric(environment, "user init (ms)", (time.perf_counter() - init_start) * 1000)
         logging.info("gRPC client initialized")
 
+    def on_start(self):
+        """Connect and send priming queries before the first task during a warm-up window."""
+        self.base.warm_up(self.connect, self.grpc_find_neighbors)
+
+    def connect(self) -> list:
+        """Connect the worker's channels ahead of the first request, returning their setup times if this user did."""
+        return self.channel_pool.connect(self.environment.parsed_options.warmup_connect_timeout)
+
+    def next_channel(self):
+        """Return the index of the channel to send the next request on.
+
+        Blocking users stay on their assigned channel. Users with several
+        requests in flight cycle through the pool, skipping channels that are
+        at the stream limit.
+        """
+        if self.inflight is None:
+            return self.channel_index
+        self.channel_index = (self.channel_index + 1) % self.channel_pool.size
+        return self.channel_pool.pick(self.channel_index)
+
     @task
     @tag('grpc')
     def grpc_find_neighbors(self):
-        """Execute a Vector Search query using gRPC."""
-        # Create datapoint based on embedding type
-        if (config.sparse_embedding_num_dimensions > 0 and
-            config.sparse_embedding_num_dimensions_with_values > 0 and
-            config.sparse_embedding_num_dimensions_with_values <= config.sparse_embedding_num_dimensions):
-            # Sparse embedding case
-            values, dimensions = self.base.generate_sparse_embedding()
-            datapoint = IndexDatapoint(
-                datapoint_id='0',
-                sparse_embedding={
-                    'dimensions': dimensions,
-                    'values': values
-                }
-            )
+        """Execute a Vector Search query using gRPC, or a write when the read/write mix picks one."""
+        if self.base.should_write():
+            self.grpc_write_datapoints()
+            return
+
+        # In open-loop mode, wait for this request's scheduled arrival
+        intended_start = self.base.wait_for_arrival()
+        self.base.update_matrix_cell()
+        self.base.next_query_filter()
+        self.base.tag_request()
+        self.base.start_recall_sample()
+        with profile_section("serialize"):
+            request = self.build_request()
+            if self.raw_responses and not isinstance(request, bytes):
+                request = FindNeighborsRequest.serialize(request)
+        recall_queries = self.base.take_recall_queries()
+        # Priming queries block, so the first response is timed
+        if self.inflight is not None and not self.base.warming_up:
+            self.send_future(request, intended_start, recall_queries)
+            return
+
+        start_time = time.perf_counter()
+        try:
+            response = self.send(request)
+        except Exception as e:
+            self.base.report_per_query("grpc", (time.perf_counter() - start_time) * 1000, exception=e)
+            self.base.report_arrival_latency(intended_start, exception=e)
+            raise
+        self.base.report_per_query("grpc", (time.perf_counter() - start_time) * 1000)
+        self.base.report_arrival_latency(intended_start)
+        self.handle_response(response, recall_queries)
+
+    def handle_response(self, response, recall_queries):
+        """Decode a raw response if it is sampled or recall-checked, timing the decode for sampled ones."""
+        if isinstance(response, bytes):
+            if self.base.sample_payload():
+                size = len(response)
+                start_time = time.perf_counter()
+                with profile_section("decode"):
+                    response = FindNeighborsResponse.deserialize(response)
+                self.base.report_payload("protobuf", size, (time.perf_counter() - start_time) * 1000)
+            elif recall_queries is not None:
+                with profile_section("decode"):
+                    response = FindNeighborsResponse.deserialize(response)
+        if recall_queries is not None:
+            self.check_recall(recall_queries, response)
+
+    def grpc_write_datapoints(self):
+        """Upsert a batch of new datapoints, or remove a batch this worker upserted earlier."""
+        operation, ids = self.base.writer.next_operation()
+        # Writes are not tagged with the matrix cell or ingest state
+        self.base.tag_request("")
+        self.base.writer.write_started()
+        success = False
+        try:
+            if operation == "upsert":
+                datapoints = []
+                for datapoint_id, feature_vector, sparse_embedding, restricts in self.base.new_datapoints(ids):
+                    datapoint = IndexDatapoint(datapoint_id=datapoint_id)
+                    if feature_vector is not None:
+                        datapoint.feature_vector = feature_vector
+                    if sparse_embedding is not None:
+                        datapoint.sparse_embedding = sparse_embedding
+                    if restricts is not None:
+                        apply_restricts(datapoint, restricts)
+                    datapoints.append(datapoint)
+                self.index_client.upsert_datapoints(
+                    UpsertDatapointsRequest(index=config.index_name, datapoints=datapoints)
+                )
+            else:
+                self.index_client.remove_datapoints(
+                    RemoveDatapointsRequest(index=config.index_name, datapoint_ids=ids)
+                )
+            success = True
+        except Exception as e:
+            logging.error(f"Error in gRPC {operation}: {str(e)}")
+            raise  # The interceptor will handle the error reporting
+        finally:
+            self.base.writer.write_finished(operation, ids, success)
+
+    def check_recall(self, recall_queries, response):
+        """Check a sampled request's neighbors against its exact neighbors."""
+        self.base.check_recall(recall_queries, [
+            [neighbor.datapoint.datapoint_id for neighbor in nearest.neighbors]
+            for nearest in response.nearest_neighbors
+        ])
+
+    def send(self, request):
+        """Send a proto-plus or pre-serialized FindNeighborsRequest and wait for the response."""
+        channel_index = self.next_channel()
+        # The interceptor will handle performance metrics automatically
+        try:
+            if isinstance(request, bytes):
+                return self.find_neighbors_rpcs[channel_index](request)
+            return self.grpc_clients[channel_index].find_neighbors(request)
+        except Exception as e:
+            logging.error(f"Error in gRPC call: {str(e)}")
+            raise  # The interceptor will handle the error reporting
+
+    def send_future(self, request, intended_start, recall_queries=None):
+        """Send a FindNeighborsRequest as a future once one of this user's in-flight slots is free."""
+        self.inflight.acquire()
+        channel_index = self.next_channel()
+        start_time = time.perf_counter()
+        try:
+            if isinstance(request, bytes):
+                future = self.find_neighbors_rpcs[channel_index].future(request)
+            else:
+                future = self.grpc_clients[channel_index].transport.find_neighbors.future(request)
+        except BaseException:
+            # A call that fails to start, e.g. on a closed channel, never completes to free its slot
+            self.inflight.release()
+            raise
+
+        def on_done(future):
+            self.inflight.release()
+            exception = future.exception()
+            self.base.report_per_query("grpc", (time.perf_counter() - start_time) * 1000, exception=exception)
+            self.base.report_arrival_latency(intended_start, exception=exception)
+            if exception is None:
+                self.handle_response(future.result(), recall_queries)
+
+        # The interceptor reports the request itself when it completes
+        future.add_done_callback(on_done)
+
+    def build_request(self):
+        """Build one FindNeighborsRequest, as a proto-plus message or pre-serialized bytes."""
+        num_queries = self.base.queries_per_request
+        queries = []
+
+        # Create datapoints based on embedding type
+        if self.base.replay is not None:
+            # Replayed queries
+            for _ in range(num_queries):
+                record = self.base.next_replay_record()
+                datapoint = IndexDatapoint(datapoint_id="0")
+                if record["feature_vector"] is not None:
+                    datapoint.feature_vector = record["feature_vector"]
+                if record["sparse_embedding"] is not None:
+                    datapoint.sparse_embedding = record["sparse_embedding"]
+                queries.append(FindNeighborsRequest.Query(
+                    datapoint=datapoint,
+                    neighbor_count=record["neighbor_count"] or self.base.num_neighbors
+                ))
+        elif self.base.embedding_mode != "dense":
+            # Sparse embedding case, with a dense vector as well for hybrid queries
+            for _ in range(num_queries):
+                values, dimensions = self.base.generate_sparse_embedding()
+                datapoint = IndexDatapoint(
+                    datapoint_id='0',
+                    sparse_embedding={
+                        'dimensions': dimensions,
+                        'values': values
+                    }
+                )
+                if self.base.embedding_mode == "hybrid":
+                    datapoint.feature_vector = self.base.next_feature_vector()
+                queries.append(FindNeighborsRequest.Query(datapoint=datapoint, neighbor_count=self.base.num_neighbors))
+        elif self.serialized_requests is not None:
+            # Dense embedding case, pre-serialized at startup
+            return self.serialized_requests[self.base.next_batch_index()]
+        elif self.request_template is not None:
+            # Dense embedding case, reusing the raw protobuf request
+            return self.request_template.serialize([self.base.next_feature_vector() for _ in range(num_queries)])
         else:
             # Dense embedding case
-            datapoint = IndexDatapoint(
-                datapoint_id="0",
-                feature_vector=self.base.generate_random_vector(self.base.dimensions)
-            )
-
-        # Create a query
-        query = FindNeighborsRequest.Query(
-            datapoint=datapoint,
-            neighbor_count=self.base.num_neighbors
-        )
+            for _ in range(num_queries):
+                datapoint = IndexDatapoint(
+                    datapoint_id="0",
+                    feature_vector=self.base.next_feature_vector()
+                )
+                queries.append(FindNeighborsRequest.Query(datapoint=datapoint, neighbor_count=self.base.num_neighbors))
         
         # Add optional parameters if specified
         if self.base.fraction_leaf_nodes_to_search_override > 0:
-            query.fraction_leaf_nodes_to_search_override = self.base.fraction_leaf_nodes_to_search_override
+            for query in queries:
+                query.fraction_leaf_nodes_to_search_override = self.base.fraction_leaf_nodes_to_search_override
+        if self.base.crowding_neighbor_count > 0:
+            for query in queries:
+                query.per_crowding_attribute_neighbor_count = self.base.crowding_neighbor_count
+        if self.base.query_filter is not None:
+            for query in queries:
+                apply_restricts(query.datapoint, self.base.query_filter)
         
-        # Create the request - use the proper format with project number
-        index_endpoint = f"projects/{self.base.project_number}/locations/us-central1/indexEndpoints/{self.base.endpoint_id_numeric}"
-        
-        request = FindNeighborsRequest(
-            index_endpoint=index_endpoint,
+        # Create the request
+        return FindNeighborsRequest(
+            index_endpoint=self.index_endpoint,
             deployed_index_id=self.base.deployed_index_id,
-            queries=[query]
+            queries=queries,
+            return_full_datapoint=self.base.return_full_datapoint,
         )
-        
-        # The interceptor will handle performance metrics automatically
-        try:
-            response = self.grpc_client.find_neighbors(request)
-        except Exception as e:
-            logging.error(f"Error in gRPC call: {str(e)}")
-            raise  # The interceptor will handle the error reporting
 
 # Concrete implementation classes that dynamically set their abstract attribute
 # based on the endpoint access type (grpc vs http)
@@ -588,8 +4546,168 @@ class GrpcVectorSearchUser(VectorSearchGrpcUser):
         super().__init__(environment)
         logging.info(f"GrpcVectorSearchUser initialized with abstract={self.abstract}")
 
+# Request types of the findNeighbors calls over HTTP and gRPC
+QUERY_REQUEST_TYPES = ("POST", "grpc")
+
+# Endings of findNeighbors request names over HTTP and gRPC, before any matrix or ingest tag
+QUERY_NAME_ENDINGS = (":findNeighbors", "/FindNeighbors")
+
+
+def is_query_entry(name: str, method: str) -> bool:
+    """Whether a stats entry counts findNeighbors calls, leaving out writes and warm-up priming queries."""
+    return (
+        method in QUERY_REQUEST_TYPES
+        and name.split(" ", 1)[0].endswith(QUERY_NAME_ENDINGS)
+        and not name.endswith(WARMUP_SUFFIX)
+    )
+
+
+def query_stats_snapshot(stats) -> tuple:
+    """Return (requests, failures, response_times) summed over the stats entries of findNeighbors calls."""
+    requests = 0
+    failures = 0
+    response_times = collections.Counter()
+    for (name, method), entry in stats.entries.items():
+        if is_query_entry(name, method):
+            requests += entry.num_requests
+            failures += entry.num_failures
+            response_times.update(entry.response_times)
+    return requests, failures, response_times
+
+
+class QpsSweepShape(LoadTestShape):
+    """Step-load shape that finds the highest QPS a deployed index sustains.
+
+    A fixed number of users offers an open-loop target QPS, starting at
+    --sweep-start-qps and raised by --sweep-step-qps each time a step's p99
+    settles across consecutive windows. The sweep stops at the first step
+    whose p99 or error rate crosses its threshold, whose completed QPS falls
+    short of the target, or whose latency does not settle. The last passing
+    step is the knee, and every step is logged and written to --sweep-csv.
+    Enabled with QPS_SWEEP=true in the config.
+    """
+
+    abstract = not config.qps_sweep
+
+    COLUMNS = ["target_qps", "achieved_qps", "requests", "error_rate", "p50_ms", "p90_ms", "p99_ms",
+               "duration_s", "result"]
+
+    def __init__(self):
+        super().__init__()
+        self.options = None
+        self.target_qps = 0.0
+        self.steps = []
+        self.finished = False
+
+    def _start_step(self, target_qps: float):
+        self.target_qps = target_qps
+        self.step_start = self.get_run_time()
+        self.snapshots = [(self.step_start, query_stats_snapshot(self.runner.environment.stats))]
+        send_open_loop_rate(self.runner.environment, target_qps)
+        logging.info(f"QPS sweep step: {target_qps:.1f} QPS")
+
+    def _window_stats(self, first: int, last: int) -> dict:
+        """Summarize the requests completed between two snapshots of the current step."""
+        start_time, (start_requests, start_failures, start_times) = self.snapshots[first]
+        end_time, (end_requests, end_failures, end_times) = self.snapshots[last]
+        requests = max(end_requests - start_requests, 0)
+        response_times = end_times - start_times
+        return {
+            "target_qps": round(self.target_qps, 1),
+            "achieved_qps": round(requests / max(end_time - start_time, 1e-9), 1),
+            "requests": requests,
+            "error_rate": round(max(end_failures - start_failures, 0) / requests, 4) if requests else 0.0,
+            "p50_ms": calculate_response_time_percentile(response_times, requests, 0.5),
+            "p90_ms": calculate_response_time_percentile(response_times, requests, 0.9),
+            "p99_ms": calculate_response_time_percentile(response_times, requests, 0.99),
+            "duration_s": round(end_time - self.step_start),
+        }
+
+    def _evaluate(self):
+        """Record the step and return its result once it is stable or timed out, or None to keep holding it."""
+        options = self.options
+        step_time = self.get_run_time() - self.step_start
+        if len(self.snapshots) < 3 or step_time < options.sweep_min_step_time:
+            return None
+        previous_p99 = self._window_stats(-3, -2)["p99_ms"]
+        latest_p99 = self._window_stats(-2, -1)["p99_ms"]
+        # Locust's p99 is in whole milliseconds, so a 1 ms move would be over 10% of a p99 under 10 ms
+        stable = abs(latest_p99 - previous_p99) <= max(
+            options.sweep_stability_tolerance * previous_p99, options.sweep_stability_floor_ms
+        )
+        if not stable and step_time < options.sweep_max_step_time:
+            return None
+
+        # Judge the step on its last two windows, after the ramp to the new rate
+        step = self._window_stats(-3, -1)
+        if step["p99_ms"] > options.sweep_p99_ms:
+            step["result"] = "p99 above threshold"
+        elif step["error_rate"] > options.sweep_max_error_rate:
+            step["result"] = "error rate above threshold"
+        elif step["achieved_qps"] < options.sweep_min_achieved_ratio * self.target_qps:
+            step["result"] = "below target QPS"
+        elif not stable:
+            step["result"] = "latency not stable"
+        else:
+            step["result"] = "pass"
+        self.steps.append(step)
+        logging.info(f"QPS sweep step at {step['target_qps']} QPS: {step['result']} "
+                     f"(achieved {step['achieved_qps']} QPS, p99 {step['p99_ms']} ms, "
+                     f"error rate {step['error_rate']:.2%})")
+        return step["result"]
+
+    def finish(self):
+        """Log the per-step table and the knee point, and write the table to --sweep-csv."""
+        if self.finished or self.options is None:
+            return
+        self.finished = True
+        with open(self.options.sweep_csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.steps)
+
+        lines = [" ".join(f"{column:>14}" for column in self.COLUMNS)]
+        for step in self.steps:
+            lines.append(" ".join(f"{str(step[column]):>14}" for column in self.COLUMNS))
+        logging.info("QPS sweep steps:\n" + "\n".join(lines))
+        passing = [step for step in self.steps if step["result"] == "pass"]
+        if passing:
+            knee = passing[-1]
+            logging.info(f"QPS sweep knee point: {knee['achieved_qps']} QPS (target {knee['target_qps']}, "
+                         f"p99 {knee['p99_ms']} ms); table written to {self.options.sweep_csv}")
+        else:
+            logging.warning(f"No QPS sweep step passed; lower --sweep-start-qps. "
+                            f"Table written to {self.options.sweep_csv}")
+
+    def tick(self):
+        if self.options is None:
+            self.options = self.runner.environment.parsed_options
+            self._start_step(self.options.sweep_start_qps)
+
+        run_time = self.get_run_time()
+        if run_time - self.snapshots[-1][0] >= self.options.sweep_window:
+            self.snapshots.append((run_time, query_stats_snapshot(self.runner.environment.stats)))
+            result = self._evaluate()
+            if result is not None:
+                next_qps = self.target_qps + self.options.sweep_step_qps
+                if result != "pass" or next_qps > self.options.sweep_max_qps:
+                    self.finish()
+                    return None
+                self._start_step(next_qps)
+        return self.options.sweep_users, self.options.sweep_users
+
+
+@events.test_stop.add_listener
+def on_qps_sweep_test_stop(environment, **kwargs):
+    """Write the sweep table if the run is stopped before the sweep finishes."""
+    if isinstance(environment.shape_class, QpsSweepShape):
+        environment.shape_class.finish()
+
 # Log which class is being used
 if USE_GRPC:
     logging.info("Using gRPC mode, GrpcVectorSearchUser is active and HttpVectorSearchUser is abstract")
 else:
-    logging.info("Using HTTP mode, HttpVectorSearchUser is active and GrpcVectorSearchUser is abstract")
\ No newline at end of file
+    logging.info("Using HTTP mode, HttpVectorSearchUser is active and GrpcVectorSearchUser is abstract")
+
+_IMPORT_TIME = time.perf_counter() - _IMPORT_START_TIME
+logging.info(f"Locustfile imported in {_IMPORT_TIME * 1000:.0f} ms")
@@ -82,6 +82,8 @@ module "gke_autopilot" {
   locust_test_type = var.locust_test_type
   create_external_ip = var.create_external_ip
   min_replicas_worker = var.min_replicas_worker
+  worker_processes = var.worker_processes
+  worker_shm_size  = var.worker_shm_size
 
   # Use simplified network configuration from locals
   network                   = local.endpoint_network
@@ -170,6 +170,17 @@ resource "kubernetes_deployment" "locust_worker" {
             default_mode = "0644"
           }
         }
+        # The container runtime's /dev/shm is 64 MB, too small for a query vector pool shared by several processes
+        dynamic "volume" {
+          for_each = var.worker_processes > 1 ? [1] : []
+          content {
+            name = "${local.resource_prefix}-shm"
+            empty_dir {
+              medium     = "Memory"
+              size_limit = var.worker_shm_size
+            }
+          }
+        }
         container {
           image = var.image
           name  = "locust-worker"
@@ -178,10 +189,22 @@ resource "kubernetes_deployment" "locust_worker" {
             mount_path = "/tasks/locust_config.env"
             sub_path   = "locust_config.env"
           }
-          args = ["-f", "/tasks/locust.py", "--worker", "--master-host", "${local.resource_prefix}-master", "--tags=${var.locust_test_type}", "${local.user_class}"]
+          dynamic "volume_mount" {
+            for_each = var.worker_processes > 1 ? [1] : []
+            content {
+              name       = "${local.resource_prefix}-shm"
+              mount_path = "/dev/shm"
+            }
+          }
+          # With several processes, Locust forks one worker per core and each connects to the master
+          args = concat(
+            ["-f", "/tasks/locust.py", "--worker", "--master-host", "${local.resource_prefix}-master", "--tags=${var.locust_test_type}"],
+            var.worker_processes > 1 ? ["--processes", tostring(var.worker_processes)] : [],
+            ["${local.user_class}"]
+          )
           resources {
             requests = {
-              cpu = "1000m"
+              cpu = "${var.worker_processes * 1000}m"
             }
           }
         }
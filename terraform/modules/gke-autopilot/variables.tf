@@ -88,4 +88,16 @@ variable "min_replicas_worker" {
   description = "Minimum number of worker replicas for the Locust worker autoscaler"
   type        = number
   default     = 10
+}
+
+variable "worker_processes" {
+  description = "Locust worker processes per worker pod, one per requested CPU core"
+  type        = number
+  default     = 1
+}
+
+variable "worker_shm_size" {
+  description = "Size of the memory-backed /dev/shm mounted in worker pods with several processes"
+  type        = string
+  default     = "1Gi"
 }
\ No newline at end of file
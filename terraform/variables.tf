@@ -422,6 +422,23 @@ variable "min_replicas_worker" {
   default     = 10
 }
 
+variable "worker_processes" {
+  description = "Locust worker processes per worker pod, one per requested CPU core"
+  type        = number
+  default     = 1
+
+  validation {
+    condition     = var.worker_processes >= 1
+    error_message = "The worker_processes must be at least 1."
+  }
+}
+
+variable "worker_shm_size" {
+  description = "Size of the memory-backed /dev/shm mounted in worker pods with several processes, which share the generated query vector pool there"
+  type        = string
+  default     = "1Gi"
+}
+
 variable "locust_test_type" {
   description = "The type of load test to run (http or grpc)"
   type        = string
@@ -2,6 +2,80 @@ import subprocess
 import time
 import os
 import argparse
+import csv
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Terraform reports each resource's duration as e.g. "module.x.google_vertex_ai_index.vector_index: Creation complete
+# after 1h2m3s [id=...]"
+COMPLETE_PATTERN = re.compile(r"^(\S+): (Creation|Modifications|Destruction) complete after ((?:\d+h)?(?:\d+m)?(?:\d+s)?)")
+DURATION_PATTERN = re.compile(r"(\d+)([hms])")
+
+# Deployment phases by the type of the resource Terraform creates for them
+PHASES = {
+    "google_vertex_ai_index": "index_build",
+    "google_vertex_ai_index_endpoint": "endpoint_create",
+    "google_vertex_ai_index_endpoint_deployed_index": "index_deploy",
+}
+
+RESULT_COLUMNS = ["name", "workspace", "status", "apply_s", *PHASES.values(), "destroy_s", "resources", "vars"]
+
+# Serializes lines streamed from concurrent Terraform runs
+_PRINT_LOCK = threading.Lock()
+
+
+def parse_duration(value: str) -> int:
+    """Convert a Terraform duration such as "1h2m3s" to seconds."""
+    units = {"h": 3600, "m": 60, "s": 1}
+    return sum(int(amount) * units[unit] for amount, unit in DURATION_PATTERN.findall(value))
+
+
+def run_terraform(args: list, prefix: str = "", env: dict = None):
+    """
+    Runs a Terraform command, printing its output as it runs and timing every resource it completes.
+
+    Args:
+        args: The Terraform arguments, e.g. ["apply", "-auto-approve"].
+        prefix: Printed before each output line, to tell concurrent runs apart.
+        env: Extra environment variables for the command.
+
+    Returns:
+        A (succeeded, elapsed_seconds, resources) tuple, where resources maps each
+        completed resource address to its (seconds, finished_after_seconds) timing.
+    """
+    resources = {}
+    start_time = time.time()
+    process = subprocess.Popen(
+        ["terraform", *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env={**os.environ, **(env or {})},
+    )
+    for line in process.stdout:
+        line = line.rstrip("\n")
+        with _PRINT_LOCK:
+            print(f"{prefix}{line}", flush=True)
+        match = COMPLETE_PATTERN.match(line)
+        if match:
+            resources[match.group(1)] = (parse_duration(match.group(3)), round(time.time() - start_time))
+    process.wait()
+    elapsed = time.time() - start_time
+    if process.returncode != 0:
+        print(f"{prefix}Terraform command failed: terraform {' '.join(args)}")
+    return process.returncode == 0, elapsed, resources
+
+
+def phase_timings(resources: dict) -> dict:
+    """Sum resource durations into the deployment phases in PHASES."""
+    phases = {}
+    for address, (seconds, _) in resources.items():
+        phase = PHASES.get(address.split(".")[-2])
+        if phase is not None:
+            phases[phase] = phases.get(phase, 0) + seconds
+    return phases
 
 
 def deploy_vector_search_index(
@@ -21,46 +95,136 @@ def deploy_vector_search_index(
         The deployment time in seconds, or None if an error occurred.
     """
 
-    try:
-        # 1. Terraform Init
-        print(f"Initializing Terraform...")
-        result = subprocess.run(
-            ["terraform", "init"], capture_output=True, text=True, check=True
-        )
-        print(result.stdout)
-
-        # 2. Terraform Apply (targeted)
-        print(f"Deploying index...")
-
-        tf_var_args = []
-        for key, value in tf_vars.items():
-            tf_var_args.append("-var")
-            tf_var_args.append(f"{key}={value}")
-
-        start_time = time.time()
-        result = subprocess.run(
-            [
-                "terraform",
-                "apply",
-                "-auto-approve",
-                "-target=" + index_resource_address,  # Correct resource address
-            ]
-            + tf_var_args,  # Correctly pass variables
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        end_time = time.time()
-        print(result.stdout)
-        deployment_time = end_time - start_time
-        print(f"Index deployment time: {deployment_time:.2f} seconds")
+    # 1. Terraform Init
+    print("Initializing Terraform...")
+    if not run_terraform(["init", "-no-color"])[0]:
+        return None
+
+    # 2. Terraform Apply (targeted)
+    print("Deploying index...")
 
-        return deployment_time
+    tf_var_args = []
+    for key, value in tf_vars.items():
+        tf_var_args.append("-var")
+        tf_var_args.append(f"{key}={value}")
 
-    except subprocess.CalledProcessError as e:
-        print(f"Error during Terraform execution:\n{e.stderr}")
-        print(f"Terraform command failed: {e.cmd}")  # Print the exact command
+    succeeded, deployment_time, resources = run_terraform(
+        [
+            "apply",
+            "-auto-approve",
+            "-no-color",
+            "-target=" + index_resource_address,  # Correct resource address
+        ]
+        + tf_var_args  # Correctly pass variables
+    )
+    if not succeeded:
         return None
+    for phase, seconds in phase_timings(resources).items():
+        print(f"{phase}: {seconds} seconds")
+    print(f"Index deployment time: {deployment_time:.2f} seconds")
+
+    return deployment_time
+
+
+def benchmark_deployments(
+    index_resource_address: str,
+    configs: list,
+    tf_vars: dict,
+    results_path: str,
+    workspace_prefix: str = "bench",
+    max_parallel: int = 0,
+    destroy: bool = False,
+):
+    """
+    Deploys several index configurations concurrently, each in its own Terraform workspace, and
+    writes per-phase timings to a CSV file.
+    Assumes the script is run from within the Terraform directory.
+
+    Args:
+        index_resource_address: The Terraform resource address to apply for each configuration.
+        configs: A list of {"name": ..., "vars": {...}} configurations.
+        tf_vars: Terraform variables shared by every configuration; a configuration's own vars win.
+        results_path: The CSV file to write, with one row per configuration.
+        workspace_prefix: Prefix of the workspace, and deployment_id, of each configuration.
+        max_parallel: Configurations deployed at once, or 0 for all of them.
+        destroy: Whether to destroy each configuration's resources after timing its deployment.
+
+    Returns:
+        The result rows, one per configuration.
+    """
+    print("Initializing Terraform...")
+    if not run_terraform(["init", "-no-color"])[0]:
+        return []
+
+    # Create the workspaces up front, since selecting one changes the directory's current workspace
+    current_workspace = subprocess.run(
+        ["terraform", "workspace", "show"], capture_output=True, text=True, check=True
+    ).stdout.strip()
+    existing = subprocess.run(
+        ["terraform", "workspace", "list"], capture_output=True, text=True, check=True
+    ).stdout.replace("*", " ").split()
+    for config in configs:
+        workspace = f"{workspace_prefix}-{config['name']}"
+        if workspace not in existing:
+            subprocess.run(["terraform", "workspace", "new", workspace], capture_output=True, text=True, check=True)
+    subprocess.run(["terraform", "workspace", "select", current_workspace], capture_output=True, text=True, check=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+
+    def deploy(config: dict) -> dict:
+        name = config["name"]
+        workspace = f"{workspace_prefix}-{name}"
+        config_vars = {"deployment_id": workspace, **tf_vars, **config.get("vars", {})}
+        # A var file keeps lists, maps and numbers typed, which -var strings would not
+        var_file = os.path.abspath(f"{results_path}.{name}.tfvars.json")
+        with open(var_file, "w") as f:
+            json.dump(config_vars, f, indent=2)
+
+        # TF_WORKSPACE selects the workspace for this process alone, so runs do not share state
+        env = {"TF_WORKSPACE": workspace}
+        prefix = f"[{name}] "
+        succeeded, apply_time, resources = run_terraform(
+            ["apply", "-auto-approve", "-no-color", f"-target={index_resource_address}", f"-var-file={var_file}"],
+            prefix=prefix,
+            env=env,
+        )
+        row = {
+            "name": name,
+            "workspace": workspace,
+            "status": "deployed" if succeeded else "failed",
+            "apply_s": round(apply_time),
+            **phase_timings(resources),
+            "resources": json.dumps(resources),
+            "vars": json.dumps(config.get("vars", {})),
+        }
+        if destroy:
+            destroyed, destroy_time, _ = run_terraform(
+                ["destroy", "-auto-approve", "-no-color", f"-target={index_resource_address}", f"-var-file={var_file}"],
+                prefix=prefix,
+                env=env,
+            )
+            row["destroy_s"] = round(destroy_time)
+            if not destroyed:
+                row["status"] += ", destroy failed"
+        print(f"{prefix}Finished in {apply_time:.0f} seconds: {row['status']}")
+        return row
+
+    with ThreadPoolExecutor(max_workers=max_parallel or len(configs)) as executor:
+        rows = list(executor.map(deploy, configs))
+
+    with open(results_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"{'config':<24} {'status':<10} {'apply s':>8} " + " ".join(f"{phase + ' s':>18}" for phase in PHASES.values()))
+    for row in rows:
+        print(
+            f"{row['name']:<24} {row['status']:<10} {row['apply_s']:>8} "
+            + " ".join(f"{str(row.get(phase, '-')):>18}" for phase in PHASES.values())
+        )
+    print(f"Results written to {results_path}")
+    return rows
 
 
 if __name__ == "__main__":
@@ -78,6 +242,37 @@ if __name__ == "__main__":
         action="append",
         help="Terraform variables (e.g., --var index_name=my-index-1 --var region=us-central1).",
     )
+    parser.add_argument(
+        "--benchmark",
+        type=str,
+        help=(
+            'JSON file with a list of configurations to deploy concurrently, e.g. [{"name": "small", '
+            '"vars": {"index_shard_size": "SHARD_SIZE_SMALL"}}]. --var values apply to every configuration.'
+        ),
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        default="deployment_benchmark.csv",
+        help="CSV file for the benchmark's per-phase timings.",
+    )
+    parser.add_argument(
+        "--workspace-prefix",
+        type=str,
+        default="bench",
+        help="Prefix of each benchmark configuration's Terraform workspace and deployment_id.",
+    )
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        default=0,
+        help="Benchmark configurations deployed at once; 0 deploys all of them together.",
+    )
+    parser.add_argument(
+        "--destroy",
+        action="store_true",
+        help="Destroy each benchmark configuration's resources after its deployment is timed.",
+    )
 
     args = parser.parse_args()
 
@@ -88,9 +283,22 @@ if __name__ == "__main__":
             key, value = var_str.split("=", 1)  # Split on the first '=' only
             tf_vars[key] = value
 
-    deployment_duration = deploy_vector_search_index(
-        args.index_resource_address, tf_vars
-    )
+    if args.benchmark:
+        with open(args.benchmark) as f:
+            configs = json.load(f)
+        benchmark_deployments(
+            args.index_resource_address,
+            configs,
+            tf_vars,
+            args.results,
+            workspace_prefix=args.workspace_prefix,
+            max_parallel=args.max_parallel,
+            destroy=args.destroy,
+        )
+    else:
+        deployment_duration = deploy_vector_search_index(
+            args.index_resource_address, tf_vars
+        )
 
-    if deployment_duration is not None:
-        print(f"Deployment time: {deployment_duration:.2f} seconds")
\ No newline at end of file
+        if deployment_duration is not None:
+            print(f"Deployment time: {deployment_duration:.2f} seconds")
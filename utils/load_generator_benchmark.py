@@ -0,0 +1,174 @@
+"""End-to-end throughput benchmark of the Locust load generator against the mock MatchService.
+
+Starts utils/mock_match_service.py, runs locust_tests/locust.py in one headless
+Locust process (one worker core) against it for each protocol and user count,
+and reports the requests per second that process sustains per core of CPU it
+uses. The mock server runs in its own processes, so the numbers measure the
+load generator's ceiling rather than the server's.
+
+Usage:
+    python utils/load_generator_benchmark.py
+    python utils/load_generator_benchmark.py --protocols grpc --users 10 50 200 --dimensions 768
+    python utils/load_generator_benchmark.py --latency-ms 5 -- --grpc-request-mode serialized --query-pool-size 1000
+
+Arguments after `--` are passed to Locust.
+"""
+
+import argparse
+import csv
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCUSTFILE_PATH = os.path.join(UTILS_DIR, "..", "locust_tests", "locust.py")
+MOCK_SERVER_PATH = os.path.join(UTILS_DIR, "mock_match_service.py")
+
+ENDPOINT_ACCESS_TYPES = {"http": "public", "grpc": "private_service_connect"}
+QUERY_NAME_ENDINGS = (":findNeighbors", "/FindNeighbors")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_ports(ports: list, timeout: float = 30.0):
+    """Wait until something accepts connections on every port."""
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Mock server did not start listening on port {port}")
+                time.sleep(0.2)
+
+
+def start_mock_server(args, http_port: int, grpc_port: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [
+            sys.executable, MOCK_SERVER_PATH,
+            "--http-port", str(http_port),
+            "--grpc-port", str(grpc_port),
+            "--processes", str(args.server_processes),
+            "--latency-distribution", args.latency_distribution,
+            "--latency-ms", str(args.latency_ms),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    wait_for_ports([http_port, grpc_port])
+    return server
+
+
+def read_stats(csv_prefix: str) -> dict:
+    """Return the findNeighbors row from a Locust stats CSV, and the profiled CPU use from its client metrics."""
+    result = {"requests_per_s": 0.0, "failures": 0, "p50_ms": 0.0, "p99_ms": 0.0, "cpu_percent": 0.0}
+    with open(f"{csv_prefix}_stats.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            if row["Name"].endswith(QUERY_NAME_ENDINGS):
+                result["requests_per_s"] += float(row["Requests/s"])
+                result["failures"] += int(row["Failure Count"])
+                result["p50_ms"] = max(result["p50_ms"], float(row["50%"]))
+                result["p99_ms"] = max(result["p99_ms"], float(row["99%"]))
+    with open(f"{csv_prefix}_client_metrics.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            if row["kind"] == "worker-profile" and row["name"].startswith("cpu"):
+                result["cpu_percent"] = float(row["mean"])
+    return result
+
+
+def run_locust(args, protocol: str, users: int, http_port: int, grpc_port: int, locust_args: list) -> dict:
+    """Run one headless Locust process against the mock server and return its stats."""
+    with tempfile.TemporaryDirectory() as run_dir:
+        with open(os.path.join(run_dir, "locust_config.env"), "w") as f:
+            f.write(
+                f"INDEX_DIMENSIONS={args.dimensions}\n"
+                "PROJECT_NUMBER=0\n"
+                "INDEX_ENDPOINT_ID=0\n"
+                "DEPLOYED_INDEX_ID=benchmark\n"
+                f"ENDPOINT_ACCESS_TYPE={ENDPOINT_ACCESS_TYPES[protocol]}\n"
+                "MOCK_SERVER_ADDRESS=127.0.0.1\n"
+                f"MOCK_SERVER_HTTP_PORT={http_port}\n"
+                f"MOCK_SERVER_GRPC_PORT={grpc_port}\n"
+            )
+        subprocess.run(
+            [
+                sys.executable, "-m", "locust",
+                "-f", LOCUSTFILE_PATH,
+                "--headless",
+                "-u", str(users),
+                "-r", str(users),
+                "-t", f"{args.duration}s",
+                "--qps-per-user", "0",
+                "--num-neighbors", str(args.num_neighbors),
+                # Measure from when all users are running, with the process's CPU use alongside
+                "--reset-stats",
+                "--profile-workers",
+                "--csv", os.path.join(run_dir, "run"),
+                "--only-summary",
+                *locust_args,
+            ],
+            cwd=run_dir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        return read_stats(os.path.join(run_dir, "run"))
+
+
+def print_results(results: list):
+    """Print a table of (protocol, users, stats) results."""
+    print(f"{'protocol':<9} {'users':>6} {'req/s':>10} {'CPU %':>7} {'req/s/core':>11} "
+          f"{'p50 ms':>7} {'p99 ms':>7} {'failures':>9}")
+    for protocol, users, stats in results:
+        cpu = stats["cpu_percent"] / 100
+        per_core = stats["requests_per_s"] / cpu if cpu > 0 else 0.0
+        print(
+            f"{protocol:<9} {users:>6} {stats['requests_per_s']:>10,.0f} {stats['cpu_percent']:>7.0f} "
+            f"{per_core:>11,.0f} {stats['p50_ms']:>7.0f} {stats['p99_ms']:>7.0f} {stats['failures']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the load generator's maximum requests per second per core against the mock server."
+    )
+    parser.add_argument("--protocols", nargs="+", choices=["http", "grpc"], default=["http", "grpc"])
+    parser.add_argument("--users", nargs="+", type=int, default=[50], help="User counts to run for each protocol.")
+    parser.add_argument("--duration", type=int, default=30, help="Seconds per run after all users have spawned.")
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--num-neighbors", type=int, default=20)
+    parser.add_argument(
+        "--server-processes", type=int, default=2,
+        help="Mock server processes; raise this if the server becomes the bottleneck.",
+    )
+    parser.add_argument(
+        "--latency-distribution", type=str, default="none",
+        choices=["none", "fixed", "uniform", "exponential", "lognormal"],
+    )
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean synthetic server latency.")
+    args, locust_args = parser.parse_known_args()
+    if locust_args[:1] == ["--"]:
+        locust_args = locust_args[1:]
+
+    http_port, grpc_port = free_port(), free_port()
+    server = start_mock_server(args, http_port, grpc_port)
+    results = []
+    try:
+        for protocol in args.protocols:
+            for users in args.users:
+                results.append((protocol, users, run_locust(args, protocol, users, http_port, grpc_port, locust_args)))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"Load generator throughput against the mock MatchService, {args.dimensions} dimensions, "
+          f"{args.num_neighbors} neighbors, one Locust process")
+    print_results(results)
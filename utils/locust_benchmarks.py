@@ -0,0 +1,339 @@
+"""Microbenchmarks for the per-request hot path of locust_tests/locust.py.
+
+Each benchmark runs a code path from the locustfile in a tight loop on a single
+core and reports its throughput per second of CPU time, so changes to the
+load generator can be compared without a deployed index.
+
+Usage:
+    python utils/locust_benchmarks.py http-body --dimensions 768
+    python utils/locust_benchmarks.py grpc-request --dimensions 768
+    python utils/locust_benchmarks.py interceptor --num-neighbors 20
+    python utils/locust_benchmarks.py sparse-embedding --sparse-dimensions 10000 --sparse-values 200
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+import types
+
+# Imported before the locustfile so gevent monkey-patches ssl before google.auth loads it
+import locust  # noqa: F401
+import grpc
+
+LOCUSTFILE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "locust_tests", "locust.py"
+)
+
+
+def load_locustfile(dimensions: int):
+    """Import locust_tests/locust.py as a module, using a throwaway config for `dimensions`."""
+    with tempfile.TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, "locust_config.env"), "w") as f:
+            f.write(
+                f"INDEX_DIMENSIONS={dimensions}\n"
+                "PROJECT_NUMBER=0\n"
+                "INDEX_ENDPOINT_ID=0\n"
+                "DEPLOYED_INDEX_ID=benchmark\n"
+                "ENDPOINT_ACCESS_TYPE=public\n"
+            )
+        cwd = os.getcwd()
+        os.chdir(config_dir)
+        try:
+            spec = importlib.util.spec_from_file_location("locustfile", LOCUSTFILE_PATH)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            os.chdir(cwd)
+    # The config is public, so the gRPC types the benchmarks use are not imported with the module
+    module.load_grpc_modules()
+    return module
+
+
+def measure(fn, duration: float):
+    """
+    Calls `fn` repeatedly for `duration` seconds of CPU time.
+
+    Args:
+        fn: A callable returning the number of bytes it produced.
+        duration: CPU seconds to run for.
+
+    Returns:
+        A (calls, total_bytes, cpu_seconds) tuple.
+    """
+    calls = 0
+    total_bytes = 0
+    start = time.process_time()
+    deadline = start + duration
+    while True:
+        for _ in range(100):
+            total_bytes += fn()
+        calls += 100
+        now = time.process_time()
+        if now >= deadline:
+            return calls, total_bytes, now - start
+
+
+def print_results(results: list):
+    """Print a table of (name, calls, bytes, cpu_seconds) results, relative to the first row."""
+    baseline_rate = results[0][1] / results[0][3]
+    print(f"{'path':<28} {'calls/s/core':>14} {'MB/s/core':>12} {'bytes/call':>12} {'speedup':>9}")
+    for name, calls, total_bytes, cpu_seconds in results:
+        rate = calls / cpu_seconds
+        print(
+            f"{name:<28} {rate:>14,.0f} {total_bytes / cpu_seconds / 1e6:>12.1f} "
+            f"{total_bytes / calls:>12,.0f} {rate / baseline_rate:>8.1f}x"
+        )
+
+
+def benchmark_http_body(args):
+    """Compare the default json.dumps request path against pre-encoded findNeighbors bodies."""
+    locustfile = load_locustfile(args.dimensions)
+    pool = locustfile.QueryVectorPool.generate(args.pool_size, args.dimensions, seed=0)
+    request = {
+        "deployedIndexId": "benchmark",
+        "queries": [
+            {
+                "datapoint": {"datapointId": "0"},
+                "neighborCount": args.num_neighbors,
+            }
+        ],
+    }
+    template = locustfile.FindNeighborsBodyTemplate(request)
+    bodies = template.precompile(pool)
+    datapoint = request["queries"][0]["datapoint"]
+    position = [0]
+
+    def next_index():
+        position[0] = (position[0] + 1) % pool.size
+        return position[0]
+
+    def json_random_vector():
+        # The default path: a fresh random vector, with the whole request encoded by json.dumps
+        datapoint["featureVector"] = locustfile.BaseVectorSearchUser.generate_random_vector(None, args.dimensions)
+        return len(json.dumps(request).encode())
+
+    def json_pool_vector():
+        datapoint["featureVector"] = pool.row(next_index())
+        return len(json.dumps(request).encode())
+
+    def template_pool_vector():
+        return len(template.render([pool.row(next_index())]))
+
+    def precompiled_body():
+        return len(bodies[next_index()])
+
+    results = []
+    for name, fn in [
+        ("json, random vector", json_random_vector),
+        ("json, pool vector", json_pool_vector),
+        ("template, pool vector", template_pool_vector),
+        ("precompiled body", precompiled_body),
+    ]:
+        results.append((name,) + measure(fn, args.duration))
+    print(f"findNeighbors body encoding, {args.dimensions} dimensions, pool of {args.pool_size}")
+    print_results(results)
+
+
+def benchmark_grpc_request(args):
+    """Compare proto-plus FindNeighborsRequest construction against raw and pre-serialized protobuf."""
+    locustfile = load_locustfile(args.dimensions)
+    pool = locustfile.QueryVectorPool.generate(args.pool_size, args.dimensions, seed=0)
+    index_endpoint = "projects/0/locations/us-central1/indexEndpoints/0"
+    template = locustfile.FindNeighborsRequestTemplate(index_endpoint, "benchmark", args.num_neighbors)
+    requests = template.precompile(pool)
+    position = [0]
+
+    def next_index():
+        position[0] = (position[0] + 1) % pool.size
+        return position[0]
+
+    def proto_plus_request():
+        # The default path: proto-plus wrappers built and serialized for every call
+        datapoint = locustfile.IndexDatapoint(datapoint_id="0", feature_vector=pool.row(next_index()))
+        query = locustfile.FindNeighborsRequest.Query(datapoint=datapoint, neighbor_count=args.num_neighbors)
+        request = locustfile.FindNeighborsRequest(
+            index_endpoint=index_endpoint, deployed_index_id="benchmark", queries=[query]
+        )
+        return len(locustfile.FindNeighborsRequest.serialize(request))
+
+    def protobuf_request():
+        return len(template.serialize([pool.row(next_index())]))
+
+    def serialized_request():
+        return len(requests[next_index()])
+
+    results = []
+    for name, fn in [
+        ("proto-plus", proto_plus_request),
+        ("protobuf template", protobuf_request),
+        ("pre-serialized", serialized_request),
+    ]:
+        results.append((name,) + measure(fn, args.duration))
+    print(f"FindNeighborsRequest construction, {args.dimensions} dimensions, pool of {args.pool_size}")
+    print_results(results)
+
+
+def benchmark_interceptor(args):
+    """Compare LocustInterceptor's per-call overhead with full, sampled and no response sizing."""
+    locustfile = load_locustfile(args.dimensions)
+    from google.cloud.aiplatform_v1 import FindNeighborsResponse
+
+    neighbors = [
+        FindNeighborsResponse.Neighbor(
+            datapoint=locustfile.IndexDatapoint(datapoint_id=str(i)), distance=float(i)
+        )
+        for i in range(args.num_neighbors)
+    ]
+    message = FindNeighborsResponse(
+        nearest_neighbors=[FindNeighborsResponse.NearestNeighbors(id="0", neighbors=neighbors)]
+    )
+
+    class CompletedCall:
+        """Stands in for the outcome grpc returns from a finished unary call."""
+
+        def done(self):
+            return True
+
+        def result(self):
+            return message
+
+    class FailedCall(CompletedCall):
+        """Stands in for a finished unary call that failed, whose result() raises."""
+
+        def result(self):
+            raise grpc.RpcError("Injected failure")
+
+    call = CompletedCall()
+    call_details = types.SimpleNamespace(method=locustfile._FIND_NEIGHBORS_METHOD)
+    reported = [0, None]
+
+    def fire(response_length, exception=None, **kwargs):
+        reported[0] = response_length
+        reported[1] = exception
+
+    # Measures the interceptor alone, without Locust's stats bookkeeping behind the request event
+    environment = types.SimpleNamespace(events=types.SimpleNamespace(request=types.SimpleNamespace(fire=fire)))
+
+    def continuation(details, request):
+        return call
+
+    # Failed calls must be reported as failures whether or not responses are sized
+    for size_sample_rate in (1.0, 0.01, 0):
+        interceptor = locustfile.LocustInterceptor(environment=environment, size_sample_rate=size_sample_rate)
+        interceptor.intercept_unary_unary(lambda details, request: FailedCall(), call_details, None)
+        if not isinstance(reported[1], grpc.RpcError):
+            raise AssertionError(f"Failed call reported as a success with size sample rate {size_sample_rate}")
+
+    def no_interceptor():
+        continuation(call_details, None).result()
+        return 0
+
+    def intercepted(size_sample_rate):
+        interceptor = locustfile.LocustInterceptor(environment=environment, size_sample_rate=size_sample_rate)
+
+        def fn():
+            interceptor.intercept_unary_unary(continuation, call_details, None)
+            return reported[0]
+        return fn
+
+    results = []
+    for name, fn in [
+        ("size every response", intercepted(1.0)),
+        ("size 1 in 100", intercepted(0.01)),
+        ("no sizing", intercepted(0)),
+        ("no interceptor", no_interceptor),
+    ]:
+        results.append((name,) + measure(fn, args.duration))
+    print(f"LocustInterceptor per-call overhead, {args.num_neighbors} neighbors per response")
+    print_results(results)
+    no_interceptor_cost = results[-1][3] / results[-1][1]
+    for name, calls, _, cpu_seconds in results[:-1]:
+        print(f"{name}: {(cpu_seconds / calls - no_interceptor_cost) * 1e6:.2f} us of CPU per call")
+
+
+def benchmark_sparse_embedding(args):
+    """Compare per-request random.sample sparse embeddings against the batched NumPy generator."""
+    locustfile = load_locustfile(args.dimensions)
+    generator = locustfile.SparseEmbeddingGenerator(
+        args.sparse_dimensions, args.sparse_values, batch_size=args.batch_size, seed=0
+    )
+
+    def python_random():
+        # The previous path: a Python list of uniforms and random.sample over the vocabulary per request
+        values = [random.uniform(-1.0, 1.0) for _ in range(args.sparse_values)]
+        dimensions = random.sample(range(args.sparse_dimensions), args.sparse_values)
+        return len(values) + len(dimensions)
+
+    def numpy_batches():
+        values, dimensions = generator.next()
+        return len(values) + len(dimensions)
+
+    results = []
+    for name, fn in [
+        ("random.sample per request", python_random),
+        ("numpy batches", numpy_batches),
+    ]:
+        results.append((name,) + measure(fn, args.duration))
+    print(
+        f"Sparse embedding generation, {args.sparse_values} of {args.sparse_dimensions} dimensions, "
+        f"batches of {args.batch_size} (bytes column counts list entries)"
+    )
+    print_results(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Locust load generator's per-request hot path."
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    http_body_parser = subparsers.add_parser(
+        "http-body", help="HTTP findNeighbors body encoding."
+    )
+    http_body_parser.add_argument("--dimensions", type=int, default=768)
+    http_body_parser.add_argument("--num-neighbors", type=int, default=20)
+    http_body_parser.add_argument("--pool-size", type=int, default=1000)
+    http_body_parser.add_argument(
+        "--duration", type=float, default=2.0, help="CPU seconds per measured path."
+    )
+    http_body_parser.set_defaults(func=benchmark_http_body)
+
+    grpc_request_parser = subparsers.add_parser(
+        "grpc-request", help="gRPC FindNeighborsRequest construction and serialization."
+    )
+    grpc_request_parser.add_argument("--dimensions", type=int, default=768)
+    grpc_request_parser.add_argument("--num-neighbors", type=int, default=20)
+    grpc_request_parser.add_argument("--pool-size", type=int, default=1000)
+    grpc_request_parser.add_argument(
+        "--duration", type=float, default=2.0, help="CPU seconds per measured path."
+    )
+    grpc_request_parser.set_defaults(func=benchmark_grpc_request)
+
+    interceptor_parser = subparsers.add_parser(
+        "interceptor", help="LocustInterceptor overhead per unary call."
+    )
+    interceptor_parser.add_argument("--dimensions", type=int, default=768)
+    interceptor_parser.add_argument("--num-neighbors", type=int, default=20)
+    interceptor_parser.add_argument(
+        "--duration", type=float, default=2.0, help="CPU seconds per measured path."
+    )
+    interceptor_parser.set_defaults(func=benchmark_interceptor)
+
+    sparse_parser = subparsers.add_parser(
+        "sparse-embedding", help="Random sparse embedding generation."
+    )
+    sparse_parser.add_argument("--dimensions", type=int, default=768)
+    sparse_parser.add_argument("--sparse-dimensions", type=int, default=10000)
+    sparse_parser.add_argument("--sparse-values", type=int, default=200)
+    sparse_parser.add_argument("--batch-size", type=int, default=1024)
+    sparse_parser.add_argument(
+        "--duration", type=float, default=2.0, help="CPU seconds per measured path."
+    )
+    sparse_parser.set_defaults(func=benchmark_sparse_embedding)
+
+    args = parser.parse_args()
+    args.func(args)
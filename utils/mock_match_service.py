@@ -0,0 +1,280 @@
+"""Stand-in Vector Search MatchService for benchmarking the load generator without a deployed index.
+
+Serves MatchService.FindNeighbors over gRPC and :findNeighbors over HTTP/1.1,
+with synthetic latency, injected errors and configurable response sizes.
+Responses are encoded once per shape and reused, so the server spends its CPU
+on parsing requests and the load generator stays the bottleneck. Point
+locust_tests/locust.py at it with MOCK_SERVER_ADDRESS in locust_config.env.
+
+Usage:
+    python utils/mock_match_service.py
+    python utils/mock_match_service.py --latency-distribution lognormal --latency-ms 5 --error-rate 0.001
+    python utils/mock_match_service.py --processes 4 --neighbors 100 --response-dimensions 768
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import random
+import signal
+
+import grpc
+from google.cloud.aiplatform_v1 import FindNeighborsRequest, FindNeighborsResponse
+
+_FIND_NEIGHBORS_REQUEST = FindNeighborsRequest.pb()
+_FIND_NEIGHBORS_RESPONSE = FindNeighborsResponse.pb()
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+                500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class LatencyModel:
+    """Draws synthetic response latencies in seconds with a given mean."""
+
+    def __init__(self, distribution: str = "none", mean_ms: float = 0.0, sigma: float = 0.5):
+        self.distribution = distribution if mean_ms > 0 else "none"
+        self.mean = mean_ms / 1000
+        # Lognormal location giving the requested mean for shape `sigma`
+        self.sigma = sigma
+        self.mu = math.log(self.mean) - sigma ** 2 / 2 if self.mean > 0 else 0.0
+
+    def sample(self) -> float:
+        if self.distribution == "fixed":
+            return self.mean
+        if self.distribution == "uniform":
+            return random.uniform(0, 2 * self.mean)
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.mean)
+        if self.distribution == "lognormal":
+            return random.lognormvariate(self.mu, self.sigma)
+        return 0.0
+
+
+class MockMatchService:
+    """Builds FindNeighbors responses and decides each call's latency and outcome."""
+
+    def __init__(self, latency: LatencyModel, error_rate: float = 0.0, neighbors: int = 0,
+                 response_dimensions: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.neighbors = neighbors
+        self.response_dimensions = response_dimensions
+        self.protobuf_responses = {}
+        self.json_responses = {}
+
+    def response_shape(self, num_queries: int, neighbor_count: int, query_dimensions: int,
+                       full_datapoint: bool) -> tuple:
+        """Return (queries, neighbors per query, vector dimensions per neighbor) for a request."""
+        neighbors = self.neighbors or neighbor_count or 10
+        dimensions = self.response_dimensions or (query_dimensions if full_datapoint else 0)
+        return num_queries, neighbors, dimensions
+
+    def protobuf_response(self, shape: tuple) -> bytes:
+        response = self.protobuf_responses.get(shape)
+        if response is None:
+            num_queries, neighbors, dimensions = shape
+            message = _FIND_NEIGHBORS_RESPONSE()
+            for query in range(num_queries):
+                nearest = message.nearest_neighbors.add(id=str(query))
+                for i in range(neighbors):
+                    neighbor = nearest.neighbors.add(distance=i / neighbors)
+                    neighbor.datapoint.datapoint_id = str(i)
+                    neighbor.datapoint.feature_vector.extend([0.5] * dimensions)
+            response = self.protobuf_responses[shape] = message.SerializeToString()
+        return response
+
+    def json_response(self, shape: tuple) -> bytes:
+        response = self.json_responses.get(shape)
+        if response is None:
+            num_queries, neighbors, dimensions = shape
+            nearest_neighbors = []
+            for query in range(num_queries):
+                nearest = []
+                for i in range(neighbors):
+                    datapoint = {"datapointId": str(i)}
+                    if dimensions:
+                        datapoint["featureVector"] = [0.5] * dimensions
+                    nearest.append({"datapoint": datapoint, "distance": i / neighbors})
+                nearest_neighbors.append({"id": str(query), "neighbors": nearest})
+            response = self.json_responses[shape] = json.dumps({"nearestNeighbors": nearest_neighbors}).encode()
+        return response
+
+    async def delay(self) -> bool:
+        """Wait out the call's synthetic latency, and return whether the call should fail."""
+        delay = self.latency.sample()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+async def serve_grpc(service: MockMatchService, host: str, port: int, error_code: grpc.StatusCode):
+    """Serve FindNeighbors on raw bytes, so requests are parsed once and responses never re-encoded."""
+
+    async def find_neighbors(request: bytes, context):
+        message = _FIND_NEIGHBORS_REQUEST.FromString(request)
+        queries = message.queries
+        shape = service.response_shape(
+            len(queries),
+            queries[0].neighbor_count if queries else 0,
+            len(queries[0].datapoint.feature_vector) if queries else 0,
+            message.return_full_datapoint,
+        )
+        if await service.delay():
+            await context.abort(error_code, "Injected error")
+        return service.protobuf_response(shape)
+
+    handler = grpc.method_handlers_generic_handler(
+        "google.cloud.aiplatform.v1.MatchService",
+        {"FindNeighbors": grpc.unary_unary_rpc_method_handler(find_neighbors)},
+    )
+    server = grpc.aio.server(options=[("grpc.so_reuseport", 1)])
+    server.add_generic_rpc_handlers((handler,))
+    server.add_insecure_port(f"{host}:{port}")
+    await server.start()
+    logging.info(f"Serving gRPC FindNeighbors on {host}:{port}")
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(None)
+
+
+async def serve_http(service: MockMatchService, host: str, port: int, error_status: int):
+    """Serve :findNeighbors over keep-alive HTTP/1.1 connections with Content-Length bodies."""
+
+    async def write_response(writer, status: int, body: bytes, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Error')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                keep_alive = headers.get("connection", "").lower() != "close"
+
+                path = request_line.split(" ")[1] if " " in request_line else ""
+                if not path.split("?")[0].endswith(":findNeighbors"):
+                    await write_response(writer, 404, b'{"error": {"code": 404}}', keep_alive)
+                else:
+                    try:
+                        request = json.loads(body)
+                        queries = request.get("queries", [])
+                        datapoint = queries[0].get("datapoint", {}) if queries else {}
+                        shape = service.response_shape(
+                            len(queries),
+                            int(queries[0].get("neighborCount", 0)) if queries else 0,
+                            len(datapoint.get("featureVector", [])),
+                            bool(request.get("returnFullDatapoint")),
+                        )
+                    except (ValueError, AttributeError, TypeError):
+                        await write_response(writer, 400, b'{"error": {"code": 400}}', keep_alive)
+                        continue
+                    if await service.delay():
+                        body = json.dumps({"error": {"code": error_status, "message": "Injected error"}}).encode()
+                        await write_response(writer, error_status, body, keep_alive)
+                    else:
+                        await write_response(writer, 200, service.json_response(shape), keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_connection, host, port, reuse_port=True)
+    logging.info(f"Serving HTTP :findNeighbors on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def run(args):
+    """Run the gRPC and HTTP servers in this process until interrupted."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    service = MockMatchService(
+        LatencyModel(args.latency_distribution, args.latency_ms, args.latency_sigma),
+        error_rate=args.error_rate,
+        neighbors=args.neighbors,
+        response_dimensions=args.response_dimensions,
+    )
+
+    async def serve():
+        servers = []
+        if args.grpc_port:
+            servers.append(serve_grpc(service, args.host, args.grpc_port, grpc.StatusCode[args.grpc_error_code]))
+        if args.http_port:
+            servers.append(serve_http(service, args.host, args.http_port, args.http_error_status))
+        serving = asyncio.gather(*servers)
+        # Stop cleanly on SIGTERM, so the main process exits normally and multiprocessing stops its children
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a mock Vector Search MatchService over gRPC and HTTP."
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--grpc-port", type=int, default=8500, help="gRPC port, or 0 to disable gRPC.")
+    parser.add_argument("--http-port", type=int, default=8080, help="HTTP port, or 0 to disable HTTP.")
+    parser.add_argument(
+        "--processes", type=int, default=1,
+        help="Server processes sharing the ports, so the server outpaces the load generator under test.",
+    )
+    parser.add_argument(
+        "--latency-distribution", type=str, default="none",
+        choices=["none", "fixed", "uniform", "exponential", "lognormal"],
+        help="Distribution of the synthetic latency added to every call.",
+    )
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean synthetic latency in milliseconds.")
+    parser.add_argument(
+        "--latency-sigma", type=float, default=0.5,
+        help="Shape of the lognormal distribution; larger values give a longer tail.",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail.")
+    parser.add_argument(
+        "--grpc-error-code", type=str, default="UNAVAILABLE",
+        choices=[code.name for code in grpc.StatusCode if code != grpc.StatusCode.OK],
+    )
+    parser.add_argument("--http-error-status", type=int, default=503)
+    parser.add_argument(
+        "--neighbors", type=int, default=0,
+        help="Neighbors returned per query. 0 returns each query's neighbor count.",
+    )
+    parser.add_argument(
+        "--response-dimensions", type=int, default=0,
+        help=(
+            "Feature vector length returned with every neighbor. 0 returns vectors the size of the "
+            "query's only when the request asks for full datapoints."
+        ),
+    )
+    args = parser.parse_args()
+
+    # Processes are spawned rather than forked, since gRPC does not survive a fork after it starts
+    context = multiprocessing.get_context("spawn")
+    children = [context.Process(target=run, args=(args,), daemon=True) for _ in range(args.processes - 1)]
+    for child in children:
+        child.start()
+    run(args)